@@ -79,6 +79,8 @@ class User(dict):
         dict.__init__(self, *a, **k)
 
         self.permissions: dict[str, bool] | set[str] = {}
+        # True if the user or __guest__ has __all_permissions__
+        self.all_permissions = False
         self.limits: dict[str, int | float] = {}
         self.token: str | None = None
 
@@ -102,6 +104,14 @@ Users = {}
 # https://stackoverflow.com/questions/18605294/is-devises-token-authenticatable-secure
 tokenHashes: dict[bytes, User] = {}
 
+# Incremented on any change to users, tokens, or permissions, so
+# anything caching who a request belongs to knows to look again.
+authVersion = 0
+
+# Precomputed by generateUserPermissions
+guestPermissions: frozenset[str] = frozenset()
+guestAllPermissions = False
+
 with open(os.path.join(directories.datadir, "defaultusersettings.yaml")) as f:
     defaultusersettings = yaml.load(f, Loader=yaml.SafeLoader)
 
@@ -201,6 +211,7 @@ def changeUsername(old, new) -> None:
         # the actual user object
         Users[new] = Users.pop(old)
         Users[new]["username"] = new
+        clearCredentialCache(old)
         dumpDatabase()
 
 
@@ -210,6 +221,7 @@ def changePassword(user, newpassword, useSystem=False) -> None:
         raise ValueError("Password cannot be longer than 256 bytes")
 
     with lock:
+        clearCredentialCache(user)
         if useSystem:
             Users[user]["password"] = "system"  # pragma: allowlist secret
             dumpDatabase()
@@ -238,6 +250,7 @@ def removeUser(user) -> None:
     global tokenHashes
     with lock:
         x = Users.pop(user)
+        clearCredentialCache(user)
         # If the user has a token, delete that too
         if x.token in Tokens:
             Tokens.pop(x.token)
@@ -317,6 +330,7 @@ def loadFromData(
 
         Users.clear()
         Groups.clear()
+        clearCredentialCache()
 
         Groups.update(temp["groups"])
 
@@ -419,6 +433,21 @@ def generateUserPermissions(username: None = None) -> None:
             # Speed up by using a set
             Users[i].permissions = set(newp)
 
+        global guestPermissions, guestAllPermissions
+        if "__guest__" in Users:
+            guestPermissions = frozenset(Users["__guest__"].permissions)
+        else:
+            guestPermissions = frozenset()
+        guestAllPermissions = "__all_permissions__" in guestPermissions
+
+        # So permission checks are a single set lookup
+        for i in Users:
+            Users[i].all_permissions = guestAllPermissions or (
+                "__all_permissions__" in Users[i].permissions
+            )
+
+        authChanged()
+
 
 def addLinuxSystemUser() -> None:
     """
@@ -526,6 +555,76 @@ def userLogin(username, password) -> str:
         return "failure"
 
 
+# Credentials that recently passed userLogin, so clients that send HTTP Basic
+# auth on every request don't pay for a full password check every time.
+# Keyed by an HMAC of the username and password with the local secret,
+# never by the password itself.
+CREDENTIAL_CACHE_TIME = 300
+CREDENTIAL_CACHE_SIZE = 256
+
+# Maps credential digest to (digest, username, expiry)
+credentialCache: dict[bytes, tuple[bytes, str, float]] = {}
+
+
+def _credential_digest(username: str, password: str) -> bytes:
+    return hmac.digest(
+        __local_secret,
+        usr_bytes(username, "utf8") + b"\x00" + usr_bytes(password, "utf8"),
+        "sha256",
+    )
+
+
+def authChanged() -> None:
+    "Invalidate anything cached about who requests belong to"
+    global authVersion
+    with lock:
+        authVersion += 1
+
+
+def clearCredentialCache(username: str | None = None) -> None:
+    """Forget cached verified credentials for one user, or everyone.
+    Must be called whenever a password, username or token changes."""
+    with lock:
+        authChanged()
+        if username is None:
+            credentialCache.clear()
+            return
+        for i in [i for i, v in credentialCache.items() if v[1] == username]:
+            del credentialCache[i]
+
+
+def cachedUserLogin(username: str, password: str) -> str:
+    """Like userLogin, but credentials that succeeded within the last
+    CREDENTIAL_CACHE_TIME seconds are accepted without checking the
+    password again. Returns the user's token, or "failure"."""
+    d = _credential_digest(username, password)
+    now = time.monotonic()
+
+    x = credentialCache.get(d)
+    if x and hmac.compare_digest(x[0], d) and x[2] > now:
+        with lock:
+            # It could have been invalidated since we looked
+            if credentialCache.get(d) is x and username in Users:
+                t = Users[username].token
+                if t:
+                    return t
+
+    t = userLogin(username, password)
+    if t == "failure":
+        return t
+
+    with lock:
+        if len(credentialCache) >= CREDENTIAL_CACHE_SIZE:
+            for i in [i for i, v in credentialCache.items() if v[2] <= now]:
+                del credentialCache[i]
+        # Still full, evict the oldest
+        while len(credentialCache) >= CREDENTIAL_CACHE_SIZE:
+            del credentialCache[next(iter(credentialCache))]
+
+        credentialCache[d] = (d, username, now + CREDENTIAL_CACHE_TIME)
+    return t
+
+
 def checkTokenPermission(token, permission) -> bool:
     """return true if the user associated with token has the permission"""
     global tokenHashes
@@ -631,6 +730,7 @@ def assignNewToken(user: str, logout_old: bool = True) -> None:
         x = base64.b64encode(os.urandom(24)).decode()
 
         if logout_old:
+            clearCredentialCache(user)
             to_rm = []
             for i in tokenHashes:
                 u = tokenHashes[i]
@@ -683,6 +783,8 @@ def setUserSetting(user, setting, value) -> None:
             user["settings"] = {}
 
         Users[un]["settings"][setting] = value
+        # allow-cors changes who requests belong to
+        authChanged()
         dumpDatabase()
 
 
@@ -741,37 +843,9 @@ def canUserDoThis(user: str, permission: str) -> bool:
 
     if permission == "__guest__":
         return True
-    if user not in Users:
-        if (
-            "__guest__" in Users
-            and permission in Users["__guest__"].permissions
-        ):
-            return True
-        else:
-            if (
-                "__guest__" in Users
-                and "__all_permissions__" in Users["__guest__"].permissions
-            ):
-                return True
-
-        return False
-
-    if permission in Users[user].permissions:
-        return True
 
-    if "__all_permissions__" in Users[user].permissions:
-        return True
-
-    if (
-        "__guest__" in Users
-        and "__all_permissions__" in Users["__guest__"].permissions
-    ):
-        return True
-
-    if (
-        "__guest__" in Users
-        and "__all_permissions__" in Users["__guest__"].permissions
-    ):
-        return True
+    u = Users.get(user)
+    if u is None:
+        return guestAllPermissions or permission in guestPermissions
 
-    return False
+    return u.all_permissions or permission in u.permissions
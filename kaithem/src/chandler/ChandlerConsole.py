@@ -309,6 +309,15 @@ class ChandlerConsole(console_abc.Console_ABC):
                     framerate=float(u[i].get("framerate", 44)),
                     number=int(u[i].get("number", 0)),
                 )
+            elif u[i]["type"] == "sacn":
+                # Empty interface means the universe's multicast address
+                universeObjects[i] = universes.ArtNetUniverse(
+                    i,
+                    channels=int(u[i].get("channels", 128)),
+                    address="sacn://" + u[i].get("interface", ""),
+                    framerate=float(u[i].get("framerate", 44)),
+                    number=int(u[i].get("number", 1)),
+                )
             elif u[i]["type"] == "dummy":
                 universeObjects[i] = universes.Universe(
                     i, count=int(u[i].get("channels", 128))
@@ -6,6 +6,7 @@ from scullery import messagebus
 from kaithem.api import lifespan
 
 from . import ChandlerConsole, core, group_lighting, universes
+from .frame_scheduler import FrameScheduler, get_configured_frame_rate
 
 logger = core.logger
 soundLock = threading.Lock()
@@ -58,6 +59,8 @@ run = [True]
 
 frame_wait = threading.Event()
 
+scheduler = FrameScheduler(get_configured_frame_rate())
+
 
 def cl_loop():
     global lastrendered
@@ -70,6 +73,7 @@ def cl_loop():
     while run[0]:
         frame_number += 1
         core.started_frame_number = frame_number
+        scheduler.begin_frame()
         t = time.time()
         changed = {}
         full_repaint = False
@@ -84,25 +88,30 @@ def cl_loop():
                     u_cache = universes.getUniverses()
                     full_repaint = True
                     u_cache_time = t
+                    # Rate changes are rare, piggyback on the cache refresh
+                    scheduler.target_hz = get_configured_frame_rate()
 
                 do_gui_push = False
                 # Only needed when we don't know length in advance
-                # so it doesn't need fast response its just a fallback
-                if t - lastrendered > 1 / 3:
+                # so it doesn't need fast response its just a fallback.
+                # When we are falling behind, back off and give the time
+                # to rendering instead.
+                if t - lastrendered > (1 if scheduler.overrunning else 1 / 3):
                     pollsounds()
                     do_gui_push = True
                     lastrendered = t
 
-                for b in core.boards.values():
-                    poll_board_groups(b)
-                    if do_gui_push:
-                        b.cl_gui_push(u_cache)
+                with scheduler.stage("group_poll"):
+                    for b in core.boards.values():
+                        poll_board_groups(b)
+                        if do_gui_push:
+                            b.cl_gui_push(u_cache)
 
             # The pre-render step has to
             # happen before we start compositing on the layers
 
             # TODO the boards count can change
-            with core.cl_context:
+            with core.cl_context, scheduler.stage("composite"):
                 with group_lighting.render_loop_lock:
                     for b in core.boards.values():
                         c = group_lighting.composite_layers_from_board(
@@ -110,7 +119,8 @@ def cl_loop():
                         )
                         changed.update(c)
 
-            group_lighting.do_output(changed, u_cache)
+            with scheduler.stage("output"):
+                group_lighting.do_output(changed, u_cache)
 
             # Don't go to the next frame until all events and tasks from this frame are done
             # But if the action queue is empty, we skip the step
@@ -119,11 +129,12 @@ def cl_loop():
                 queue_wait = True
                 core.serialized_async_with_core_lock(frame_wait.set)
 
-            core.process_next_frame_actions()
+            with scheduler.stage("next_frame_actions"):
+                core.process_next_frame_actions()
 
-            # Sleep happens at the end, ideally the next frame actions could be done before rendering
-            # and we could save some latency.
-            time.sleep(1 / 60)
+            # Sleep until the deadline for the next frame, so the
+            # frame period doesn't depend on how long rendering took.
+            scheduler.wait_for_next_frame()
 
             if queue_wait:
                 # Don't go to the next frame until all events and tasks from this frame are done
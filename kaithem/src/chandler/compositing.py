@@ -0,0 +1,260 @@
+"""Compositing engine that keeps every universe's values in one
+preallocated 2D buffer and blends each group onto all the universes
+it touches in one vectorized pass.
+
+Everything here is protected by the render loop lock.
+"""
+
+from __future__ import annotations
+
+import traceback
+from typing import TYPE_CHECKING
+
+import numpy
+import numpy.typing
+
+if TYPE_CHECKING:
+    from .fadecanvas import LightingLayer
+    from .groups import Group
+    from .universes import Universe
+
+
+class CompositingBuffer:
+    """One row per universe, one column per channel.  Rows are padded to
+    the widest universe.  Each universe's values and alphas attributes
+    are views into its row, so output code that reads them
+    does not need to know about the buffer.
+
+    Scratch space for blending is allocated along with the buffer,
+    so compositing a frame does not allocate any new arrays
+    unless the set of universes changes.
+    """
+
+    def __init__(self):
+        self.rows: dict[str, int] = {}
+        self._signature: list[tuple[str, int, int]] = []
+        self._bound_snapshot: dict[str, Universe] | None = None
+        self._universe_objects: list[Universe] = []
+        self._allocate(0, 0)
+
+    def _allocate(self, count: int, width: int):
+        shape = (count, width)
+        self.values: numpy.typing.NDArray[numpy.float64] = numpy.zeros(shape)
+        self.alphas: numpy.typing.NDArray[numpy.float64] = numpy.zeros(shape)
+
+        # Scratch space, sliced to the number of rows a group touches
+        self._bg = numpy.zeros(shape)
+        self._bg_alphas = numpy.zeros(shape)
+        self._layer_values = numpy.zeros(shape)
+        self._layer_alphas = numpy.zeros(shape)
+        self._fade = numpy.zeros(shape)
+        self._tmp = numpy.zeros(shape)
+        self._hue_mask = numpy.zeros(shape, dtype=bool)
+        self._mask = numpy.zeros(shape, dtype=bool)
+
+    def bind(self, universes_snapshot: dict[str, Universe]):
+        """Make sure every universe in the snapshot has a row,
+        reallocating if the set of universes changed.
+        Current values are preserved across reallocation."""
+        if universes_snapshot is self._bound_snapshot:
+            return
+
+        signature = [
+            (name, id(u), len(u.values))
+            for name, u in universes_snapshot.items()
+        ]
+
+        if signature != self._signature:
+            objs = list(universes_snapshot.values())
+            width = max([len(u.values) for u in objs], default=0)
+            self._allocate(len(objs), width)
+            self.rows = {}
+
+            for row, (name, u) in enumerate(universes_snapshot.items()):
+                self.rows[name] = row
+                self._bind_row(row, u)
+
+            self._signature = signature
+            self._universe_objects = objs
+
+        self._bound_snapshot = universes_snapshot
+
+    def _bind_row(self, row: int, universe: Universe):
+        count = len(universe.values)
+        self.values[row, :count] = universe.values
+        self.alphas[row, :count] = universe.alphas[:count]
+        universe.values = self.values[row, :count]
+        universe.alphas = self.alphas[row, :count]
+
+    def check_views(self, names: list[str]):
+        """Rebind any universe whose values were replaced
+        by something other than its view into the buffer."""
+        for name in names:
+            row = self.rows[name]
+            u = self._universe_objects[row]
+            if u.values.base is not self.values or (
+                u.alphas.base is not self.alphas
+            ):
+                self._bind_row(row, u)
+
+    def reset(self, names: list[str]):
+        "Zero the values and alphas of the named universes in one pass"
+        rows = [self.rows[i] for i in names if i in self.rows]
+        if rows:
+            self.values[rows] = 0
+            self.alphas[rows] = 0
+
+    def composite_group(
+        self,
+        group: Group,
+        layer: LightingLayer,
+        names: list[str],
+        universes_snapshot: dict[str, Universe],
+    ):
+        """Blend the group's rendered layer onto the named universes,
+        which must all be in the layer and bound to this buffer."""
+        k = len(names)
+        if not k:
+            return
+
+        rows = [self.rows[i] for i in names]
+
+        bg = self._bg[:k]
+        bg_alphas = self._bg_alphas[:k]
+        layer_values = self._layer_values[:k]
+        layer_alphas = self._layer_alphas[:k]
+        hue_mask = self._hue_mask[:k]
+
+        numpy.take(self.values, rows, axis=0, out=bg)
+        numpy.take(self.alphas, rows, axis=0, out=bg_alphas)
+
+        for n, name in enumerate(names):
+            u = universes_snapshot[name]
+            count = len(u.values)
+
+            if name in layer.sparse:
+                sp = layer.sparse[name]
+                layer_values[n] = 0
+                layer_alphas[n] = 0
+                if sp.size <= count:
+                    layer_values[n, sp.indices] = sp.values
+                    layer_alphas[n, sp.indices] = sp.alphas
+            else:
+                # Layers made before a universe was resized may not match
+                used = min(count, len(layer.values[name]))
+                layer_values[n, :used] = layer.values[name][:used]
+                layer_values[n, used:] = 0
+                layer_alphas[n, :used] = layer.alphas[name][:used]
+                layer_alphas[n, used:] = 0
+            hue_mask[n, :count] = u.hueBlendMask[:count]
+            hue_mask[n, count:] = False
+
+            # The universe may need to know when it's current fade should
+            # end, if it handles fading in a different way.
+            # This will look really bad for complex things, to try and
+            # reduce them to a series of fades, but we just do the best
+            # we can, and assume there's mostly only 1 group at a time
+            # affecting things
+            u.fadeEndTime = max(
+                u.fadeEndTime, group.cue.fade_in + group.entered_cue
+            )
+
+        bm = group.lighting_manager.blend
+
+        if bm == "normal":
+            self._blend_normal(k, group.alpha)
+        elif bm in ("HTP", "inhibit"):
+            self._blend_htp_inhibit(k, group.alpha, bm == "HTP")
+        elif bm == "gel" or bm == "multiply":
+            if group.alpha:
+                self._blend_multiply(k, group.alpha)
+        elif group.lighting_manager._blend:
+            self._blend_custom(k, names, universes_snapshot, group)
+
+        self.values[rows] = bg
+        self.alphas[rows] = bg_alphas
+
+    def _blend_normal(self, k: int, alpha: float):
+        bg = self._bg[:k]
+        bg_alphas = self._bg_alphas[:k]
+        fade = self._fade[:k]
+        tmp = self._tmp[:k]
+        mask = self._mask[:k]
+
+        # Hue channels with nothing behind them are treated
+        # as fully opaque.
+        numpy.equal(bg_alphas, 0.0, out=mask)
+        numpy.logical_and(mask, self._hue_mask[:k], out=mask)
+        numpy.maximum(mask, alpha, out=fade)
+        fade *= self._layer_alphas[:k]
+
+        # bg * (1 - fade) + values * fade
+        numpy.subtract(self._layer_values[:k], bg, out=tmp)
+        tmp *= fade
+        bg += tmp
+
+        # Essentially calculate remaining light percent,
+        # then multiply layers and convert back to alpha
+        numpy.subtract(1.0, bg_alphas, out=tmp)
+        tmp *= fade
+        bg_alphas += tmp
+
+    def _blend_htp_inhibit(self, k: int, alpha: float, htp: bool):
+        fade = self._fade[:k]
+        tmp = self._tmp[:k]
+
+        numpy.multiply(self._layer_alphas[:k], alpha, out=fade)
+        numpy.multiply(self._layer_values[:k], fade, out=tmp)
+        if htp:
+            numpy.maximum(self._bg[:k], tmp, out=self._bg[:k])
+        else:
+            numpy.minimum(self._bg[:k], tmp, out=self._bg[:k])
+        numpy.greater(fade, 0, out=self._bg_alphas[:k])
+
+    def _blend_multiply(self, k: int, alpha: float):
+        bg = self._bg[:k]
+        fade = self._fade[:k]
+        tmp = self._tmp[:k]
+
+        numpy.multiply(self._layer_alphas[:k], alpha, out=fade)
+
+        # COMPLETELY incorrect, but we don't use alpha for that much,
+        # and the real math Is complicated. #TODO
+        numpy.greater(fade, 0, out=self._bg_alphas[:k])
+
+        numpy.multiply(bg, self._layer_values[:k], out=tmp)
+        tmp *= alpha / 255
+        numpy.subtract(1.0, fade, out=fade)
+        bg *= fade
+        bg += tmp
+
+    def _blend_custom(
+        self,
+        k: int,
+        names: list[str],
+        universes_snapshot: dict[str, Universe],
+        group: Group,
+    ):
+        # Plugin blend modes work one universe at a time
+        blend = group.lighting_manager._blend
+        for n, name in enumerate(names):
+            count = len(universes_snapshot[name].values)
+            try:
+                result = blend.frame(
+                    name,
+                    self._bg[n, :count],
+                    self._layer_values[n, :count],
+                    self._layer_alphas[n, :count],
+                    group.alpha,
+                )
+                self._bg[n, :count] = result
+                # Also incorrect-ish, but treating modified vals
+                # as fully opaque is good enough.
+                numpy.greater(
+                    self._layer_alphas[n, :count] * group.alpha,
+                    0,
+                    out=self._bg_alphas[n, :count],
+                )
+            except Exception:
+                print("Error in blend function")
+                print(traceback.format_exc())
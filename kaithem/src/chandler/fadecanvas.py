@@ -9,15 +9,141 @@ import numpy.typing
 if typing.TYPE_CHECKING:
     from .universes import Universe
 
+# Universes where no more than this fraction of channels are set
+# get stored as sparse channel lists when rendering
+SPARSE_FILL_RATIO = 0.25
+
+
+class SparseChannels:
+    """The set channels of one universe, as parallel arrays of
+    sorted channel indices, values, and alphas."""
+
+    __slots__ = ("alphas", "indices", "size", "values")
+
+    def __init__(
+        self,
+        size: int,
+        indices: numpy.typing.NDArray[numpy.intp],
+        values: numpy.typing.NDArray[numpy.float64],
+        alphas: numpy.typing.NDArray[numpy.float64],
+    ):
+        assert len(indices) == len(values) == len(alphas)
+        self.size = size
+        self.indices = indices
+        self.values = values
+        self.alphas = alphas
+
+    def gather(
+        self, indices: numpy.typing.NDArray[numpy.intp]
+    ) -> tuple[
+        numpy.typing.NDArray[numpy.float64],
+        numpy.typing.NDArray[numpy.float64],
+    ]:
+        """Values and alphas at the given sorted channel indices,
+        with zeros for channels that are not set"""
+        if not len(self.indices):
+            return numpy.zeros(len(indices)), numpy.zeros(len(indices))
+        pos = numpy.searchsorted(self.indices, indices)
+        pos = numpy.minimum(pos, len(self.indices) - 1)
+        found = self.indices[pos] == indices
+        return (
+            numpy.where(found, self.values[pos], 0.0),
+            numpy.where(found, self.alphas[pos], 0.0),
+        )
+
+    def to_dense(
+        self,
+    ) -> tuple[
+        numpy.typing.NDArray[numpy.float64],
+        numpy.typing.NDArray[numpy.float64],
+    ]:
+        v = numpy.zeros(self.size)
+        a = numpy.zeros(self.size)
+        v[self.indices] = self.values
+        a[self.indices] = self.alphas
+        return v, a
+
+    def copy(self) -> SparseChannels:
+        return SparseChannels(
+            self.size,
+            self.indices.copy(),
+            self.values.copy(),
+            self.alphas.copy(),
+        )
+
 
 class LightingLayer:
+    """Per universe values and alphas for a group.
+
+    Universes are normally stored as dense arrays in values and alphas,
+    which callers may modify directly, as long as they call invalidate()
+    for the universe afterwards.
+
+    Layers produced by fade_in store universes with few channels set
+    in sparse instead, which the compositor scatters directly.
+    """
+
     def __init__(self, ll: LightingLayer | None = None):
         self.values: dict[str, numpy.typing.NDArray[numpy.float64]] = {}
         self.alphas: dict[str, numpy.typing.NDArray[numpy.float64]] = {}
+        self.sparse: dict[str, SparseChannels] = {}
+
+        # Cached indices of dense channels with nonzero alpha
+        self._active: dict[str, numpy.typing.NDArray[numpy.intp]] = {}
 
         if ll:
             self.values = copy.deepcopy(ll.values)
             self.alphas = copy.deepcopy(ll.alphas)
+            self.sparse = {i: ll.sparse[i].copy() for i in ll.sparse}
+
+    def universes(self) -> list[str]:
+        "Every universe in the layer, dense or sparse"
+        return list(self.values) + list(self.sparse)
+
+    def invalidate(self, universe: str | None = None):
+        "Call after directly modifying the dense arrays"
+        if universe is None:
+            self._active.clear()
+        else:
+            self._active.pop(universe, None)
+
+    def active_channels(
+        self, universe: str
+    ) -> numpy.typing.NDArray[numpy.intp]:
+        "Sorted indices of channels with nonzero alpha"
+        if universe in self.sparse:
+            return self.sparse[universe].indices
+        if universe not in self._active:
+            self._active[universe] = numpy.flatnonzero(
+                self.alphas[universe] > 0
+            )
+        return self._active[universe]
+
+    def size(self, universe: str) -> int:
+        if universe in self.sparse:
+            return self.sparse[universe].size
+        return len(self.values[universe])
+
+    def gather(
+        self, universe: str, indices: numpy.typing.NDArray[numpy.intp]
+    ) -> tuple[
+        numpy.typing.NDArray[numpy.float64],
+        numpy.typing.NDArray[numpy.float64],
+    ]:
+        "Values and alphas at the given sorted channel indices"
+        if universe in self.sparse:
+            return self.sparse[universe].gather(indices)
+        return self.values[universe][indices], self.alphas[universe][indices]
+
+    def to_dense(
+        self, universe: str
+    ) -> tuple[
+        numpy.typing.NDArray[numpy.float64],
+        numpy.typing.NDArray[numpy.float64],
+    ]:
+        if universe in self.sparse:
+            return self.sparse[universe].to_dense()
+        return self.values[universe], self.alphas[universe]
 
     def clean(self):
         """Remove stuff where alphas are all zero"""
@@ -26,6 +152,11 @@ class LightingLayer:
             if numpy.all(self.alphas[i] < 0.00000001):
                 del self.values[i]
                 del self.alphas[i]
+                self.invalidate(i)
+
+        for i in list(self.sparse):
+            if numpy.all(self.sparse[i].alphas < 0.00000001):
+                del self.sparse[i]
 
     def set_val(
         self,
@@ -42,18 +173,28 @@ class LightingLayer:
                 default_universe_count, dtype=numpy.float64
             )
         self.values[universe][channel] = value
+        self.invalidate(universe)
 
     def update_from(self, other: LightingLayer):
-        """Update self wherever incoming alpha is nonzero"""
-        for i in other.values:
+        """Update self wherever incoming alpha is nonzero.
+        Self must be a dense layer."""
+        assert not self.sparse
+        for i in other.universes():
+            size = other.size(i)
             if i not in self.values:
-                self.values[i] = numpy.zeros(other.values[i].shape)
-                self.alphas[i] = numpy.zeros(other.alphas[i].shape)
+                self.values[i] = numpy.zeros(size)
+                self.alphas[i] = numpy.zeros(size)
+
+            idx = other.active_channels(i)
+            if not len(idx):
+                continue
 
-            mask = other.alphas[i] > 0
+            v, a = other.gather(i, idx)
+            self.values[i][idx] = v
+            self.alphas[i][idx] = a
 
-            self.values[i] = numpy.where(mask, other.values[i], self.values[i])
-            self.alphas[i] = numpy.where(mask, other.alphas[i], self.alphas[i])
+            if i in self._active:
+                self._active[i] = numpy.union1d(self._active[i], idx)
 
     def fade_in(
         self,
@@ -64,42 +205,66 @@ class LightingLayer:
         """Produce a new layer that is a blend between self and other.
         except that if a value is in the new but not the old,
         fade up the alpha but jump straight to val to avoid double fades.
+
+        Universes where few channels are set in either layer
+        are only computed for those channels, and stored sparse.
         """
-        op = {}
-        op_a = {}
-        for universename in new_other.values:
-            if universename not in self.values:
-                v = numpy.zeros(new_other.values[universename].shape)
-                a = numpy.zeros(new_other.alphas[universename].shape)
-            else:
-                v = self.values[universename]
-                a = self.alphas[universename]
+        ll = LightingLayer()
 
-            mask = a > 0
+        for universename in new_other.universes():
+            size = new_other.size(universename)
+            has_old = (
+                universename in self.values or universename in self.sparse
+            ) and self.size(universename) == size
 
             b = blend
             if universename in universes_cache:
                 if not universes_cache[universename].local_fading:
                     b = 1
 
-            op[universename] = numpy.where(
-                mask,
-                b * new_other.values[universename] + (1 - b) * v,
-                new_other.values[universename],
-            )
+            idx = new_other.active_channels(universename)
+            if has_old:
+                idx = numpy.union1d(idx, self.active_channels(universename))
 
-            op_a[universename] = (
-                b * new_other.alphas[universename] + (1 - b) * a
-            )
+            if len(idx) <= size * SPARSE_FILL_RATIO:
+                new_v, new_a = new_other.gather(universename, idx)
+                if has_old:
+                    v, a = self.gather(universename, idx)
+                else:
+                    v = a = numpy.zeros(len(idx))
+                ll.sparse[universename] = SparseChannels(
+                    size,
+                    idx,
+                    *self._blend(new_v, new_a, v, a, b),
+                )
+                continue
+
+            new_v, new_a = new_other.to_dense(universename)
+            if has_old:
+                v, a = self.to_dense(universename)
+            else:
+                v = a = numpy.zeros(size)
+
+            (
+                ll.values[universename],
+                ll.alphas[universename],
+            ) = self._blend(new_v, new_a, v, a, b)
 
-        ll = LightingLayer()
-        ll.values = op
-        ll.alphas = op_a
         return ll
 
+    @staticmethod
+    def _blend(new_v, new_a, v, a, b):
+        mask = a > 0
+        return (
+            numpy.where(mask, b * new_v + (1 - b) * v, new_v),
+            b * new_a + (1 - b) * a,
+        )
+
     def clear(self):
         self.values = {}
         self.alphas = {}
+        self.sparse = {}
+        self.invalidate()
 
     def copy(self):
         return LightingLayer(self)
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+import structlog
+
+from kaithem.api import tags
+
+from .. import settings_overrides
+
+logger = structlog.get_logger(__name__)
+
+FRAME_RATE_SETTING = "chandler/frame_rate"
+DEFAULT_FRAME_RATE = 60.0
+
+# Stages of a render loop frame, in the order they run
+STAGES = ("group_poll", "composite", "output", "next_frame_actions")
+
+settings_overrides.set_description(
+    FRAME_RATE_SETTING,
+    "Target Chandler render loop rate in frames per second, default 60",
+)
+
+
+def get_configured_frame_rate() -> float:
+    "Read the target frame rate from settings, falling back to the default"
+    v = settings_overrides.get_val(FRAME_RATE_SETTING)
+    if not v:
+        return DEFAULT_FRAME_RATE
+    try:
+        hz = float(v)
+    except ValueError:
+        logger.exception(f"Invalid {FRAME_RATE_SETTING} setting: {v}")
+        return DEFAULT_FRAME_RATE
+    return min(max(hz, 1.0), 240.0)
+
+
+class FrameScheduler:
+    """Paces a loop to absolute per-frame deadlines, and measures how long
+    each stage of the frame takes.
+
+    Deadlines advance by exactly one period per frame, so the time spent
+    rendering does not get added on top of the frame period.
+
+    When a frame overruns its deadline, the missed frames are skipped
+    rather than rendered back to back to catch up, and the schedule
+    restarts from the current time.
+
+    Timing is published as tags under tag_prefix no more than once per
+    telemetry_interval, averaged over the frames since the last publish.
+
+    clock and sleep default to time.monotonic and time.sleep, and can be
+    replaced to run the schedule against simulated time.
+    """
+
+    def __init__(
+        self,
+        target_hz: float = DEFAULT_FRAME_RATE,
+        tag_prefix: str = "/chandler/render",
+        telemetry_interval: float = 1.0,
+        min_sleep: float = 0.001,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        assert target_hz > 0
+        self.target_hz = target_hz
+        self.telemetry_interval = telemetry_interval
+        # Even overrunning frames sleep a little so other threads
+        # waiting on the locks we use get a chance to run.
+        self.min_sleep = min_sleep
+        self.clock = clock
+        self.sleep = sleep
+
+        self.frame_start = self.clock()
+        self.deadline = self.frame_start
+        # The schedule starts from the first frame, not from when
+        # the scheduler was created
+        self.started = False
+
+        # True if the last completed frame missed its deadline
+        self.overrunning = False
+        self.overruns = 0
+        self.skipped_frames = 0
+
+        self._window_start = self.frame_start
+        self._window_frames = 0
+        self._window_max_frame = 0.0
+        self._stage_totals: dict[str, float] = dict.fromkeys(STAGES, 0.0)
+
+        self.fps_tag = tags.NumericTag(tag_prefix + ".fps")
+        self.fps_tag.unit = "Hz"
+        self.fps_tag.description = "Measured render loop frame rate"
+        self.fps_tag.writable = False
+        self.fps_tag.expose("view_status")
+
+        self.overruns_tag = tags.NumericTag(tag_prefix + ".overruns")
+        self.overruns_tag.description = (
+            "Number of frames that missed their deadline since startup"
+        )
+        self.overruns_tag.writable = False
+        self.overruns_tag.expose("view_status")
+
+        self.skipped_tag = tags.NumericTag(tag_prefix + ".skipped_frames")
+        self.skipped_tag.description = (
+            "Frames dropped to resync after overruns since startup"
+        )
+        self.skipped_tag.writable = False
+        self.skipped_tag.expose("view_status")
+
+        self.max_frame_tag = tags.NumericTag(tag_prefix + ".frame_max")
+        self.max_frame_tag.unit = "ms"
+        self.max_frame_tag.description = (
+            "Longest frame render time, excluding sleep, in the last window"
+        )
+        self.max_frame_tag.writable = False
+        self.max_frame_tag.expose("view_status")
+
+        self.stage_tags: dict[str, tags.NumericTagPointClass] = {}
+        for i in STAGES:
+            t = tags.NumericTag(f"{tag_prefix}.{i}")
+            t.unit = "ms"
+            t.description = f"Average time spent in the {i} stage per frame"
+            t.writable = False
+            t.expose("view_status")
+            self.stage_tags[i] = t
+
+    @property
+    def period(self) -> float:
+        return 1 / self.target_hz
+
+    def begin_frame(self):
+        self.frame_start = self.clock()
+        if not self.started:
+            self.started = True
+            self.deadline = self.frame_start
+            self._window_start = self.frame_start
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        "Time a stage of the current frame"
+        t = self.clock()
+        try:
+            yield
+        finally:
+            self._stage_totals[name] += self.clock() - t
+
+    def wait_for_next_frame(self):
+        """Sleep until the next frame's deadline.
+        Call once per frame, after all the work is done."""
+        now = self.clock()
+        period = self.period
+
+        self._window_frames += 1
+        self._window_max_frame = max(
+            self._window_max_frame, now - self.frame_start
+        )
+
+        self.deadline += period
+
+        if now > self.deadline:
+            self.overrunning = True
+            self.overruns += 1
+            self.skipped_frames += int((now - self.deadline) / period)
+            # Resync instead of bursting frames to catch up
+            self.deadline = now
+        else:
+            self.overrunning = False
+
+        if now - self._window_start >= self.telemetry_interval:
+            self.publish_telemetry(now)
+
+        self.sleep(max(self.deadline - now, self.min_sleep))
+
+    def publish_telemetry(self, now: float | None = None):
+        now = now or self.clock()
+        elapsed = now - self._window_start
+        frames = self._window_frames
+
+        if frames and elapsed > 0:
+            self.fps_tag.value = round(frames / elapsed, 2)
+            self.max_frame_tag.value = round(self._window_max_frame * 1000, 3)
+            for i in STAGES:
+                self.stage_tags[i].value = round(
+                    self._stage_totals[i] * 1000 / frames, 3
+                )
+
+        self.overruns_tag.value = self.overruns
+        self.skipped_tag.value = self.skipped_frames
+
+        self._window_start = now
+        self._window_frames = 0
+        self._window_max_frame = 0.0
+        for i in STAGES:
+            self._stage_totals[i] = 0.0
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import re
 import time
-import traceback
 from typing import TYPE_CHECKING
 
 import numpy
@@ -10,6 +9,7 @@ import numpy
 from kaithem.src.chandler.cue import EffectData
 
 from . import blendmodes, generator_plugins, universes
+from .compositing import CompositingBuffer
 
 if TYPE_CHECKING:
     from .ChandlerConsole import ChandlerConsole
@@ -148,6 +148,7 @@ class GroupLightingManager:
                 ):
                     self.cached_values_raw_by_effect[effect].values[u][c] = 0
                     self.cached_values_raw_by_effect[effect].alphas[u][c] = 0
+                    self.cached_values_raw_by_effect[effect].invalidate(u)
                     self.refresh_generator_layout(self.cue, effect)
             else:
                 if u not in self.cached_values_raw_by_effect[effect].values:
@@ -167,6 +168,7 @@ class GroupLightingManager:
                     self.cached_values_raw_by_effect[effect].alphas[u][c] > 0
                 )
                 self.cached_values_raw_by_effect[effect].alphas[u][c] = 1
+                self.cached_values_raw_by_effect[effect].invalidate(u)
                 if not was_present:
                     self.refresh_generator_layout(self.cue, effect)
                 else:
@@ -214,11 +216,15 @@ class GroupLightingManager:
                     m = gen.precomputed_mappings[j]
                     if j not in v.values:
                         v.values[j] = numpy.zeros(
-                            len(universes_cache[i].values)
+                            len(universes_cache[j].values)
+                        )
+                        v.alphas[j] = numpy.zeros(
+                            len(universes_cache[j].values)
                         )
 
                     v.values[j][m[0]] = p[m[1]]
                     v.alphas[j][m[0]] = 1.0
+                    v.invalidate(j)
             op.update_from(v)
 
         return self.fading_from_flattened.fade_in(op, fp, universes_cache)
@@ -235,7 +241,7 @@ class GroupLightingManager:
                 for j in self.cached_values_raw_by_effect[i].values:
                     self.should_repaint_onto_universes[j] = True
 
-            for j in self.fading_from_flattened.values:
+            for j in self.fading_from_flattened.universes():
                 self.should_repaint_onto_universes[j] = True
 
     def next(self, cue: Cue | None, fade_in: bool = False):
@@ -391,6 +397,7 @@ class GroupLightingManager:
                         layer.alphas[universe][channel] = (
                             1.0 if cue_value is not None else 0
                         )
+                        layer.invalidate(universe)
 
     def fade_complete_cleanup(self):
         """Called when the fade is complete,
@@ -509,87 +516,8 @@ class GroupLightingManager:
                 self.mark_need_repaint_onto_universes()
 
 
-def _composite(background, values, alphas, alpha):
-    "In place compositing of one universe as a numpy array on a background.  Returns background."
-    background = background * (1 - (alphas * alpha)) + values * alphas * alpha
-    return background
-
-
-def composite_rendered_layer_onto_universe(
-    universe: str,
-    group: Group,
-    nl: LightingLayer,
-    universe_object: universes.Universe,
-):
-    "May happen in place, or not, but always returns the new version"
-
-    universe_values = universe_object.values
-
-    if universe not in nl.values:
-        return universe_values
-
-    vals = nl.values[universe]
-    alphas = nl.alphas[universe]
-
-    # The universe may need to know when it's current fade should end,
-    # if it handles fading in a different way.
-    # This will look really bad for complex things, to try and reduce them to a series of fades,
-    # but we just do the best we can, and assume there's mostly only 1 group at a time affecting things
-    universe_object.fadeEndTime = max(
-        universe_object.fadeEndTime, group.cue.fade_in + group.entered_cue
-    )
-
-    universe_alphas = universe_object.alphas
-
-    bm = group.lighting_manager.blend
-
-    if bm == "normal":
-        # todo: is it bad to multiply by bool?
-        unsetVals = universe_alphas == 0.0
-        fade = numpy.maximum(
-            group.alpha, unsetVals & universe_object.hueBlendMask
-        )
-
-        universe_values = _composite(universe_values, vals, alphas, fade)
-        # Essentially calculate remaining light percent, then multiply layers and convert back to alpha
-        universe_alphas = 1 - ((1 - (alphas * fade)) * (1 - (universe_alphas)))
-
-    elif bm == "HTP":
-        universe_values = numpy.maximum(
-            universe_values, vals * (alphas * group.alpha)
-        )
-        universe_alphas = (alphas * group.alpha) > 0
-
-    elif bm == "inhibit":
-        universe_values = numpy.minimum(
-            universe_values, vals * (alphas * group.alpha)
-        )
-        universe_alphas = (alphas * group.alpha) > 0
-
-    elif bm == "gel" or bm == "multiply":
-        if group.alpha:
-            # precompute constants
-            c = 255 / group.alpha
-            universe_values = (universe_values * (1 - alphas * group.alpha)) + (
-                universe_values * vals
-            ) / c
-
-            # COMPLETELY incorrect, but we don't use alpha for that much, and the real math
-            # Is complicated. #TODO
-            universe_alphas = (alphas * group.alpha) > 0
-
-    elif group.lighting_manager._blend:
-        try:
-            universe_values = group.lighting_manager._blend.frame(
-                universe, universe_values, vals, alphas, group.alpha
-            )
-            # Also incorrect-ish, but treating modified vals as fully opaque is good enough.
-            universe_alphas = (alphas * group.alpha) > 0
-        except Exception:
-            print("Error in blend function")
-            print(traceback.format_exc())
-    universe_object.alphas = universe_alphas
-    return universe_values
+# All universes are composited into this, it's protected by the render lock
+compositing_buffer = CompositingBuffer()
 
 
 def composite_layers_from_board(
@@ -625,9 +553,15 @@ def composite_layers_from_board(
     if not needs_rerender:
         return changed
 
-    for u in universesSnapshot:
-        if u in changed or u in universes.request_rerender:
-            universesSnapshot[u].reset()
+    compositing_buffer.bind(universesSnapshot)
+
+    to_reset = [
+        u
+        for u in universesSnapshot
+        if u in changed or u in universes.request_rerender
+    ]
+    compositing_buffer.check_views(to_reset)
+    compositing_buffer.reset(to_reset)
 
     universes.request_rerender.clear()
 
@@ -647,23 +581,17 @@ def composite_layers_from_board(
 
         x = i.lighting_manager.get_current_flattened_outputs(universesSnapshot)
 
-        # Loop over universes the group affects
-        for u in x.values:
-            # Leave universes with no changes in them alone
-            if u not in changed:
-                continue
-
-            if u.startswith("__") and u.endswith("__"):
-                continue
-
-            if u not in universesSnapshot:
-                continue
+        # Universes the group affects, leaving alone
+        # the ones with no changes in them
+        affected = [
+            u
+            for u in x.universes()
+            if u in changed
+            and u in universesSnapshot
+            and not (u.startswith("__") and u.endswith("__"))
+        ]
 
-            universeObject = universesSnapshot[u]
-
-            universeObject.values = composite_rendered_layer_onto_universe(
-                u, i, x, universeObject
-            )
+        compositing_buffer.composite_group(i, x, affected, universesSnapshot)
 
     return changed
 
@@ -671,13 +599,20 @@ def composite_layers_from_board(
 def do_output(changed, universesSnapshot):
     """Trigger all universes to actually output the frames.
     Need a snapshot list of universes because getting
-    it is expensive according to profiler
+    it is expensive according to profiler.
+
+    Frames identical to the universe's last output are counted
+    and skipped, senders handle any keep-alive resending themselves.
     """
     for i in changed:
         try:
             if i in universesSnapshot:
                 x = universesSnapshot[i]
                 x.preFrame()
-                x.onFrame()
+                if x.output_changed():
+                    x.onFrame()
+                    x.frames_sent += 1
+                else:
+                    x.frames_suppressed += 1
         except Exception:
             raise
@@ -1720,7 +1720,7 @@ class Group:
 
         if self.mqttConnection and self.script_context:
             # Subscribe to everything we aren't subscribed to
-            for i in self.script_context.event_listeners:
+            for i in self.script_context.event_index:
                 if i.startswith("$mqtt:"):
                     x = i.split(":", 1)
                     if x[1] not in self.mqttSubscribed:
@@ -1731,7 +1731,7 @@ class Group:
             to_rm = []
 
             for i in self.mqttSubscribed:
-                if "$mqtt:" + i not in self.script_context.event_listeners:
+                if "$mqtt:" + i not in self.script_context.event_index:
                     if i not in self.unusedMqttTopics:
                         self.unusedMqttTopics[i] = time.monotonic()
                         continue
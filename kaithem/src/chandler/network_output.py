@@ -0,0 +1,356 @@
+"""Shared output engine for network lighting protocols, Art-Net and sACN.
+
+Every network universe owns a preallocated packet, and new frames are
+written into its DMX data in place.  A single thread sends every universe
+with a pending frame, so adding universes does not add threads or sockets.
+"""
+
+from __future__ import annotations
+
+import socket
+import struct
+import threading
+import time
+import uuid
+import weakref
+from typing import TYPE_CHECKING
+
+import numpy
+import numpy.typing
+import structlog
+
+from .. import settings_overrides
+
+if TYPE_CHECKING:
+    from .universes import Universe
+
+logger = structlog.get_logger(__name__)
+
+ARTNET_PORT = 6454
+SACN_PORT = 5568
+
+# Address schemes that select sACN instead of Art-Net
+SACN_SCHEMES = ("sacn", "e131")
+
+# Identifies this process as an sACN source
+SACN_CID = uuid.uuid4().bytes
+
+KEEPALIVE_SETTING = "chandler/network_keepalive"
+DEFAULT_KEEPALIVE = 1.0
+
+# How long a universe waits before retrying after a send error
+ERROR_BACKOFF = 5.0
+
+settings_overrides.set_description(
+    KEEPALIVE_SETTING,
+    "Seconds between resends of unchanged Art-Net and sACN frames, "
+    "default 1. Takes effect when universes are reconfigured.",
+)
+
+
+def get_configured_keepalive() -> float:
+    v = settings_overrides.get_val(KEEPALIVE_SETTING)
+    if not v:
+        return DEFAULT_KEEPALIVE
+    try:
+        return min(max(float(v), 0.05), 60.0)
+    except ValueError:
+        logger.exception(f"Invalid {KEEPALIVE_SETTING} setting: {v}")
+        return DEFAULT_KEEPALIVE
+
+
+class OutputPacket:
+    """A packet with room for one universe of DMX data after its header.
+    The values passed to write() are indexed from 1 like DMX channels,
+    element 0 is ignored."""
+
+    header_size = 0
+
+    def __init__(
+        self,
+        channels: int,
+        destination: tuple[str, int],
+        framerate: float,
+        universe: weakref.ref[Universe] | None = None,
+    ):
+        self.destination = destination
+        self.framerate = max(float(framerate), 0.1)
+        self.universe = universe
+
+        self.length = self.data_length(min(max(channels, 1), 512))
+        self.buffer = bytearray(self.header_size + self.length)
+        self.data = numpy.frombuffer(
+            self.buffer, dtype=numpy.uint8, offset=self.header_size
+        )
+        self._scratch = numpy.zeros(self.length, dtype=numpy.float32)
+        # The next frame's data, to compare against the current data
+        self._staged = numpy.zeros(self.length, dtype=numpy.uint8)
+        self._diff = numpy.zeros(self.length, dtype=bool)
+
+        # Copy of the buffer taken under the engine lock, which is what
+        # actually goes out, so a frame never gets sent half written
+        self.tx = bytearray(len(self.buffer))
+
+        self.dirty = False
+        self.last_sent = 0.0
+        # Unchanged frames are resent this often
+        self.keepalive = DEFAULT_KEEPALIVE
+        self.error: str | None = None
+
+        self.frames_sent = 0
+        self.keepalives_sent = 0
+
+    @staticmethod
+    def data_length(channels: int) -> int:
+        return channels
+
+    def stage(self, values: numpy.typing.NDArray[numpy.floating]) -> bool:
+        """Convert values to DMX bytes without sending them.
+        Returns True if they differ from the current data,
+        which during slow fades they often don't."""
+        n = min(len(values) - 1, self.length)
+        scratch = self._scratch[:n]
+        numpy.clip(values[1 : n + 1], 0, 255, out=scratch)
+        self._staged[:n] = scratch
+        numpy.not_equal(self._staged, self.data, out=self._diff)
+        return bool(self._diff.any())
+
+    def commit(self):
+        "Make the last staged frame the data, and mark it to be sent"
+        self.data[:] = self._staged
+        self.dirty = True
+
+    def write(self, values: numpy.typing.NDArray[numpy.floating]) -> bool:
+        "Update the data and mark it to be sent, only if it changed"
+        if not self.stage(values):
+            return False
+        self.commit()
+        return True
+
+    def due(self, now: float) -> bool:
+        "True if the packet should be sent now"
+        return now >= self.next_send()
+
+    def next_send(self) -> float:
+        if self.dirty:
+            return self.last_sent + 1 / self.framerate
+        return self.last_sent + self.keepalive
+
+    def snapshot(self, now: float):
+        "Copy the buffer into tx, called under the engine lock"
+        if self.dirty:
+            self.frames_sent += 1
+        else:
+            self.keepalives_sent += 1
+        self.tx[:] = self.buffer
+        self.dirty = False
+        self.last_sent = now
+
+    def set_status(self, s: str, ok: bool):
+        try:
+            if self.universe:
+                u = self.universe()
+                if u:
+                    u.setStatus(s, ok)
+        except Exception:
+            logger.exception("Error setting universe status")
+
+
+class ArtNetPacket(OutputPacket):
+    "An ArtDmx packet"
+
+    header_size = 18
+
+    def __init__(self, channels, destination, framerate, universe=None):
+        super().__init__(channels, destination, framerate, universe)
+        self.buffer[:12] = b"Art-Net\x00\x00\x50\x00\x0e"
+        struct.pack_into(">H", self.buffer, 16, self.length)
+        self.port_address: tuple[int, int] | None = None
+
+    @staticmethod
+    def data_length(channels: int) -> int:
+        # Art-Net requires an even length of at least 2
+        return max(2, channels + (channels % 2))
+
+    def set_port_address(self, physical: int, universe: int):
+        """Rewrites the header, so once the packet is registered
+        this must go through the engine, like write()"""
+        if self.port_address != (physical, universe):
+            struct.pack_into(
+                "<BH", self.buffer, 13, physical & 0xFF, universe & 0x7FFF
+            )
+            self.port_address = (physical, universe)
+
+
+class SACNPacket(OutputPacket):
+    "An E1.31 data packet"
+
+    header_size = 126
+
+    def __init__(
+        self,
+        channels,
+        destination,
+        framerate,
+        universe=None,
+        number: int = 1,
+        source_name: str = "Kaithem",
+        priority: int = 100,
+    ):
+        super().__init__(channels, destination, framerate, universe)
+        self.sequence = 0
+
+        total = len(self.buffer)
+        b = self.buffer
+        # Root layer
+        struct.pack_into("!HH12s", b, 0, 0x0010, 0, b"ASC-E1.17\x00\x00\x00")
+        struct.pack_into("!HI16s", b, 16, 0x7000 | (total - 16), 4, SACN_CID)
+        # Framing layer
+        struct.pack_into(
+            "!HI64sBHBBH",
+            b,
+            38,
+            0x7000 | (total - 38),
+            2,
+            source_name.encode()[:63],
+            priority,
+            0,
+            0,
+            0,
+            number,
+        )
+        # DMP layer, the last byte is the DMX start code
+        struct.pack_into(
+            "!HBBHHHB",
+            b,
+            115,
+            0x7000 | (total - 115),
+            2,
+            0xA1,
+            0,
+            1,
+            self.length + 1,
+            0,
+        )
+
+    def snapshot(self, now: float):
+        super().snapshot(now)
+        self.sequence = (self.sequence + 1) % 256
+        self.tx[111] = self.sequence
+
+
+def sacn_multicast_address(number: int) -> str:
+    return f"239.255.{(number >> 8) & 0xFF}.{number & 0xFF}"
+
+
+class NetworkOutputEngine:
+    """Sends registered packets from one thread and one socket.
+    Frames are rate limited per packet, to that packet's frame rate."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.packets: list[OutputPacket] = []
+        self.thread: threading.Thread | None = None
+        self.sock: socket.socket | None = None
+        self._batch: list[OutputPacket] = []
+
+    def register(self, packet: OutputPacket):
+        packet.keepalive = get_configured_keepalive()
+        with self.lock:
+            if packet not in self.packets:
+                self.packets.append(packet)
+            if not self.thread:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                self.sock.setsockopt(
+                    socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 8
+                )
+                self.sock.bind(("", 0))
+                self.sock.settimeout(1)
+
+                self.thread = threading.Thread(
+                    target=self.run, name="NetworkLightingOutput", daemon=True
+                )
+                self.thread.start()
+        self.wake.set()
+
+    def unregister(self, packet: OutputPacket):
+        with self.lock:
+            if packet in self.packets:
+                self.packets.remove(packet)
+
+    def submit(
+        self,
+        packet: OutputPacket,
+        values: numpy.typing.NDArray[numpy.floating],
+    ) -> bool:
+        """Write a new frame into the packet and wake the sender.
+        Returns False if the frame was the same as the last one."""
+        with self.lock:
+            changed = packet.write(values)
+        if changed:
+            self.wake.set()
+        return changed
+
+    def set_port_address(
+        self, packet: ArtNetPacket, physical: int, universe: int
+    ):
+        "Change the port address in an Art-Net packet's header"
+        # Only ever changed under the lock, so if it's the same it's safe
+        if packet.port_address == (physical, universe):
+            return
+        with self.lock:
+            packet.set_port_address(physical, universe)
+
+    def submit_staged(self, packet: OutputPacket):
+        """Send the frame already converted by packet.stage(),
+        for callers that staged it to check if it changed"""
+        with self.lock:
+            packet.commit()
+        self.wake.set()
+
+    def run(self):
+        batch = self._batch
+        while True:
+            try:
+                now = time.monotonic()
+                next_wake = now + 1
+
+                batch.clear()
+                with self.lock:
+                    for p in self.packets:
+                        if p.due(now):
+                            p.snapshot(now)
+                            batch.append(p)
+                        else:
+                            next_wake = min(next_wake, p.next_send())
+
+                assert self.sock
+                for p in batch:
+                    try:
+                        self.sock.sendto(p.tx, p.destination)
+                    except Exception as e:
+                        with self.lock:
+                            p.last_sent = now + ERROR_BACKOFF
+                        if p.error is None:
+                            logger.exception(
+                                f"Error sending to {p.destination}"
+                            )
+                        p.error = str(e)
+                        p.set_status("Send error, " + str(e)[:100], False)
+                    else:
+                        if p.error is not None:
+                            p.error = None
+                            p.set_status("OK", True)
+                    next_wake = min(next_wake, p.next_send())
+
+                self.wake.wait(max(next_wake - time.monotonic(), 0))
+                self.wake.clear()
+            except Exception:
+                logger.exception("Error in network lighting output")
+                time.sleep(1)
+
+
+engine = NetworkOutputEngine()
@@ -5,7 +5,6 @@ from __future__ import annotations
 import gc
 import json
 import logging
-import socket
 import struct
 import threading
 import time
@@ -15,6 +14,7 @@ from typing import Any
 
 import colorzero
 import numpy
+import numpy.typing
 import serial
 import serial.tools.list_ports
 import structlog
@@ -23,7 +23,7 @@ from scullery import messagebus, workers
 from kaithem.api import devices, lifespan, tags
 from kaithem.src import alerts
 
-from . import core
+from . import core, network_output
 from .core import disallow_special
 
 logger = structlog.get_logger(__name__)
@@ -391,6 +391,13 @@ class Universe:
         self.hueBlendMask = numpy.array([0.0] * count, dtype="?")
 
         self.count = count
+
+        # Copy of the values and alphas from the last frame output,
+        # so identical frames don't get sent again
+        self._last_output: numpy.typing.NDArray[numpy.float64] | None = None
+        self.frames_sent = 0
+        self.frames_suppressed = 0
+
         # Maps fine channel numbers to coarse channel numbers
         self.fine_channels: dict[int, int] = {}
 
@@ -554,8 +561,9 @@ class Universe:
 
     def reset(self):
         "Reset all values to 0"
-        self.values = numpy.array([0.0] * self.count, dtype="f4")
-        self.alphas = numpy.array([0.0] * self.count, dtype="f4")
+        # In place, the arrays may be views into the compositing buffer
+        self.values.fill(0)
+        self.alphas.fill(0)
 
     def preFrame(self):
         """Frame preprocessor, uses fixture-specific info,"
@@ -568,6 +576,24 @@ class Universe:
         for i in self.fixed_channels:
             self.values[i] = self.fixed_channels[i]
 
+    def output_changed(self) -> bool:
+        """Called after preFrame, return True if this frame
+        is different from the last one that was output."""
+        last = self._last_output
+        n = len(self.values)
+        if last is None or last.shape != (2, n) or len(self.alphas) != n:
+            self._last_output = numpy.array([self.values, self.alphas])
+            return True
+
+        if numpy.array_equal(last[0], self.values) and numpy.array_equal(
+            last[1], self.alphas
+        ):
+            return False
+
+        last[0] = self.values
+        last[1] = self.alphas
+        return True
+
     def onFrame(self):
         pass
 
@@ -779,6 +805,10 @@ class DMXSender:
 
 
 class ArtNetUniverse(Universe):
+    """Sends Art-Net to an ip:port address, or sACN if the address
+    starts with sacn://.  An sACN address without a host uses
+    the standard multicast address for the universe number."""
+
     def __init__(
         self,
         name,
@@ -798,8 +828,13 @@ class ArtNetUniverse(Universe):
         else:
             scheme = ""
 
-        addr, port = x[-1].split(":")
-        port = int(port)
+        addr, _, port = x[-1].partition(":")
+        if port:
+            port = int(port)
+        elif scheme in network_output.SACN_SCHEMES:
+            port = network_output.SACN_PORT
+        else:
+            port = network_output.ARTNET_PORT
 
         # Sender needs the values to be there for setup
 
@@ -813,12 +848,17 @@ class ArtNetUniverse(Universe):
 
         self.hidden = False
 
+    def output_changed(self) -> bool:
+        # Compare what would actually go on the wire, during slow fades
+        # the DMX values often don't change every frame
+        return self.sender.packet.stage(self.values)
+
     def onFrame(self):
-        data = self.values
-        self.sender.onFrame(data, None, self.number)
+        # output_changed() already staged the values into the packet
+        self.sender.submit_staged(None, self.number)
 
     def __del__(self):
-        # Stop the thread when this gets deleted
+        # Stop sending when this gets deleted
         self.sender.onFrame(None)
 
     @core.cl_context.required
@@ -836,78 +876,37 @@ def makeSender(c, uref, *a):
 
 class ArtNetSender:
     """This object is used by the universe object
-    to send data to the enttec adapter.
-    It runs in it's own thread because the
-    frame rate might have nothing to do with
-    the rate at which the data actually gets rendered.
+    to send Art-Net or sACN data.
+    The actual sending happens in the shared network output thread,
+    this just owns the universe's preallocated packet.
     """
 
     def __init__(self, universe, addr, port, framerate, scheme):
-        self.frame = threading.Event()
         self.scheme = scheme
-
         self.universe = universe
-        self.data = False
-        self.running = 1
-        # The last telemetry we didn't ignore
-        self.lastTelemetry = 0
-
-        def run():
-            import time
-            import traceback
-
-            interval = 1.1 / self.framerate
-
-            while self.running:
-                try:
-                    s = time.time()
-                    x = self.frame.wait(interval)
-                    if not x:
-                        interval = min(60, interval * 1.3)
-                    else:
-                        interval = 1.5 / self.framerate
-                    if self.data is False:
-                        continue
-                    with self.lock:
-                        if self.data is None:
-                            print("Stopping ArtNet Sender for " + self.addr)
-                            return
-
-                        addr = self.addr
-                        self.frame.clear()
-                    try:
-                        self.sock.sendto(self.data, (addr, self.port))
-                    except Exception:
-                        time.sleep(5)
-                        raise
-
-                    time.sleep(
-                        max(((1.0 / self.framerate) - (time.time() - s)), 0)
-                    )
-                except Exception:
-                    core.rl_log_exc("Error in artnet universe")
-                    print(traceback.format_exc())
-
-        self.thread = threading.Thread(target=run)
-        self.thread.name = "ArtnetSenderThread_" + self.thread.name
-
-        self.thread.daemon = True
         self.framerate = float(framerate)
-        self.lock = threading.Lock()
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        # Bind to the server address
-        self.sock.bind(("", 0))
-        self.sock.settimeout(1)
+        u = universe()
+        # Channel 0 is not sent
+        channels = len(u.values) - 1
+
+        if scheme in network_output.SACN_SCHEMES:
+            number = min(max(int(u.number), 1), 63999)
+            addr = addr or network_output.sacn_multicast_address(number)
+            self.packet = network_output.SACNPacket(
+                channels, (addr, port), framerate, universe, number=number
+            )
+        else:
+            self.packet = network_output.ArtNetPacket(
+                channels, (addr, port), framerate, universe
+            )
 
         self.addr = addr
         self.port = port
-        self.thread.start()
+        network_output.engine.register(self.packet)
 
     def __del__(self):
-        self.running = 0
+        network_output.engine.unregister(self.packet)
 
     def setStatus(self, s, ok):
         try:
@@ -916,23 +915,26 @@ class ArtNetSender:
             pass
 
     def onFrame(self, data, physical=None, universe=0):
-        with self.lock:
-            if data is not None:
-                # DMX starts at 1, don't send element 0 even though it exists.
-                p = (
-                    b"Art-Net\x00\x00\x50\x00\x0e\0"
-                    + struct.pack(
-                        "<BH",
-                        physical if physical is not None else universe,
-                        universe,
-                    )
-                    + struct.pack(">H", len(data))
-                    + (data.astype(numpy.uint8).tobytes()[1:])
-                )
-                self.data = p
-            else:
-                self.data = data
-            self.frame.set()
+        if data is None:
+            network_output.engine.unregister(self.packet)
+            return
+
+        self._set_port_address(physical, universe)
+        # DMX starts at 1, element 0 is not sent even though it exists.
+        network_output.engine.submit(self.packet, data)
+
+    def submit_staged(self, physical=None, universe=0):
+        "Send the frame staged into the packet by packet.stage()"
+        self._set_port_address(physical, universe)
+        network_output.engine.submit_staged(self.packet)
+
+    def _set_port_address(self, physical, universe):
+        if isinstance(self.packet, network_output.ArtNetPacket):
+            network_output.engine.set_port_address(
+                self.packet,
+                physical if physical is not None else universe,
+                universe,
+            )
 
 
 class EnttecOpenUniverse(Universe):
@@ -1245,18 +1247,22 @@ class ColorTagUniverse(Universe):
             self.local_fading = True
 
     def onFrame(self):
+        # Values are composited in place, so copy them now, before the
+        # next frame starts rendering over them.
+        rgb = self.values[1:4].copy()
+
         def f():
             if self.lock.acquire(timeout=1):
                 try:
-                    self._onFrame()
+                    self._onFrame(rgb)
                 finally:
                     self.lock.release()
 
         workers.do(f)
 
-    def _onFrame(self):
+    def _onFrame(self, rgb):
         c = colorzero.Color.from_rgb(
-            self.values[1] / 255, self.values[2] / 255, self.values[3] / 255
+            rgb[0] / 255, rgb[1] / 255, rgb[2] / 255
         ).html
 
         tm = time.time()
@@ -41,6 +41,9 @@ mixerdir = os.path.join(vardir, "system.mixer")
 
 
 moduledir = os.path.join(vardir, "modules")
+
+# Only things that can be regenerated, safe to delete at any time
+cachedir = os.path.join(vardir, "cache")
 htmldir = os.path.join(dn, "html")
 
 # Mostly to not break unit tests
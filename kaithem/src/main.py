@@ -13,7 +13,7 @@ from typing import Any
 import structlog
 
 from . import config as config_module
-from . import console_about_page
+from . import console_about_page, startup_profile
 from . import logconfig as _logconfig  # noqa: F401
 from .print_thread_tracebacks import watchdog
 
@@ -36,9 +36,10 @@ def import_in_thread(m):
             _logger.exception(f"Error importing {m}")
         finally:
             backround_import_count.release()
-        taken = round(time.time() - start_time, 2)
+        taken = time.time() - start_time
+        startup_profile.record("import", m, taken)
         if taken > 0.1:
-            _logger.info(f"Loading {m} took {taken}s")
+            _logger.info(f"Loading {m} took {round(taken, 2)}s")
 
     threading.Thread(
         target=f, daemon=True, name=f"nostartstoplog.importer.{m}"
@@ -104,12 +105,14 @@ def initialize(config: dict[str, Any] | None = None):
 
     # config needs to be available before init for overrides
     # but it can't be initialized until after pathsetup which may
-    config_module.initialize(config)
+    with startup_profile.timed("init", "config"):
+        config_module.initialize(config)
     from . import (
         geolocation,
     )
 
-    geolocation.use_api_if_needed()
+    with startup_profile.timed("init", "geolocation"):
+        geolocation.use_api_if_needed()
 
     # must load AFTER config init
     from scullery import (
@@ -124,13 +127,15 @@ def initialize(config: dict[str, Any] | None = None):
 
     from . import sound
 
-    sound.init()
+    with startup_profile.timed("init", "sound"):
+        sound.init()
 
     # Enable importing stuff directly from ./thirdparty,
     # Since we include lots of dependancies
     # that would normally be provided by the system.
     # This must be done before CherryPy
     # Thhese happpen early so we cab start logging stuff soon
+    core_import_start = time.time()
     from . import (
         ManageUsers,  # noqa: F401
         alerts,  # noqa: F401
@@ -156,6 +161,10 @@ def initialize(config: dict[str, Any] | None = None):
     )
     from .chandler import resource_type  # noqa
 
+    startup_profile.record(
+        "init", "core imports", time.time() - core_import_start
+    )
+
     def handle_error(f):
         # If we can, try to send the exception back whence it came
         try:
@@ -203,14 +212,18 @@ def initialize(config: dict[str, Any] | None = None):
 
     os.makedirs(os.path.join(directories.vardir, "static"), exist_ok=True)
 
-    auth.initializeAuthentication()
+    with startup_profile.timed("init", "auth"):
+        auth.initializeAuthentication()
     logger.info("Loaded auth data")
 
-    plugin_system.load_plugins()
-    plugin_system.load_user_plugins()
+    with startup_profile.timed("init", "plugins"):
+        plugin_system.load_plugins()
+    with startup_profile.timed("init", "user plugins"):
+        plugin_system.load_user_plugins()
 
     # Load all modules from the active modules directory
-    modules.initModules()
+    with startup_profile.timed("init", "modules"):
+        modules.initModules()
     logger.info("Loaded modules")
 
     try:
@@ -226,8 +239,12 @@ def initialize(config: dict[str, Any] | None = None):
     except Exception:
         logger.exception("error setting process title")
 
-    taken = round(time.time() - start_time, 2)
-    logger.info(f"initialize() took {taken}s")
+    taken = time.time() - start_time
+    logger.info(f"initialize() took {round(taken, 2)}s")
+
+    fn = os.path.join(directories.logdir, "startup_profile.txt")
+    startup_profile.write_report(fn, taken)
+    logger.info(f"Startup profile written to {fn}")
 
 
 def start_server():
@@ -1,8 +1,10 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 # File for keeping track of and editing kaithem modules(not python modules)
+import concurrent.futures
 import copy
 import gc
+import hashlib
 import logging
 import os
 import re
@@ -15,12 +17,21 @@ from collections.abc import Callable
 from io import BytesIO
 from typing import Any
 
+import msgpack
 import structlog
 import yaml
 
 from kaithem.src.validation_util import validate_args
 
-from . import auth, directories, messagebus, modules_state, pages, util
+from . import (
+    auth,
+    directories,
+    messagebus,
+    modules_state,
+    pages,
+    plugin_system,
+    util,
+)
 from .modules_state import (
     ResourceDictType,
     check_forbidden,
@@ -35,11 +46,31 @@ from .modules_state import (
 
 logger = structlog.get_logger(__name__)
 
+# Module folders are read and parsed this many at a time at startup
+MODULE_LOAD_THREADS = 8
+
+# libyaml is much faster, when it's available
+yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Bump whenever parsing or normalizing resource files changes,
+# to discard everything cached by older versions.
+RESOURCE_CACHE_VERSION = 1
+
 
 def loadAllCustomResourceTypes() -> None:
     # TODO this is O(m * n) time. Is that bad?
     start_time = time.time()
 
+    # Lazy plugins for types that are actually used have to be loaded first
+    plugin_system.require_resource_types(
+        {
+            r["resource"].get("type", "")
+            for m in modules_state.ActiveModules.values()
+            for r in m.values()
+            if hasattr(r, "get") and "resource" in r
+        }
+    )
+
     types: list[tuple[float, str]] = []
     for key, typeobj in resource_types.items():
         types.append((typeobj.priority, key))
@@ -114,16 +145,57 @@ def readResourceFromFile(
     with open(fn, "rb") as f:
         d = f.read().decode("utf-8")
 
-    x = readResourceFromData(d, relative_name, ver, filename=fn)
     # logger.debug("Loaded resource from file "+fn)
-    original = copy.deepcopy(x[0])
+    return readResourceFromData(d, relative_name, ver, filename=fn)
 
-    if not (x[0] == original):
-        logger.info(
-            f"Resource {x[1]} is in an older format and should be migrated to the new file type"
-        )
-    # For now don't break anything by actually changing the data.
-    return (original, x[1])
+
+def _resource_cache_fn(folder: str) -> str:
+    h = hashlib.sha256(os.path.abspath(folder).encode()).hexdigest()[:32]
+    return os.path.join(directories.cachedir, "resources", f"{h}.msgpack")
+
+
+def loadResourceCache(folder: str) -> dict[str, list[Any]]:
+    """Parsed resource files from the last time a module folder was read.
+    Maps relative filename to [mtime_ns, size, resource name, packed data]"""
+    try:
+        with open(_resource_cache_fn(folder), "rb") as f:
+            d = msgpack.unpackb(f.read(), raw=False)
+        if d["version"] == RESOURCE_CACHE_VERSION and d["folder"] == (
+            os.path.abspath(folder)
+        ):
+            return d["files"]
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.exception(f"Discarding bad resource cache for {folder}")
+    return {}
+
+
+def saveResourceCache(folder: str, files: dict[str, list[Any]]) -> None:
+    fn = _resource_cache_fn(folder)
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        d = {
+            "version": RESOURCE_CACHE_VERSION,
+            "folder": os.path.abspath(folder),
+            "files": files,
+        }
+        with open(f"{fn}~", "wb") as f:
+            f.write(msgpack.packb(d))
+        os.replace(f"{fn}~", fn)
+    except Exception:
+        logger.exception(f"Could not save resource cache for {folder}")
+
+
+def _pack_resource(r: ResourceDictType) -> bytes | None:
+    "None if msgpack can't exactly round trip it, like YAML dates"
+    try:
+        b = msgpack.packb(r)
+        if msgpack.unpackb(b, raw=False) == r:
+            return b
+    except Exception:
+        pass
+    return None
 
 
 # Backwards compatible resource loader.
@@ -157,7 +229,7 @@ def readResourceFromData(
 
                 r = tomllib.loads(d)
             else:
-                r = yaml.load(sections[0], Loader=yaml.SafeLoader)
+                r = yaml.load(sections[0], Loader=yaml_loader)
 
             # Catch new style save files
             if len(sections) > 1:
@@ -233,30 +305,66 @@ def initModules() -> None:
 
 
 def loadModules(modulesdir: str) -> None:
-    "Load all modules in the given folder to RAM."
+    """Load all modules in the given folder to RAM.
+
+    The folders are read and parsed in a thread pool, but added to
+    ActiveModules one at a time in the same order as loading them serially.
+    """
     logger.debug(f"Loading modules from {modulesdir}")
-    for i in util.get_immediate_subdirectories(modulesdir):
-        loadModule(os.path.join(modulesdir, i), util.unurl(i))
+    start_time = time.time()
 
-    for i in os.listdir(modulesdir):
-        try:
-            if not i.endswith(".location"):
-                continue
-            if not os.path.isfile(os.path.join(modulesdir, i)):
-                continue
-            # Read ythe location we are supposed to load from
-            with open(os.path.join(modulesdir, i)) as f:
-                s = f.read(4096)
-            # Get rid of the .location, then set the location in the dict
-            with modulesLock:
-                external_module_locations[util.unurl(i[0:-9])] = s
-            # We use the ignore func when loading ext modules
-            loadModule(s, util.unurl(i[0:-9]), detect_ignorable)
-        except Exception:
-            messagebus.post_message(
-                "/system/notifications/errors",
-                f" Error loading external module: {traceback.format_exc(4)}",
+    with concurrent.futures.ThreadPoolExecutor(
+        MODULE_LOAD_THREADS, thread_name_prefix="ModuleLoader"
+    ) as pool:
+        local = [
+            (
+                util.unurl(i),
+                pool.submit(scanModule, os.path.join(modulesdir, i)),
             )
+            for i in util.get_immediate_subdirectories(modulesdir)
+        ]
+
+        external = []
+        for i in os.listdir(modulesdir):
+            try:
+                if not i.endswith(".location"):
+                    continue
+                if not os.path.isfile(os.path.join(modulesdir, i)):
+                    continue
+                # Read ythe location we are supposed to load from
+                with open(os.path.join(modulesdir, i)) as f:
+                    s = f.read(4096)
+                # We use the ignore func when loading ext modules
+                external.append(
+                    (
+                        util.unurl(i[0:-9]),
+                        s,
+                        pool.submit(scanModule, s, detect_ignorable),
+                    )
+                )
+            except Exception:
+                messagebus.post_message(
+                    "/system/notifications/errors",
+                    f" Error loading external module: {traceback.format_exc(4)}",
+                )
+
+        for name, f in local:
+            insertModule(name, f.result())
+
+        for name, location, f in external:
+            try:
+                # Get rid of the .location, then set the location in the dict
+                with modulesLock:
+                    external_module_locations[name] = location
+                insertModule(name, f.result())
+            except Exception:
+                messagebus.post_message(
+                    "/system/notifications/errors",
+                    f" Error loading external module: {traceback.format_exc(4)}",
+                )
+
+    taken = round(time.time() - start_time, 2)
+    logger.info(f"Read {len(local) + len(external)} modules in {taken}s")
 
 
 def detect_ignorable(path: str) -> bool:
@@ -298,108 +406,144 @@ def loadModule(
     """Load a single module but don't bookkeep it and actually init everything with resource types.
     Used by loadModules"""
     logger.debug(f"Attempting to load module {modulename}")
+    insertModule(modulename, scanModule(folder, ignore_func, resource_folder))
 
+
+def scanModule(
+    folder: str,
+    ignore_func: Callable[[str], bool] | None = None,
+    resource_folder: str | None = None,
+) -> dict[str, ResourceDictType]:
+    """Read all the resources in a module folder, without touching any
+    global state, so many modules can be scanned at once."""
     if not resource_folder:
         resource_folder = os.path.join(folder, "__filedata__")
 
-    with modulesLock:
-        # Make an empty dict to hold the module resources
-        module: dict[str, ResourceDictType] = {}
-
-        for t in resource_types:
-            found = resource_types[t].scan_dir(folder)
-            for rn in found:
-                rsc = modules_state.normalize_resource_data(found[rn])
-                module[rn] = rsc
-
-        # Iterate over all resource files and load them
-        for root, dirs, files in os.walk(folder):
-            # Function used to ignore things like VCS folders and such
-            if ignore_func and ignore_func(root):
+    # Make an empty dict to hold the module resources
+    module: dict[str, ResourceDictType] = {}
+
+    # Unchanged resource files are not parsed again
+    cache = loadResourceCache(folder)
+    new_cache: dict[str, list[Any]] = {}
+
+    for t in resource_types:
+        found = resource_types[t].scan_dir(folder)
+        for rn in found:
+            rsc = modules_state.normalize_resource_data(found[rn])
+            module[rn] = rsc
+
+    # Iterate over all resource files and load them
+    for root, dirs, files in os.walk(folder):
+        # Function used to ignore things like VCS folders and such
+        if ignore_func and ignore_func(root):
+            continue
+        if root.startswith(resource_folder):
+            continue
+
+        # Handle all resources that have unusual file types.
+
+        # TODO multiple storage types for one
+        # Name mean we can have conflicts, detect and warn
+        for i in dirs:
+            if "/__" not in i:
+                for t in resource_types:
+                    abs = os.path.join(root, i)
+                    rel = os.path.relpath(abs, folder)
+                    found = resource_types[t].scan_dir(abs)
+                    found = copy.deepcopy(found)
+
+                    for rn in found:
+                        rsc = modules_state.normalize_resource_data(found[rn])
+                        if rel:
+                            module[rel + "/" + rn] = rsc
+                        else:
+                            module[rn] = rsc
+
+        for i in files:
+            relfn = os.path.relpath(os.path.join(root, i), folder)
+            fn = os.path.join(folder, relfn)
+            if ignore_func and ignore_func(i):
                 continue
-            if root.startswith(resource_folder):
-                continue
-
-            # Handle all resources that have unusual file types.
-
-            # TODO multiple storage types for one
-            # Name mean we can have conflicts, detect and warn
-            for i in dirs:
-                if "/__" not in i:
-                    for t in resource_types:
-                        abs = os.path.join(root, i)
-                        rel = os.path.relpath(abs, folder)
-                        found = resource_types[t].scan_dir(abs)
-                        found = copy.deepcopy(found)
-
-                        for rn in found:
-                            rsc = modules_state.normalize_resource_data(
-                                found[rn]
-                            )
-                            if rel:
-                                module[rel + "/" + rn] = rsc
-                            else:
-                                module[rn] = rsc
-
-            for i in files:
-                relfn = os.path.relpath(os.path.join(root, i), folder)
-                fn = os.path.join(folder, relfn)
-                if ignore_func and ignore_func(i):
-                    continue
 
-                if "/." in fn:
-                    continue
+            if "/." in fn:
+                continue
 
-                if fn.endswith((".yaml", ".json", ".toml")):
+            if fn.endswith((".yaml", ".json", ".toml")):
+                try:
+                    # TODO: Lib modules? filedata?
+                    # Load the resource and add it to the dict. Resouce names are urlencodes in filenames.
                     try:
-                        # TODO: Lib modules? filedata?
-                        # Load the resource and add it to the dict. Resouce names are urlencodes in filenames.
-                        try:
+                        st = os.stat(fn)
+                        c = cache.get(relfn)
+                        if c and c[:2] == [st.st_mtime_ns, st.st_size]:
+                            resourcename = c[2]
+                            r = msgpack.unpackb(c[3], raw=False)
+                            new_cache[relfn] = c
+                        else:
                             r, resourcename = readResourceFromFile(fn, relfn)
-                            if not r or not resourcename:
-                                # File managers sprinkle this crap around
-                                if not os.path.basename(fn) == ".directory":
-                                    logger.exception(f"Null loading {fn}")
-                                continue
-
-                        except Exception:
-                            logger.exception(f"Error loading {fn}")
-                            continue
-
-                        module[resourcename] = r
-                        if "resource" not in r or "type" not in r["resource"]:
-                            logger.warning(
-                                f"No resource type found for {resourcename}"
-                            )
+                            if r and resourcename:
+                                b = _pack_resource(r)
+                                if b is not None:
+                                    new_cache[relfn] = [
+                                        st.st_mtime_ns,
+                                        st.st_size,
+                                        resourcename,
+                                        b,
+                                    ]
+
+                        if not r or not resourcename:
+                            # File managers sprinkle this crap around
+                            if not os.path.basename(fn) == ".directory":
+                                logger.exception(f"Null loading {fn}")
                             continue
 
                     except Exception:
-                        messagebus.post_message(
-                            "/system/notifications/errors",
-                            f"Error loading from: {fn}\r\n{traceback.format_exc()}",
+                        logger.exception(f"Error loading {fn}")
+                        continue
+
+                    module[resourcename] = r
+                    if "resource" not in r or "type" not in r["resource"]:
+                        logger.warning(
+                            f"No resource type found for {resourcename}"
                         )
-                        raise
+                        continue
 
-            for i in dirs:
-                if ignore_func and ignore_func(i):
-                    continue
-                relfn = os.path.relpath(os.path.join(root, i), folder)
-                fn = os.path.join(folder, relfn)
-                if "/__filedata__/" in fn or fn.endswith("/__filedata__"):
-                    continue
+                except Exception:
+                    messagebus.post_message(
+                        "/system/notifications/errors",
+                        f"Error loading from: {fn}\r\n{traceback.format_exc()}",
+                    )
+                    raise
 
-                # Create a directory resource for the dirrctory
-                module[util.unurl(relfn)] = {"resource": {"type": "directory"}}
+        for i in dirs:
+            if ignore_func and ignore_func(i):
+                continue
+            relfn = os.path.relpath(os.path.join(root, i), folder)
+            fn = os.path.join(folder, relfn)
+            if "/__filedata__/" in fn or fn.endswith("/__filedata__"):
+                continue
 
-        if "__metadata__" not in module:
-            module["__metadata__"] = {
-                "resource": {
-                    "type": "module_metadata",
-                    "modified": int(time.time()),
-                },
-                "description": "",
-            }
+            # Create a directory resource for the dirrctory
+            module[util.unurl(relfn)] = {"resource": {"type": "directory"}}
+
+    if "__metadata__" not in module:
+        module["__metadata__"] = {
+            "resource": {
+                "type": "module_metadata",
+                "modified": int(time.time()),
+            },
+            "description": "",
+        }
 
+    if new_cache != cache:
+        saveResourceCache(folder, new_cache)
+
+    return module
+
+
+def insertModule(modulename: str, module: dict[str, ResourceDictType]):
+    "Add a scanned module to ActiveModules, in RAM only"
+    with modulesLock:
         scopes[modulename] = ModuleObject(modulename)
         modules_state.ActiveModules[modulename] = module
         modules_state.importFiledataFolderStructure(modulename)
@@ -586,6 +730,7 @@ def rmResource(
             fr = os.path.join(getModuleDir(module), "__filedata__", resource)
             if os.path.isfile(fr):
                 os.remove(fr)
+                modules_state.forgetFileDigests(fr)
             else:
                 logger.warning(
                     f"Resource {resource} not found in module {module}"
@@ -746,6 +891,7 @@ def rmModule(module: str, message: str = "deleted") -> None:
     if module not in external_module_locations:
         if os.path.exists(fn):
             shutil.rmtree(fn)
+            modules_state.forgetFileDigests(fn)
 
     modules_state.recalcModuleHashes()
     # Get rid of any garbage cycles associated with the event.
@@ -797,6 +943,8 @@ def handleResourceChange(
         if t == "module-description":
             pass
         else:
+            if t not in resource_types:
+                plugin_system.require_resource_types([t])
             if t not in resource_types:
                 logger.warning(
                     f"Unknown resource type {t} for resource {resource} in module {module}"
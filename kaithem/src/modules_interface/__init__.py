@@ -20,6 +20,7 @@ from .. import (
     modules,
     modules_state,
     pages,
+    plugin_system,
     quart_app,
     util,
 )
@@ -103,6 +104,7 @@ def actions(module, dir):
         pages.require("system_admin")
     except PermissionError:
         return pages.loginredirect(pages.geturl())
+    plugin_system.require_module_actions()
     return pages.render_jinja_template(
         "modules/module_actions.j2.html",
         name=module,
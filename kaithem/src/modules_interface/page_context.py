@@ -4,7 +4,14 @@ import weakref
 import structlog
 from scullery import scheduling
 
-from kaithem.src import modules, modules_state, pages, unitsofmeasure, util
+from kaithem.src import (
+    modules,
+    modules_state,
+    pages,
+    plugin_system,
+    unitsofmeasure,
+    util,
+)
 from kaithem.src.modules_state import get_resource_label_image_url, in_folder
 from kaithem.src.util import url
 
@@ -86,6 +93,7 @@ module_page_context = {
     "scheduling": scheduling,
     "modules_state": modules_state,
     "modules": modules,
+    "plugin_system": plugin_system,
     "os": os,
     "weakref": weakref,
     "getDesc": getDesc,
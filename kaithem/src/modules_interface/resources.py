@@ -24,6 +24,7 @@ from kaithem.src import (
     modules,
     modules_state,
     pages,
+    plugin_system,
     quart_app,
     util,
 )
@@ -140,6 +141,7 @@ def addresource(module, type):
             hidden_inputs={"dir": path},
         )
     else:
+        plugin_system.require_resource_types([type])
         return modules_state.resource_types[type].create_page(module, path)
 
 
@@ -1,47 +1,204 @@
+import bisect
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from typing import Any
+
 import quart
 
 from kaithem.src import modules_state, pages, quart_app
 
-searchable = {"event": ["setup", "trigger", "action"], "page": ["body"]}
+# Matches in the resource name count for this many matches in the content
+NAME_WEIGHT = 10
+
+# Ranked results are kept for paging through them
+RESULT_CACHE_SIZE = 32
+
+_token_re = re.compile(r"\w+")
+
+# Parts of snake_case, camelCase, and HTTPServer style identifiers,
+# and runs of digits
+_subword_re = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(s: str) -> list[str]:
+    "Words in a search query"
+    return _token_re.findall(s.lower())
+
+
+def index_terms(s: str) -> list[str]:
+    """Words to index, plus the parts of any identifiers,
+    so searching for pump finds turn_on_pump and pumpLevel."""
+    terms = []
+    for word in _token_re.findall(s):
+        terms.append(word.lower())
+        parts = _subword_re.findall(word)
+        if len(parts) > 1:
+            terms.extend(i.lower() for i in parts)
+    return terms
+
+
+def _strings(x: Any) -> Iterator[str]:
+    "Every string in a resource, including dict keys"
+    if isinstance(x, str):
+        yield x
+    elif isinstance(x, dict):
+        for k, v in x.items():
+            yield str(k)
+            yield from _strings(v)
+    elif isinstance(x, list | tuple):
+        for i in x:
+            yield from _strings(i)
+    elif x is not None:
+        yield str(x)
+
+
+class SearchIndex:
+    """In memory inverted index of every word in every resource.
+
+    Rather than needing every piece of code that changes ActiveModules
+    to tell the index, it is brought up to date before each search by
+    comparing which resource objects are currently in ActiveModules
+    against the ones that were indexed, which is just an identity check
+    per resource. Resources are replaced, not modified in place,
+    when saved.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # (module, resource) -> (indexed object, term weights)
+        self.docs: dict[tuple[str, str], tuple[Any, dict[str, int]]] = {}
+        self.postings: dict[str, dict[tuple[str, str], int]] = {}
+        self._terms: list[str] | None = None
+        self.results: OrderedDict[
+            tuple[str | None, str], list[tuple[str, str]]
+        ] = OrderedDict()
+
+    def _add(self, key: tuple[str, str], obj: Any):
+        weights: dict[str, int] = {}
+        for t in index_terms(key[1]):
+            weights[t] = weights.get(t, 0) + NAME_WEIGHT
+        for s in _strings(obj):
+            for t in index_terms(s):
+                weights[t] = weights.get(t, 0) + 1
+
+        self.docs[key] = (obj, weights)
+        for t, w in weights.items():
+            if t not in self.postings:
+                self.postings[t] = {}
+                self._terms = None
+            self.postings[t][key] = w
+
+    def _remove(self, key: tuple[str, str]):
+        _obj, weights = self.docs.pop(key)
+        for t in weights:
+            p = self.postings[t]
+            p.pop(key, None)
+            if not p:
+                del self.postings[t]
+                self._terms = None
+
+    def sync(self):
+        "Reindex resources that were added, replaced, or deleted"
+        with modules_state.modulesLock:
+            current = {
+                (m, r): obj
+                for m, resources in modules_state.ActiveModules.items()
+                for r, obj in resources.items()
+            }
+
+        with self.lock:
+            changed = False
+            for key in list(self.docs):
+                if current.get(key) is not self.docs[key][0]:
+                    self._remove(key)
+                    changed = True
+            for key, obj in current.items():
+                if key not in self.docs:
+                    self._add(key, obj)
+                    changed = True
+            if changed:
+                self.results.clear()
+
+    def _matching(self, token: str) -> dict[tuple[str, str], float]:
+        "Scores of every resource with a word starting with token"
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+
+        scores: dict[tuple[str, str], float] = {}
+        i = bisect.bisect_left(self._terms, token)
+        while i < len(self._terms) and self._terms[i].startswith(token):
+            t = self._terms[i]
+            # Whole word matches rank above prefix matches
+            mul = 2 if t == token else 1
+            for key, w in self.postings[t].items():
+                scores[key] = scores.get(key, 0) + w * mul
+            i += 1
+        return scores
+
+    def search(
+        self, search: str, module: str | None = None
+    ) -> list[tuple[str, str]]:
+        """All (module, resource) pairs containing every word in search,
+        or a word starting with it, best matches first."""
+        self.sync()
+        tokens = tokenize(search)
+
+        with self.lock:
+            k = (module, " ".join(tokens))
+            if k in self.results:
+                self.results.move_to_end(k)
+                return self.results[k]
+
+            if not tokens:
+                scores = {i: 0.0 for i in self.docs}
+            else:
+                scores = self._matching(tokens[0])
+                for t in tokens[1:]:
+                    if not scores:
+                        break
+                    m = self._matching(t)
+                    scores = {i: scores[i] + m[i] for i in scores if i in m}
+
+            if module is not None:
+                scores = {i: v for i, v in scores.items() if i[0] == module}
+
+            r = sorted(scores, key=lambda i: (-scores[i], i))
+            self.results[k] = r
+            if len(self.results) > RESULT_CACHE_SIZE:
+                self.results.popitem(last=False)
+            return r
+
+
+index = SearchIndex()
 
 
 def searchModules(search, max_results=100, start=0, mstart=0):
-    pointer = mstart
-    results = []
-    x = [None, None]
-    for i in sorted(modules_state.ActiveModules.keys(), reverse=True)[mstart:]:
-        x = searchModuleResources(i, search, max_results, start)
-        if x[0]:
-            results.append((i, x[0]))
-        max_results -= len(x[0])
-        start = 0
-        pointer += 1
-        if not max_results:
-            return (results, max(0, pointer - 1), x[1])
-    return (results, max(0, pointer - 1), x[1])
+    """Search every module. Returns a list of (module, resources) with
+    the modules in order of their best result, 0, and the start
+    of the next page, or 0 if there isn't one.
+
+    mstart is no longer used, paging is by position in the ranked
+    results across all modules.
+    """
+    r = index.search(search)
+    page = r[start : start + max_results]
+    nxt = start + len(page) if start + len(page) < len(r) else 0
+
+    grouped: dict[str, list[str]] = {}
+    for m, res in page:
+        grouped.setdefault(m, []).append(res)
+    return (list(grouped.items()), 0, nxt)
 
 
 def searchModuleResources(modulename, search, max_results=100, start=0):
-    search = search.lower()
-    m = modules_state.ActiveModules[modulename]
-    results = []
-    pointer = start
-    for i in sorted(m.keys(), reverse=True)[start:]:
-        if not max_results > 0:
-            return (results, pointer)
-        pointer += 1
-        if m[i]["resource"]["type"] in searchable:
-            if search in i.lower():
-                results.append(i)
-                max_results -= 1
-                continue
-            for j in searchable[m[i]["resource"]["type"]]:
-                x = str(m[i][j]).lower().find(search)
-                if x > 0:
-                    results.append(i)
-                    max_results -= 1
-                    break
-    return (results, pointer)
+    """Search one module. Returns the ranked resource names,
+    and the start of the next page, or 0 if there isn't one."""
+    r = index.search(search, modulename)
+    page = r[start : start + max_results]
+    nxt = start + len(page) if start + len(page) < len(r) else 0
+    return ([i[1] for i in page], nxt)
 
 
 @quart_app.app.route("/modules/search/<module>", methods=["POST"])
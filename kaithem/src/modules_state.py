@@ -278,7 +278,9 @@ def writeResource(
             f.flush()
             os.fsync(f.fileno())
 
-            return fn
+        # The mtime may not change if written twice in quick succession
+        forgetFileDigests(fn)
+        return fn
 
 
 @validate_args
@@ -418,6 +420,7 @@ def rawDeleteResource(m: str, r: str, type: str | None = None) -> None:
         for i in os.listdir(dir):
             if i.startswith(r + "."):
                 os.remove(os.path.join(dir, i))
+                forgetFileDigests(os.path.join(dir, i))
 
         recalcModuleHashes()
 
@@ -509,6 +512,11 @@ moduleshash = "000000000000000000000000"
 modulehashes: dict[str, str] = {}
 modulewordhashes: dict[str, str] = {}
 
+# Absolute path -> (mtime_ns, size, sha256) of every file in a module
+# that has been hashed.
+file_digests: dict[str, tuple[int, int, bytes]] = {}
+file_digests_lock = threading.RLock()
+
 
 def hashModules() -> str:
     try:
@@ -561,9 +569,9 @@ def getModuleWordHash(m: str) -> str:
 
 def recalcModuleHashes() -> None:
     global moduleshash, modulehashes, modulewordhashes
-    moduleshash = hashModules()
     modulehashes = {}
     modulewordhashes = {}
+    moduleshash = hashModules()
 
 
 def recalcOneModuleHashDeferred(m: str) -> None:
@@ -635,14 +643,56 @@ def getModuleAsYamlZip(module: str) -> Iterable[bytes]:
     return stream_zip(member_files(module))
 
 
+def fileDigest(fn: str) -> bytes:
+    """SHA256 of a file's content. Digests are cached until the
+    file's mtime or size changes, or it is written through writeResource"""
+    st = os.stat(fn)
+    x = file_digests.get(fn)
+    if x and x[0] == st.st_mtime_ns and x[1] == st.st_size:
+        return x[2]
+
+    h = hashlib.sha256()
+    for d in iter_fc(fn):
+        h.update(d)
+    file_digests[fn] = (st.st_mtime_ns, st.st_size, h.digest())
+    return h.digest()
+
+
+def forgetFileDigests(fn: str) -> None:
+    "Drop cached digests for a file, or everything under a directory"
+    fn = os.path.normpath(fn)
+    prefix = fn + os.sep
+    with file_digests_lock:
+        for i in list(file_digests):
+            if i == fn or i.startswith(prefix):
+                file_digests.pop(i, None)
+
+
 def hashModule(module: str) -> str:
+    """Hash of the module as a tree of per file digests, so only files
+    that changed since the last hash have to be read again."""
     x = hashlib.sha256()
     x.update(module.encode())
-    for i in member_files(module):
-        x.update(b"\0" * 32)
-        x.update(i[0].encode())
-        for d in i[4]:
-            x.update(d)
+    dir = os.path.normpath(getModuleDir(module))
+    seen: set[str] = set()
+
+    with file_digests_lock:
+        for root, dirs, files in deterministic_walk(dir):
+            for i in files:
+                fn = os.path.join(root, i)
+                if "./" in fn or ".\\" in fn:
+                    continue
+                seen.add(fn)
+                x.update(b"\0" * 32)
+                x.update(f"{module}/{os.path.relpath(fn, dir)}".encode())
+                x.update(fileDigest(fn))
+
+        # Files deleted by other means than rmResource
+        prefix = dir + os.sep
+        for i in list(file_digests):
+            if i.startswith(prefix) and i not in seen:
+                file_digests.pop(i, None)
+
     return base64.b32encode(x.digest()[:16]).decode().upper().replace("=", "")
 
 
@@ -187,11 +187,8 @@ def require(permission: str | list[str]):
             noCrossSite()
 
         # If the special __guest__ user can do it, anybody can.
-        if "__guest__" in auth.Users:
-            if permission in auth.Users["__guest__"].permissions:
-                return
-            if "__all_permissions__" in auth.Users["__guest__"].permissions:
-                return
+        if auth.guestAllPermissions or permission in auth.guestPermissions:
+            return
 
         if not auth.canUserDoThis(user, permission):
             raise KaithemUserPermissionError(permission)
@@ -298,6 +295,46 @@ def getAcessingUser(asgi=None, quart_req=None) -> str:
     """Return the username of the user making the request bound to this thread or __guest__ if not logged in.
     The result of this function can be trusted because it uses the authentication token.
     """
+    if asgi:
+        scope = asgi
+    else:
+        quart_req = quart_req or quart.request
+        if not quart_req:
+            return "__no_request__"
+        scope = quart_req.scope
+
+    # Only look it up once per request or websocket connection,
+    # unless users, tokens or permissions change in the meantime.
+    v = auth.authVersion
+    x = scope.get("kaithem.user")
+    if x and x[0] == v:
+        return x[1]
+
+    user = _findAccessingUser(asgi, quart_req)
+    scope["kaithem.user"] = (v, user)
+    return user
+
+
+def _origin_allowed(user: str, headers: dict[str, str], host: str) -> bool:
+    """False if the request comes from another site's page,
+    unless the user has allow-cors set"""
+    if auth.getUserSetting(user, "allow-cors"):
+        return True
+    # ASGI header names are lowercase
+    origin = headers.get("Origin", "") or headers.get("origin", "")
+    if not origin:
+        return True
+    x = (
+        origin.replace("http://", "")
+        .replace("https://", "")
+        .replace("ws://", "")
+        .replace("wss://", "")
+    )
+    # Cherrypy and tornado compatibility
+    return host in (x, origin)
+
+
+def _findAccessingUser(asgi=None, quart_req=None) -> str:
     # Handle HTTP Basic Auth
 
     if asgi:
@@ -312,10 +349,6 @@ def getAcessingUser(asgi=None, quart_req=None) -> str:
         host = headers["host"]
 
     else:
-        quart_req = quart_req or quart.request
-        if not quart_req:
-            return "__no_request__"
-
         headers = dict(quart_req.headers)
         cookie = quart_req.cookies
         host = quart_req.host
@@ -327,13 +360,14 @@ def getAcessingUser(asgi=None, quart_req=None) -> str:
             b = base64.b64decode(x[1]).decode()
             b = b.split(";")
 
-            # Get token using username and password
-            auth.userLogin(b[0], b[1])
-            # Check the credentials of that token
+            # Check username and password, recently verified
+            # credentials are cached.
             try:
-                return auth.whoHasToken(cookie["kaithem_auth"])
-            except KeyError:
-                return "__guest__"
+                if auth.cachedUserLogin(b[0], b[1]) == "failure":
+                    return "__guest__"
+                if not _origin_allowed(b[0], headers, host):
+                    return "__guest__"
+                return b[0]
             except Exception:
                 logging.exception("Error finding accessing user")
                 return "__guest__"
@@ -343,19 +377,8 @@ def getAcessingUser(asgi=None, quart_req=None) -> str:
         return "__guest__"
     try:
         user = auth.whoHasToken(cookie["kaithem_auth"])
-        if not auth.getUserSetting(user, "allow-cors"):
-            if headers.get("Origin", ""):
-                x = (
-                    headers.get("Origin", "")
-                    .replace("http://", "")
-                    .replace("https://", "")
-                    .replace("ws://", "")
-                    .replace("wss://", "")
-                )
-                x2 = headers.get("Origin", "")
-                # Cherrypy and tornado compatibility
-                if host not in (x, x2):
-                    return "__guest__"
+        if not _origin_allowed(user, headers, host):
+            return "__guest__"
         return user
 
     except KeyError:
@@ -9,12 +9,16 @@ import sys
 import threading
 import time
 import traceback
+from collections.abc import Iterable
+from typing import Any
 
+import quart
 import structlog
+import yaml
 
 from kaithem.src.print_thread_tracebacks import watchdog
 
-from . import directories, messagebus, pathsetup, schemas
+from . import directories, messagebus, pathsetup, schemas, startup_profile
 
 logger = structlog.get_logger(__name__)
 logger.setLevel(logging.INFO)
@@ -35,16 +39,74 @@ plugin_metadata_schema = schemas.get_validator("plugin_metadata")
 
 interfaces: dict[str, type[BasePluginInterface]] = {}
 
+# Plugins with lazy: true in their plugin_metadata.yaml that have not
+# been imported yet, name -> (module name or spec, metadata)
+lazy_plugins: dict[
+    str, tuple[str | importlib.machinery.ModuleSpec, dict[str, Any]]
+] = {}
+lazy_lock = threading.RLock()
+
+
+def read_plugin_metadata(folder: str) -> dict[str, Any]:
+    "The plugin_metadata.yaml of a plugin folder, or {} if there is none"
+    fn = os.path.join(folder, "plugin_metadata.yaml")
+    if not os.path.isfile(fn):
+        return {}
+    with open(fn) as f:
+        d = yaml.safe_load(f) or {}
+    plugin_metadata_schema.validate(d)
+    return d
+
 
 def get_providers(
     service: str,
 ) -> list[BasePluginInterface]:
     """Returns a list of modules that provide the named service"""
+    for i in _lazy_providing("services", service):
+        load_lazy_plugin(i)
     if service in providers:
         return list([i[1] for i in providers[service]])
     return []
 
 
+def import_plugin(m: str | importlib.machinery.ModuleSpec):
+    "Import a plugin in the current thread and register its services"
+    t = time.monotonic()
+    name = m if isinstance(m, str) else m.name
+
+    if isinstance(m, str):
+        plugins[m] = importlib.import_module(m)
+        foo = plugins[m]
+
+    else:
+        # creates a new module based on spec
+        foo = importlib.util.module_from_spec(m)
+
+        # executes the module in its own namespace
+        # when a module is imported or reloaded.
+        assert m.loader
+        m.loader.exec_module(foo)
+        plugins[m.name] = foo
+
+    if hasattr(foo, "plugin_services"):
+        services: list[BasePluginInterface] = foo.plugin_services
+        if isinstance(services, list):
+            for i in services:
+                if not isinstance(i, BasePluginInterface):
+                    raise TypeError(f"Plugin {m} has invalid service {i}")
+                if i in providers:
+                    providers[i.service].append((i.priority, i))
+                else:
+                    providers[i.service] = [(i.priority, i)]
+                providers[i.service].sort(reverse=True)
+        else:
+            logger.error(f"Plugin {m} has invalid services list.")
+
+    taken = time.monotonic() - t
+    startup_profile.record("plugin", name, taken)
+    logger.info(f"Loaded {m} in {round(taken * 1000, 2)}ms")
+
+
 def import_in_thread(m: str | importlib.machinery.ModuleSpec):
     e = threading.Event()
     e.set()
@@ -55,43 +117,8 @@ def import_in_thread(m: str | importlib.machinery.ModuleSpec):
         watchdog(wdt_evt, f"Timed out importing {m}")
 
         try:
-            t = time.monotonic()
-
-            if isinstance(m, str):
-                plugins[m] = importlib.import_module(m)
-                foo = plugins[m]
-
-            else:
-                # creates a new module based on spec
-                foo = importlib.util.module_from_spec(m)
-
-                # executes the module in its own namespace
-                # when a module is imported or reloaded.
-                assert m.loader
-                m.loader.exec_module(foo)
-                plugins[m.name] = foo
-
-            if hasattr(foo, "plugin_services"):
-                services: list[BasePluginInterface] = foo.plugin_services
-                if isinstance(services, list):
-                    for i in services:
-                        if not isinstance(i, BasePluginInterface):
-                            raise TypeError(  # noqa: TRY301
-                                f"Plugin {m} has invalid service {i}"
-                            )
-                        if i in providers:
-                            providers[i.service].append((i.priority, i))
-                        else:
-                            providers[i.service] = [(i.priority, i)]
-                        providers[i.service].sort(reverse=True)
-                else:
-                    logger.error(f"Plugin {m} has invalid services list.")
-
+            import_plugin(m)
             evs.remove(e)
-
-            logger.info(
-                f"Loaded {m} in {round((time.monotonic() - t) * 1000, 2)}ms"
-            )
             wdt_evt.set()
 
         except Exception:
@@ -107,6 +134,96 @@ def import_in_thread(m: str | importlib.machinery.ModuleSpec):
     ).start()
 
 
+def add_lazy_plugin(
+    m: str | importlib.machinery.ModuleSpec, metadata: dict[str, Any]
+):
+    """Register a plugin to be imported when one of the resource types,
+    routes, services, or module actions in its metadata is first used"""
+    name = m if isinstance(m, str) else m.name
+    with lazy_lock:
+        lazy_plugins[name] = (m, metadata)
+
+    from . import quart_app
+
+    for prefix in metadata.get("routes", []):
+        # Real routes are more specific than a path converter and
+        # take priority over this once the plugin is loaded
+        quart_app.app.add_url_rule(
+            f"{prefix}<path:path>",
+            f"lazy_plugin:{name}:{prefix}",
+            _lazy_route_handler(name),
+            methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
+        )
+
+
+def _lazy_route_handler(name: str):
+    def f(path: str):
+        if load_lazy_plugin(name):
+            # The plugin's own route handles it now
+            return quart.redirect(quart.request.full_path.rstrip("?"), 307)
+        quart.abort(404)
+
+    return f
+
+
+def load_lazy_plugin(name: str) -> bool:
+    "Import a lazy plugin now. Returns True if this call imported it."
+    with lazy_lock:
+        if name not in lazy_plugins:
+            return False
+        m, _metadata = lazy_plugins.pop(name)
+        try:
+            import_plugin(m)
+        except Exception:
+            logger.exception(f"Error loading plugin {name}")
+            messagebus.post_message(
+                "/system/notifications/errors",
+                f"Error loading plugin {name}\n" + traceback.format_exc(),
+            )
+            return False
+        return True
+
+
+def _lazy_providing(key: str, value: str) -> list[str]:
+    if not lazy_plugins:
+        return []
+    with lazy_lock:
+        return [
+            name
+            for name, (_m, metadata) in lazy_plugins.items()
+            if value in metadata.get(key, ())
+        ]
+
+
+def require_resource_types(types: Iterable[str]) -> None:
+    "Load any lazy plugins that provide these resource types"
+    for t in types:
+        for i in _lazy_providing("resource_types", t):
+            load_lazy_plugin(i)
+
+
+def require_module_actions() -> None:
+    "Load any lazy plugins that add module actions"
+    with lazy_lock:
+        names = [
+            name
+            for name, (_m, metadata) in lazy_plugins.items()
+            if metadata.get("module_actions")
+        ]
+    for i in names:
+        load_lazy_plugin(i)
+
+
+def lazy_resource_types() -> dict[str, dict[str, str]]:
+    "Resource types of lazy plugins not loaded yet, with title and mdi_icon"
+    with lazy_lock:
+        return {
+            k: v
+            for _m, metadata in lazy_plugins.values()
+            for k, v in metadata.get("resource_types", {}).items()
+        }
+
+
 def load_plugins():
     try:
         for i in os.listdir(pathsetup.startupPluginsPath):
@@ -114,8 +231,19 @@ def load_plugins():
                 # Very important to use the full name, not just add it to path,
                 # or it would not know that it was the same module we might
                 # import elsewhere
-
-                import_in_thread("kaithem.src.plugins." + i)
+                name = "kaithem.src.plugins." + i
+                try:
+                    metadata = read_plugin_metadata(
+                        os.path.join(pathsetup.startupPluginsPath, i)
+                    )
+                except Exception:
+                    logger.exception(f"Invalid plugin metadata for {i}")
+                    metadata = {}
+
+                if metadata.get("lazy"):
+                    add_lazy_plugin(name, metadata)
+                else:
+                    import_in_thread(name)
 
         # Search every module on the import path
         for i in sys.path:
@@ -171,7 +299,11 @@ def load_user_plugins():
                             submodule_search_locations=[p],
                         )
                         assert spec
-                        import_in_thread(spec)
+                        metadata = read_plugin_metadata(p)
+                        if metadata.get("lazy"):
+                            add_lazy_plugin(spec, metadata)
+                        else:
+                            import_in_thread(spec)
                     except Exception:
                         logger.exception("Error in user plugin")
 
@@ -1,20 +1,31 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import concurrent.futures
+import contextlib
+import csv
 import datetime
 import getpass
+import heapq
+import io
 import json
+import math
 import os
+import queue
 import shutil
 import socket
 import sqlite3
+import tempfile
 import threading
 import time
 import traceback
 import weakref
-from collections.abc import Callable
+import zipfile
+from collections.abc import Callable, Iterator
+from typing import Any
 from urllib.parse import quote
 
 import dateutil.parser
+import numpy
 import pytz
 import quart
 import structlog
@@ -72,6 +83,41 @@ def ts_to_iso(t):
     )
 
 
+def iso_to_ts(s: str | float) -> float:
+    if isinstance(s, int | float):
+        return float(s)
+    d = datetime.datetime.fromisoformat(s)
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=datetime.UTC)
+    return d.timestamp()
+
+
+# Version 1 stored time as ISO strings, with no index.
+# Version 2 stores a float UNIX timestamp, indexed with the channel.
+SCHEMA_VERSION = 2
+
+# Rows moved per transaction when migrating an old database
+MIGRATION_BATCH_SIZE = 5000
+
+# Idle read connections kept open per database
+READ_POOL_SIZE = 4
+
+# Rollup tiers as (period, retention) in seconds.  Every numeric record
+# is also summarized into one row per period, which is kept for much
+# longer than the raw data usually is.
+ROLLUP_TIERS = (
+    (60, 90 * 24 * 3600),
+    (3600, 3 * 365 * 24 * 3600),
+    (24 * 3600, 30 * 365 * 24 * 3600),
+)
+
+# Rows read from the database, and sent to the client, at a time
+EXPORT_CHUNK_ROWS = 2000
+
+# Upper limit on how finely one aggregate query can split its range
+MAX_AGGREGATE_BUCKETS = 10000
+
+
 class TagLogger:
     """Base class for the object associated with one tag point for logging
     a specific type(min,max,avg,etc) of data from that tag"""
@@ -97,6 +143,7 @@ class TagLogger:
             raise ValueError("target not supported: " + target)
 
         self.target = target
+        self.tag_name = tag.name
 
         self.accumVal = self.defaultAccum
         self.accumCount = 0
@@ -121,8 +168,8 @@ class TagLogger:
     def insertData(self, d):
         self.h.insertData(d)
 
-    def clearOldData(self, force=False):
-        "Only called by the historian, that's why we can reuse the connection and do everything in one transaction"
+    def clearOldData(self, conn: sqlite3.Connection, force=False):
+        "Only called by the historian, inside the transaction it uses to flush"
         if not self.history_length:
             return
 
@@ -130,92 +177,192 @@ class TagLogger:
         if time.time() < 1597447271:
             return
 
-        with self.h.lock:
-            conn = sqlite3.Connection(self.filename)
+        cutoff = time.time() - self.history_length
 
-            c = conn.cursor()
-            c.execute(
-                "SELECT count(*) FROM record WHERE channel=? AND time<?",
-                (
-                    self.chID,
-                    ts_to_iso(time.time() - self.history_length),
-                ),
+        c = conn.execute(
+            "SELECT count(*) FROM record WHERE channel=? AND time<?",
+            (self.chID, cutoff),
+        )
+        count = c.fetchone()[0]
+
+        # Only delete records in large blocks. To do otherwise would create too much disk wear
+        if count > 8192 if not force else 1024:
+            conn.execute(
+                "DELETE FROM record WHERE channel=? AND time<?",
+                (self.chID, cutoff),
             )
-            count = c.fetchone()[0]
-
-            # Only delete records in large blocks. To do otherwise would create too much disk wear
-            if count > 8192 if not force else 1024:
-                c.execute(
-                    "DELETE FROM record WHERE channel=? AND time<?",
-                    (
-                        self.chID,
-                        ts_to_iso(time.time() - self.history_length),
-                    ),
-                )
-            conn.close()
 
-    def getDataRange(self, minTime, maxTime, maxRecords=10000):
-        with self.h.lock:
-            d = []
-            conn = sqlite3.Connection(self.filename)
+    def _pending_in_range(self, minTime, maxTime):
+        # Best-effort attempt to include recent stuff that isn't flushed yet.
+        # The list is swapped out whole when flushing, never modified,
+        # so iterating a copy is safe without a lock.
+        return [
+            (i[1], i[2])
+            for i in list(self.h.pending_data_items)
+            if i[0] == self.chID and minTime <= i[1] <= maxTime
+        ]
 
-            c = conn.cursor()
-            c.execute(
+    def getDataRange(self, minTime, maxTime, maxRecords=10000):
+        with self.h.reader() as conn:
+            d = conn.execute(
                 "SELECT time,value FROM record WHERE time>? AND time<? AND channel=? ORDER BY time ASC LIMIT ?",
-                (ts_to_iso(minTime), ts_to_iso(maxTime), self.chID, maxRecords),
-            )
-            for i in c:
-                d.append(i)
-
-            x = []
-            for safety_counter in range(10):
-                x = []
-                # Best-effort attempt to include recent stuff.
-                # We don't want to use another lock and slow stuff down
-                try:
-                    for i in self.h.pending_data_items:
-                        if i[0] == self.chID:
-                            if i[1] >= minTime and i[1] <= maxTime:
-                                x.append((i[1], i[2]))
-                    break
-                # Can fail due to iterationerror, we don't lock the pending list,
-                # We just hope we can finish very fast.
-                except Exception:
-                    raise
-            conn.close()
+                (minTime, maxTime, self.chID, maxRecords),
+            ).fetchall()
 
-            return (d + x)[:maxRecords]
+        return (d + self._pending_in_range(minTime, maxTime))[:maxRecords]
 
     def getRecent(self, minTime, maxTime, maxRecords=10000):
-        with self.h.lock:
-            d = []
-            conn = sqlite3.Connection(self.filename)
-
-            c = conn.cursor()
-            c.execute(
+        with self.h.reader() as conn:
+            d = conn.execute(
                 "SELECT time,value FROM record WHERE time>? AND time<? AND channel=? ORDER BY time DESC LIMIT ?",
-                (ts_to_iso(minTime), ts_to_iso(maxTime), self.chID, maxRecords),
+                (minTime, maxTime, self.chID, maxRecords),
+            ).fetchall()
+
+        x = self._pending_in_range(minTime, maxTime)
+        return (list(reversed(d)) + x)[-maxRecords:]
+
+    def iterDataRange(self, minTime, maxTime):
+        """Every record in the range, oldest first.
+
+        Records are read a batch at a time, and the connection goes back
+        to the pool between batches.  A slow consumer then holds neither
+        a pooled reader nor a read transaction, which would stop the WAL
+        from being checkpointed."""
+        # Resume after the last (time, rowid), times need not be unique
+        last = (minTime, -1)
+        while True:
+            with self.h.reader() as conn:
+                rows = conn.execute(
+                    "SELECT time,value,rowid FROM record WHERE channel=? "
+                    "AND (time,rowid)>(?,?) AND time<? "
+                    "ORDER BY time ASC, rowid ASC LIMIT ?",
+                    (self.chID, *last, maxTime, EXPORT_CHUNK_ROWS),
+                ).fetchall()
+
+            for t, v, _rowid in rows:
+                yield t, v
+            if len(rows) < EXPORT_CHUNK_ROWS:
+                break
+            last = (rows[-1][0], rows[-1][2])
+
+        yield from sorted(self._pending_in_range(minTime, maxTime))
+
+    def getAggregates(self, minTime, maxTime, buckets=500):
+        """Split the range into equal time buckets, and return
+        (bucket start, min, max, mean, last, count) for every bucket
+        with data in it, so the cost of drawing a chart depends on
+        its width, not how much data is in the range.
+
+        When the bucket width is a whole number of rollup tier periods,
+        the coarsest such tier supplies every tier row that lies entirely
+        inside one bucket, which also makes them available after the raw
+        records have expired.  The rest of each bucket, where a tier row
+        straddles a bucket edge or the ends of the range, is read from
+        raw records.
+
+        Only meaningful for numeric channels.
+        """
+        buckets = max(1, min(int(buckets), MAX_AGGREGATE_BUCKETS))
+        if maxTime <= minTime:
+            return []
+        width = (maxTime - minTime) / buckets
+
+        tier = 0
+        for period, _retention in ROLLUP_TIERS:
+            n = round(width / period)
+            if n and abs(width - n * period) < period * 1e-9:
+                tier = period
+
+        params = {
+            "ch": self.chID,
+            "min": minTime,
+            "max": maxTime,
+            "width": width,
+            "tier": tier,
+            # Tier rows start on multiples of the period
+            "origin": minTime - minTime % tier if tier else minTime,
+            # Float slack when checking a row ends before a bucket edge
+            "eps": 0.001,
+        }
+
+        def fits(start: str) -> str:
+            "SQL for whether the tier row starting at start is used"
+            return f"""({start} >= :min AND {start} + :tier <= :max
+                AND {start} + :tier <= :min + :eps + :width *
+                    (CAST(({start} - :min) / :width AS INTEGER) + 1))"""
+
+        # The row with max(time) supplies the bare value column,
+        # but only if it is the only min or max in the query.
+        # So the last values are found in a separate pass.
+        def grouped(source, lo, hi, total, n, t, last) -> str:
+            return f"""
+                SELECT a.b, a.lo, a.hi, a.total, l.t, l.last, a.n FROM
+                (SELECT CAST((time - :min) / :width AS INTEGER) AS b,
+                    min({lo}) AS lo, max({hi}) AS hi,
+                    total({total}) AS total, total({n}) AS n
+                    FROM {source} GROUP BY b) AS a
+                JOIN
+                (SELECT CAST((time - :min) / :width AS INTEGER) AS b,
+                    max({t}) AS t, {last} AS last
+                    FROM {source} GROUP BY b) AS l
+                ON a.b = l.b
+            """
+
+        raw = """(SELECT time, value FROM record
+            WHERE channel=:ch AND time>=:min AND time<:max)"""
+        queries = []
+        if tier:
+            tier_rows = f"""(SELECT * FROM rollup
+                WHERE tier=:tier AND channel=:ch AND {fits("time")})"""
+            queries.append(
+                grouped(
+                    tier_rows, "lo", "hi", "total", "n", "last_time", "last"
+                )
+            )
+            # Only the records that are not in a tier row used above
+            row_start = (
+                ":origin + :tier * CAST((time - :origin) / :tier AS INTEGER)"
             )
-            for i in c:
-                d.append(i)
-
-            x = []
-            for safety_counter in range(15):
-                x = []
-                # Best-effort attempt to include recent stuff.
-                # We don't want to use another lock and slow stuff down
-                try:
-                    for i in self.h.pending_data_items:
-                        if i[0] == self.chID:
-                            if i[1] >= minTime and i[1] <= maxTime:
-                                x.append((i[1], i[2]))
-                    break
-                # Can fail due to iterationerror, we don't lock the pending list,
-                # We just hope we can finish very fast.
-                except Exception:
-                    raise
-
-            return (list(reversed(d)) + x)[-maxRecords:]
+            raw = f"(SELECT * FROM {raw} WHERE NOT {fits(row_start)})"
+
+        queries.append(
+            grouped(raw, "value", "value", "value", "1", "time", "value")
+        )
+
+        rows = []
+        with self.h.reader() as conn:
+            for q in queries:
+                rows.extend(conn.execute(q, params).fetchall())
+
+        # Bucket number: [min, max, sum, last time, last value, count]
+        acc: dict[int, list] = {}
+
+        def merge(b, lo, hi, total, t, last, n):
+            # Rounding can put something right at maxTime one past the end
+            b = min(b, buckets - 1)
+            if b not in acc:
+                acc[b] = [lo, hi, total, t, last, n]
+                return
+            a = acc[b]
+            a[0] = min(a[0], lo)
+            a[1] = max(a[1], hi)
+            a[2] += total
+            if t >= a[3]:
+                a[3] = t
+                a[4] = last
+            a[5] += n
+
+        for i in rows:
+            merge(*i)
+
+        for t, v in self._pending_in_range(minTime, maxTime):
+            if t < maxTime:
+                merge(int((t - minTime) / width), v, v, v, t, v, 1)
+
+        return [
+            (minTime + b * width, a[0], a[1], a[2] / a[5], a[4], int(a[5]))
+            for b, a in sorted(acc.items())
+        ]
 
     def __del__(self):
         try:
@@ -259,48 +406,30 @@ class TagLogger:
         self.accumVal = self.defaultAccum
 
     def getChannelID(self, tag):
-        # Either get our stored channel name, or create a new onw
-        with self.h.lock:
-            # Have to make our own, we are in a new thread now.
-            conn = sqlite3.Connection(self.filename)
-            conn.row_factory = sqlite3.Row
-
-            c = conn.cursor()
-            c.execute(
-                "SELECT id,name,unit,accumulate from channel WHERE name=?",
-                (tag.name,),
-            )
-            self.chID = None
+        if not isinstance(tag.unit, str):
+            raise ValueError("bad tag unit " + str(tag.unit))
 
-            if not isinstance(tag.unit, str):
-                raise ValueError("bad tag unit " + str(tag.unit))
+        if not isinstance(self.accumType, str):
+            raise ValueError("bad tag accum " + str(self.accumType))
 
-            if not isinstance(self.accumType, str):
-                raise ValueError("bad tag accum " + str(self.accumType))
+        key = (tag.name, tag.unit, self.accumType)
 
-            for i in c:
-                if (
-                    i["name"] == tag.name
-                    and i["unit"] == tag.unit
-                    and i["accumulate"] == self.accumType
-                ):
-                    self.chID = i["id"]
-
-            if not self.chID:
+        # Either get our stored channel name, or create a new onw
+        def f(conn: sqlite3.Connection):
+            q = "SELECT id from channel WHERE name=? AND unit=? AND accumulate=?"
+            c = conn.execute(q, key)
+            x = c.fetchone()
+            if x:
+                return x[0]
+
+            with conn:
                 conn.execute(
                     "INSERT INTO channel VALUES (?,?,?,?,?)",
-                    (None, tag.name, tag.unit, self.accumType, "{}"),
+                    (None, *key, "{}"),
                 )
-                conn.commit()
+            return conn.execute(q, key).fetchone()[0]
 
-            c = conn.cursor()
-            c.execute(
-                "SELECT id from channel WHERE name=? AND unit=? AND accumulate=?",
-                (tag.name, tag.unit, self.accumType),
-            )
-            self.chID = c.fetchone()[0]
-
-            conn.close()
+        self.chID = self.h.run_in_writer(f)
 
 
 class AverageLogger(TagLogger):
@@ -427,31 +556,13 @@ class TagHistorian:
         self.lock = threading.RLock()
         self.children: dict[int, weakref.ReferenceType[TagLogger]] = {}
 
+        # Readers don't block the writer and the writer doesn't block readers.
+        self.history.execute("PRAGMA journal_mode=WAL")
+
         self.history.execute(
             """CREATE TABLE IF NOT EXISTS channel  (id INTEGER PRIMARY KEY AUTOINCREMENT,
             name text, unit text, accumulate text, metadata text)"""
         )
-        self.history.execute(
-            """CREATE TABLE IF NOT EXISTS record  (channel INTEGER,
-            time TEXT, value REAL, FOREIGN KEY(channel) REFERENCES channel(id))"""
-        )
-
-        self.history.execute(
-            """CREATE VIEW IF NOT EXISTS SimpleViewLocalTime AS SELECT
-            channel.name as Channel,
-            channel.accumulate as Type,
-            record.time as LocalTime,
-              record.value as Value,
-              channel.unit as Unit FROM record INNER JOIN channel ON channel.id = record.channel;"""
-        )
-        self.history.execute(
-            """CREATE VIEW IF NOT EXISTS SimpleViewUTC AS SELECT
-              channel.name as Channel,
-              channel.accumulate as Type,
-              record.time as UTCTime,
-              record.value as Value,
-              channel.unit as Unit FROM record INNER JOIN channel ON channel.id = record.channel;"""
-        )
 
         # TODO: Legacy compatibility
         try:
@@ -462,10 +573,27 @@ class TagHistorian:
         except Exception:
             pass
 
+        self.setup_schema(self.history)
+
         self.pending_data_items = []
+        self._pending_lock = threading.Lock()
 
         self.history.close()
 
+        # All writes go through one thread that owns the only
+        # write connection, so statements stay prepared between flushes.
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self.writer_thread = threading.Thread(
+            target=self._writer_loop,
+            name=f"TagHistorianWriter:{os.path.basename(file)}",
+            daemon=True,
+        )
+        self.writer_thread.start()
+
+        self._readers: queue.SimpleQueue[sqlite3.Connection] = (
+            queue.SimpleQueue()
+        )
+
         self.lastFlushed = time.time()
 
         self.lastGarbageCollected = 0
@@ -482,8 +610,233 @@ class TagHistorian:
         self.flusher_f = f
         self.flusher = scheduling.scheduler.every_minute(f)
 
+        self.migration_thread: threading.Thread | None = None
+        if self.legacy_records_pending():
+            self.migration_thread = threading.Thread(
+                target=self.migrate_legacy_records,
+                name="TagHistorianMigration",
+                daemon=True,
+            )
+            self.migration_thread.start()
+
+    def setup_schema(self, conn: sqlite3.Connection):
+        """Create the current schema.  Records from version 1, which
+        stored ISO time strings, are set aside in record_v1 to be moved
+        into the new table in the background."""
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        tables = {
+            i[0]
+            for i in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        }
+
+        # Views would follow the table through the rename
+        conn.execute("DROP VIEW IF EXISTS SimpleViewLocalTime")
+        conn.execute("DROP VIEW IF EXISTS SimpleViewUTC")
+
+        if version < SCHEMA_VERSION and "record" in tables:
+            if "record_v1" in tables:
+                raise RuntimeError(
+                    f"{self.filename} has two versions of the record table"
+                )
+            conn.execute("ALTER TABLE record RENAME TO record_v1")
+
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS record  (channel INTEGER,
+            time REAL, value REAL, FOREIGN KEY(channel) REFERENCES channel(id))"""
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS record_channel_time "
+            "ON record(channel, time)"
+        )
+
+        # One row per channel per tier period, holding a summary
+        # of all records in that period
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS rollup (tier INTEGER,
+            channel INTEGER, time REAL, lo REAL, hi REAL, total REAL,
+            n INTEGER, last REAL, last_time REAL,
+            PRIMARY KEY (tier, channel, time)) WITHOUT ROWID"""
+        )
+
+        conn.execute(
+            """CREATE VIEW IF NOT EXISTS SimpleViewLocalTime AS SELECT
+            channel.name as Channel,
+            channel.accumulate as Type,
+            strftime('%Y-%m-%dT%H:%M:%f', record.time, 'unixepoch', 'localtime') as LocalTime,
+              record.value as Value,
+              channel.unit as Unit FROM record INNER JOIN channel ON channel.id = record.channel;"""
+        )
+        conn.execute(
+            """CREATE VIEW IF NOT EXISTS SimpleViewUTC AS SELECT
+              channel.name as Channel,
+              channel.accumulate as Type,
+              strftime('%Y-%m-%dT%H:%M:%fZ', record.time, 'unixepoch') as UTCTime,
+              record.value as Value,
+              channel.unit as Unit FROM record INNER JOIN channel ON channel.id = record.channel;"""
+        )
+
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+    def legacy_records_pending(self) -> bool:
+        conn = sqlite3.Connection(self.filename)
+        try:
+            c = conn.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type='table' AND name='record_v1'"
+            )
+            return c.fetchone() is not None
+        finally:
+            conn.close()
+
+    def migrate_legacy_records(self):
+        """Move records from the version 1 table into the new one in
+        small batches, newest first, so recent history is usable
+        right away and flushes can run in between batches."""
+
+        def f(conn: sqlite3.Connection):
+            with conn:
+                return self._migrate_batch(conn)
+
+        try:
+            while not self.run_in_writer(f):
+                time.sleep(0.05)
+            logger.info(f"Finished migrating {self.filename}")
+        except Exception:
+            logger.exception(f"Error migrating {self.filename}")
+
+    def _migrate_batch(self, conn: sqlite3.Connection) -> bool:
+        "Migrate one batch, returns True if there was nothing left"
+        rows = conn.execute(
+            "SELECT rowid, channel, time, value FROM record_v1 "
+            "ORDER BY rowid DESC LIMIT ?",
+            (MIGRATION_BATCH_SIZE,),
+        ).fetchall()
+
+        if not rows:
+            conn.execute("DROP TABLE record_v1")
+            return True
+
+        converted = []
+        for _rowid, channel, t, value in rows:
+            try:
+                converted.append((channel, iso_to_ts(t), value))
+            except Exception:
+                # Nothing we could query anyway
+                logger.warning(f"Dropping record with bad time {t!r}")
+
+        conn.executemany("INSERT INTO record VALUES (?,?,?)", converted)
+        self.update_rollups(conn, converted)
+        conn.execute("DELETE FROM record_v1 WHERE rowid >= ?", (rows[-1][0],))
+        return False
+
+    def update_rollups(self, conn: sqlite3.Connection, rows):
+        "Fold new (channel, time, value) rows into every rollup tier"
+        # (tier, channel, period start): [min, max, sum, count, last, last time]
+        acc: dict[tuple[int, int, float], list] = {}
+        for channel, t, v in rows:
+            # NaN would be stored as NULL, and poison min and max
+            if not isinstance(v, int | float) or v != v:
+                continue
+            for period, _retention in ROLLUP_TIERS:
+                k = (period, channel, t - t % period)
+                a = acc.get(k)
+                if a is None:
+                    acc[k] = [v, v, v, 1, v, t]
+                    continue
+                a[0] = min(a[0], v)
+                a[1] = max(a[1], v)
+                a[2] += v
+                a[3] += 1
+                if t >= a[5]:
+                    a[4] = v
+                    a[5] = t
+
+        conn.executemany(
+            """INSERT INTO rollup VALUES (?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(tier, channel, time) DO UPDATE SET
+                lo = min(lo, excluded.lo),
+                hi = max(hi, excluded.hi),
+                total = total + excluded.total,
+                n = n + excluded.n,
+                last = CASE WHEN excluded.last_time >= last_time
+                    THEN excluded.last ELSE last END,
+                last_time = max(last_time, excluded.last_time)""",
+            [(*k, *a) for k, a in acc.items()],
+        )
+
+    def clear_old_rollups(self, conn: sqlite3.Connection):
+        # Attempt to detect impossible times indicating the clock is wrong.
+        if time.time() < 1597447271:
+            return
+        for period, retention in ROLLUP_TIERS:
+            conn.execute(
+                "DELETE FROM rollup WHERE tier=? AND time<?",
+                (period, time.time() - retention),
+            )
+
+    def _writer_loop(self):
+        conn = sqlite3.Connection(self.filename)
+        # Safe with WAL, and much less fsyncing on SD cards
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        while True:
+            f, future = self._jobs.get()
+            if f is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(f(conn))
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                future.set_exception(e)
+
+        conn.close()
+
+    def run_in_writer(self, f: Callable[[sqlite3.Connection], Any]) -> Any:
+        "Run f(connection) in the writer thread and wait for the result"
+        future = concurrent.futures.Future()
+        self._jobs.put((f, future))
+        return future.result()
+
+    @contextlib.contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        "Borrow a read only connection from the pool"
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.Connection(self.filename, check_same_thread=False)
+            conn.execute("PRAGMA query_only = 1")
+
+        try:
+            yield conn
+        finally:
+            # Don't leave a read transaction open, it would
+            # stop the WAL from being checkpointed.
+            if conn.in_transaction:
+                conn.rollback()
+            if self._readers.qsize() < READ_POOL_SIZE:
+                self._readers.put(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        "Stop the writer and close all connections, without flushing"
+        self.flusher.unregister()
+        messagebus.unsubscribe("/system/save", self.forceFlush)
+        self._jobs.put((None, None))
+        self.writer_thread.join()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
     def insertData(self, d):
-        self.pending_data_items.append(d)
+        with self._pending_lock:
+            self.pending_data_items.append(d)
 
     def forceFlush(self):
         self.flush(True)
@@ -505,35 +858,33 @@ class TagHistorian:
             # The reason is that we could have a change immediately followed by another change,
             # and it is important that we eventually
             # record that new change.
+            children = []
             for i in self.children:
                 x = self.children[i]()
                 if x:
+                    children.append(x)
                     if x.accumCount:
                         x.flush(force)
 
+        with self._pending_lock:
             pending_data = self.pending_data_items
             self.pending_data_items = []
-            # Hopefully let any other threads finish
-            # inserting into the old list . Note that here we consider very rarely losing a record
-            # to be better than bad performace
 
-            for i in range(30):
-                time.sleep(0.001)
+        def write(conn: sqlite3.Connection):
+            with conn:
+                if needsGC:
+                    for x in children:
+                        x.clearOldData(conn, force)
+
+                conn.executemany(
+                    "INSERT INTO record VALUES (?,?,?)", pending_data
+                )
+                self.update_rollups(conn, pending_data)
 
-            self.history = sqlite3.Connection(self.filename)
-            with self.history:
                 if needsGC:
-                    for i in self.children:
-                        x = self.children[i]()
-                        if x:
-                            x.clearOldData(force)
-
-                for i in pending_data:
-                    self.history.execute(
-                        "INSERT INTO record VALUES (?,?,?)",
-                        (i[0], ts_to_iso(i[1]), i[2]),
-                    )
-            self.history.close()
+                    self.clear_old_rollups(conn)
+
+        self.run_in_writer(write)
 
 
 try:
@@ -692,57 +1043,236 @@ t = os.path.join(os.path.dirname(__file__), "html", "logpage.html")
 def logpage(path: str = "", **kwargs):
     pages.require("system_admin")
     path = "/" + path
+
+    # Cost depends only on the number of buckets, so GET is fine
+    if "buckets" in kwargs:
+        return aggregate_query(path, kwargs)
+
     # This page could be slow because of the db stuff, so we restrict it more
     if not quart.request.method.lower() == "post":
         raise RuntimeError("POST only")
 
-    if "exportRows" not in kwargs:
+    if "exportFormat" not in kwargs:
         return pages.get_template(t).render(tagName=path, data=kwargs)
     else:
-        tag = tagpoints.allTags[path]()
-        if tag is None:
-            raise RuntimeError("This tag seems to no longer exist")
-
-        for key, i in tag.configLoggers.items():
-            assert isinstance(i, TagLogger)
-            if i.accumType == kwargs["exportType"]:
-                tz = pytz.timezone("Etc/UTC")
-                logtime = tz.localize(
-                    dateutil.parser.parse(kwargs["logtime"])
-                ).timestamp()
-                raw = i.getDataRange(
-                    logtime, time.time() + 10000000, int(kwargs["exportRows"])
-                )
+        return export_response(path, kwargs)
 
-                if kwargs["exportFormat"] == "csv.iso":
-                    filename = (
-                        path.replace("/", "_")
-                        .replace(".", "_")
-                        .replace(":", "_")[1:]
-                        + "_"
-                        + kwargs["exportType"]
-                        + tz.localize(
-                            dateutil.parser.parse(kwargs["logtime"])
-                        ).isoformat()
-                        + ".csv"
-                    )
 
-                    d = [
-                        "Time(ISO), "
-                        + path.replace(",", "")
-                        + " <accum "
-                        + kwargs["exportType"]
-                        + ">"
-                    ]
-                    for i in raw:
-                        d.append(str(i[0]) + "," + str(i[1])[:128])
-                    return quart.Response(
-                        "\r\n".join(d) + "\r\n",
-                        content_type="text/csv",
-                        headers={
-                            "Content-Disposition": "attachment; filename="
-                            + filename
+def find_logger(tag_name: str, accum: str) -> TagLogger:
+    tag = tagpoints.allTags[tag_name]()
+    if tag is None:
+        raise RuntimeError("This tag seems to no longer exist")
+
+    for i in tag.configLoggers.values():
+        assert isinstance(i, TagLogger)
+        if i.accumType == accum:
+            return i
+
+    raise RuntimeError(f"Logger not found for {tag_name}")
+
+
+def export_rows(
+    loggers: list[TagLogger], minTime, maxTime, maxRows: int = 0
+) -> Iterator[tuple[float, list]]:
+    """Records from several loggers merged on time.  There is a row for
+    every time any of them logged, with each logger's most recent value
+    as of that time, or None before its first record."""
+
+    def stream(n: int, lg: TagLogger):
+        for t, v in lg.iterDataRange(minTime, maxTime):
+            yield t, n, v
+
+    streams = [stream(n, lg) for n, lg in enumerate(loggers)]
+    current: list = [None] * len(loggers)
+    row_time = None
+    count = 0
+
+    for t, n, v in heapq.merge(*streams, key=lambda x: x[0]):
+        if row_time is not None and t != row_time:
+            yield row_time, list(current)
+            count += 1
+            if maxRows and count >= maxRows:
+                return
+        current[n] = v
+        row_time = t
+
+    if row_time is not None:
+        yield row_time, current
+
+
+def export_csv(
+    loggers: list[TagLogger], minTime, maxTime, maxRows: int = 0
+) -> Iterator[str]:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\r\n")
+    w.writerow(
+        ["Time(ISO)"] + [f"{i.tag_name} <accum {i.accumType}>" for i in loggers]
+    )
+
+    for n, (t, values) in enumerate(
+        export_rows(loggers, minTime, maxTime, maxRows)
+    ):
+        w.writerow(
+            [ts_to_iso(t)] + ["" if v is None else str(v)[:128] for v in values]
+        )
+        if n % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue()
+
+
+class _ChunkWriter(io.RawIOBase):
+    "Unseekable file that just collects what is written to it"
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        x = b"".join(self.chunks)
+        self.chunks.clear()
+        return x
+
+
+def export_npz(
+    loggers: list[TagLogger], minTime, maxTime, maxRows: int = 0
+) -> Iterator[bytes]:
+    """A NumPy .npz archive with one float64 array per column, "time" as
+    UNIX timestamps, and the values of each tag under its name.
+    Values that aren't numbers, or from before a tag's first record,
+    are NaN.
+
+    The rows are read in a single pass, spooling each column to its own
+    temporary file, so memory use doesn't depend on the size of the
+    export and every column has the same rows."""
+
+    def as_float(v):
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return math.nan
+
+    columns = ["time"] + [i.tag_name.strip("/") for i in loggers]
+
+    with contextlib.ExitStack() as stack:
+        spools = [
+            stack.enter_context(tempfile.TemporaryFile()) for i in columns
+        ]
+        count = 0
+        chunk: list[list[float]] = []
+
+        def spool_chunk():
+            a = numpy.array(chunk, dtype="<f8").reshape(-1, len(columns))
+            for col, f in enumerate(spools):
+                f.write(a[:, col].tobytes())
+            chunk.clear()
+
+        for t, values in export_rows(loggers, minTime, maxTime, maxRows):
+            chunk.append([t] + [as_float(v) for v in values])
+            count += 1
+            if len(chunk) >= EXPORT_CHUNK_ROWS:
+                spool_chunk()
+        spool_chunk()
+
+        sink = _ChunkWriter()
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+            for name, spool in zip(columns, spools):
+                spool.seek(0)
+                with zf.open(name + ".npy", "w", force_zip64=True) as f:
+                    numpy.lib.format.write_array_header_1_0(
+                        f,
+                        {
+                            "descr": "<f8",
+                            "fortran_order": False,
+                            "shape": (count,),
                         },
                     )
+                    while data := spool.read(EXPORT_CHUNK_ROWS * 8):
+                        f.write(data)
+                        yield sink.take()
+                yield sink.take()
+
+        yield sink.take()
+
+
+export_formats = {
+    "csv.iso": (export_csv, "text/csv", ".csv"),
+    "npz": (export_npz, "application/octet-stream", ".npz"),
+}
+
+
+def export_response(path: str, kwargs: dict):
+    """Stream an export of the tag's history, plus any other tags listed
+    in exportTags, separated by commas.  exportRows limits the number of
+    rows, blank or 0 for no limit."""
+    accum = kwargs["exportType"]
+    names = [path] + [
+        tagpoints.normalize_tag_name(i)
+        for i in kwargs.get("exportTags", "").split(",")
+        if i.strip()
+    ]
+    loggers = [find_logger(i, accum) for i in names]
+
+    tz = pytz.timezone("Etc/UTC")
+    start = tz.localize(dateutil.parser.parse(kwargs["logtime"]))
+    max_rows = int(kwargs.get("exportRows") or 0)
+
+    f, content_type, ext = export_formats[kwargs["exportFormat"]]
+
+    filename = (
+        path.replace("/", "_").replace(".", "_").replace(":", "_")[1:]
+        + "_"
+        + accum
+        + start.isoformat()
+        + ext
+    )
+
+    rows = f(loggers, start.timestamp(), time.time() + 10000000, max_rows)
+    return quart.Response(
+        quart.utils.run_sync_iterable(rows),
+        content_type=content_type,
+        headers={"Content-Disposition": "attachment; filename=" + filename},
+    )
+
+
+def aggregate_query(path: str, kwargs: dict):
+    """Chart data for a tag as JSON, with one entry per bucket.
+    Takes buckets, usually the chart's width in pixels, plus optional
+    start and end as UNIX timestamps, defaulting to the last hour,
+    and type, the accumulate mode of the logger to read."""
+    tag = tagpoints.allTags[path]()
+    if tag is None:
+        raise RuntimeError("This tag seems to no longer exist")
+
+    end = float(kwargs.get("end") or time.time())
+    start = float(kwargs.get("start") or end - 3600)
+    accum = kwargs.get("type", "latest")
+
+    for i in tag.configLoggers.values():
+        assert isinstance(i, TagLogger)
+        if i.accumType == accum:
+            rows = i.getAggregates(start, end, int(kwargs["buckets"]))
+            return quart.jsonify(
+                {
+                    "tag": tag.name,
+                    "type": accum,
+                    "start": start,
+                    "end": end,
+                    "time": [r[0] for r in rows],
+                    "min": [r[1] for r in rows],
+                    "max": [r[2] for r in rows],
+                    "avg": [r[3] for r in rows],
+                    "last": [r[4] for r in rows],
+                    "count": [r[5] for r in rows],
+                }
+            )
 
-        raise RuntimeError("Logger not found")
+    raise RuntimeError("Logger not found")
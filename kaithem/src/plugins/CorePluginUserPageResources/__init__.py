@@ -2,9 +2,13 @@
 from __future__ import annotations
 
 # This file handles the display of user-created pages
+import asyncio
+import concurrent.futures
+import contextvars
 import copy
 import functools
 import gc
+import hashlib
 import importlib
 import mimetypes
 import os
@@ -63,6 +67,37 @@ errors = {}
 _pages_by_module_resource: dict[str, dict[str, CompiledPage]] = {}
 _page_list_lock = threading.Lock()
 
+RENDER_THREADS_SETTING = "core/page_render_threads"
+
+settings_overrides.set_description(
+    RENDER_THREADS_SETTING,
+    "Max user pages rendering at once, default 8. Takes effect on restart.",
+)
+
+# Max cached outputs per page, for pages with cache_seconds set
+PAGE_CACHE_SIZE = 64
+
+_render_pool: concurrent.futures.ThreadPoolExecutor | None = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Page templates and code run here, so slow pages can't block the
+    event loop, or use up the threads other sync handlers need."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            try:
+                n = int(settings_overrides.get_val(RENDER_THREADS_SETTING) or 8)
+            except ValueError:
+                logger.exception(f"Invalid {RENDER_THREADS_SETTING} setting")
+                n = 8
+            _render_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(n, 1), thread_name_prefix="UserPageRender"
+            )
+        return _render_pool
+
+
 # Used for including builtin components
 component_lookup = TemplateLookup(
     directories=[
@@ -212,6 +247,10 @@ class CompiledPageAPIObject:
         self.page = p
         self.url = url_for_resource(p.module, p.resourceName)
 
+    def clear_cache(self):
+        "Discard cached output, for pages using cache_seconds"
+        self.page.clear_cache()
+
 
 class CompiledPage:
     def __init__(self, resource, m="unknown", r="unknown"):
@@ -236,6 +275,13 @@ class CompiledPage:
         self.theme: str
         self.errors: list[tuple[float, str, str]] = []
 
+        # Rendered output, for pages with cache_seconds set. Maps request
+        # path, args and user to (expires, etag, body, content type).
+        # Editing the page makes a new CompiledPage, discarding it.
+        self.cache_seconds = 0.0
+        self.output_cache: dict[tuple, tuple[float, str, bytes, str]] = {}
+        self.output_cache_lock = threading.Lock()
+
         # This API is available as 'page' from within
         # Mako template code.   It's main use is for self modifying pages
 
@@ -250,6 +296,8 @@ class CompiledPage:
                 self.permissions = []
 
             self.theme = resource.get("theme_css_url", "")
+            self.cache_seconds = float(resource.get("cache_seconds", 0) or 0)
+            self.clear_cache()
             self.alt_top_banner = resource.get("alt_top_banner", "")
 
             if "allow_xss" in resource:
@@ -423,6 +471,32 @@ class CompiledPage:
         self.refreshFromResource = refreshFromResource
         self.refreshFromResource()
 
+    def clear_cache(self):
+        with self.output_cache_lock:
+            self.output_cache.clear()
+
+    def get_cached(self, key: tuple) -> tuple[float, str, bytes, str] | None:
+        with self.output_cache_lock:
+            x = self.output_cache.get(key)
+            if x and x[0] > time.monotonic():
+                return x
+        return None
+
+    def set_cached(self, key: tuple, body: bytes, content_type: str):
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        x = (time.monotonic() + self.cache_seconds, etag, body, content_type)
+        with self.output_cache_lock:
+            if len(self.output_cache) >= PAGE_CACHE_SIZE:
+                now = time.monotonic()
+                for i in [
+                    i for i, v in self.output_cache.items() if v[0] < now
+                ]:
+                    del self.output_cache[i]
+            while len(self.output_cache) >= PAGE_CACHE_SIZE:
+                del self.output_cache[next(iter(self.output_cache))]
+            self.output_cache[key] = x
+        return x
+
     def new_print(self, *d):
         try:
             if len(d) == 1:
@@ -791,9 +865,20 @@ async def catch_all(
     if quart.request.method not in page.methods:
         # Raise a redirect the the wrongmethod error page
         return quart.redirect("/errors/wrongmethod")
+
+    cache_key = None
+    if page.cache_seconds and quart.request.method == "GET":
+        cache_key = (
+            args,
+            tuple(sorted(kwargs.items())),
+            pages.getAcessingUser(),
+        )
+        cached = page.get_cached(cache_key)
+        if cached:
+            return _cached_response(cached, h)
+
     try:
 
-        @copy_current_request_context
         def serve():
             h["Content-Type"] = page.mime
 
@@ -827,7 +912,18 @@ async def catch_all(
                 r = page.text.encode("utf-8")
             return r
 
-        r = await serve()
+        loop = asyncio.get_running_loop()
+        r = await loop.run_in_executor(
+            get_render_pool(), contextvars.copy_context().run, serve
+        )
+
+        if cache_key:
+            if isinstance(r, str):
+                r = r.encode("utf-8")
+            return _cached_response(
+                page.set_cached(cache_key, r, h["Content-Type"]), h
+            )
+
         return quart.Response(r, headers=h)
 
     except ServeFileInsteadOfRenderingPageException as e:
@@ -890,6 +986,22 @@ async def catch_all(
         raise (e)
 
 
+def _cached_response(
+    cached: tuple[float, str, bytes, str], h: dict[str, str]
+) -> quart.Response:
+    _expires, etag, body, content_type = cached
+    h["Content-Type"] = content_type
+    # Clients may keep it, but must check it is still current
+    h["Cache-Control"] = "no-cache"
+
+    if etag in quart.request.if_none_match:
+        r = quart.Response(b"", status=304, headers=h)
+    else:
+        r = quart.Response(body, headers=h)
+    r.set_etag(etag)
+    return r
+
+
 def _headers(page):
     h = {}
     x = ""
@@ -1036,6 +1148,7 @@ class PageType(modules_state.ResourceType):
         resourceobj["alt_top_banner"] = kwargs["alttopbanner"]
 
         resourceobj["mimetype"] = kwargs["mimetype"]
+        resourceobj["cache_seconds"] = float(kwargs.get("cache_seconds") or 0)
         resourceobj["template_engine"] = kwargs["template_engine"]
         resourceobj["no_navheader"] = "no_navheader" in kwargs
 
@@ -1146,6 +1259,11 @@ class PageType(modules_state.ResourceType):
             title="XSS Origins",
             default=", ".join(resource_data.get("allow_origins", "")),
         )
+        d.text_input(
+            "cache_seconds",
+            title="Cache GET responses for seconds, 0 to disable",
+            default=resource_data.get("cache_seconds", 0),
+        )
         d.text_input(
             "themecss",
             title="Theme",
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 # SPDX-License-Identifier: GPL-3.0-or-later
+import ast
 import copy
 import datetime
 import inspect
@@ -12,7 +13,7 @@ import threading
 import time
 import traceback
 import weakref
-from collections.abc import Callable
+from collections.abc import Callable, Iterable
 from types import FunctionType, MethodType
 from typing import Any, TypedDict
 
@@ -77,6 +78,9 @@ If there is an unrecognized type, it is treated as a string.
 
 simpleeval.MAX_POWER = 1024
 
+# Per context limit on cached parsed expressions
+MAX_PARSED_EXPRESSIONS = 1024
+
 
 # Command metadata type definitions
 class CommandArgManifest(TypedDict):
@@ -468,6 +472,28 @@ globalUsrFunctions = {
 
 globalConstants = {"e": math.e, "pi": math.pi}
 
+# Functions whose result only depends on their arguments, or on tags which
+# are tracked as dependencies anyway. Expression events calling anything
+# else still get polled.
+pureFunctions = {
+    "floor",
+    "max",
+    "min",
+    "log",
+    "log10",
+    "sin",
+    "cos",
+    "sqrt",
+    "tagValue",
+    "tv",
+    "stringTagValue",
+    "stv",
+}
+
+# Seconds between polls of expression events that use time, random
+# numbers, or anything else that can change without an input changing
+VOLATILE_POLL_INTERVAL = 3
+
 
 class ReturnValue(StatelessFunction):
     doc = "Returns the parameter x, and continues the action (Unless the value is None)"
@@ -796,6 +822,12 @@ class BaseChandlerScriptContext:
         # is a list of commands, a command being a list of strings.
         self.event_listeners: list[LoadedEventBindingPipeline] = []
 
+        # Index of event_listeners by event name, and the distinct
+        # expression events that have to be polled. Rebuilt whenever the
+        # bindings change, never modified in place.
+        self.event_index: dict[str, list[LoadedEventBindingPipeline]] = {}
+        self.poll_events: list[str] = []
+
         self.variables: dict[str, Any] = (
             variables if variables is not None else {}
         )
@@ -810,11 +842,17 @@ class BaseChandlerScriptContext:
         )
         self.contextName = contextName
 
-        # Cache whether or not any binding is watching a variable
-        # or variable. False positives are acceptable, it's just a slight
-        # Performance hit
-        self.need_refresh_for_variable: dict[str, bool] = {}
-        self.need_refresh_for_tag: dict[str, bool] = {}
+        # The variables each expression event read the last time it ran,
+        # and the reverse, the expression events to rerun when a variable
+        # changes. Tags are tracked as their $tag: variables.
+        self.expression_dependencies: dict[str, set[str]] = {}
+        self.variable_dependents: dict[str, set[str]] = {}
+
+        # Expression events that can change without any input changing
+        self.volatile_poll_events: list[str] = []
+
+        # Names read are added here while evaluating an expression event
+        self._dependency_recorder: set[str] | None = None
 
         # Used to track stuff like tag values that have timestamps
         # Tag value getters set it to the highest of the tag time and its current val.
@@ -846,6 +884,8 @@ class BaseChandlerScriptContext:
         self.contextName = "ScriptContext"
 
         self.time_events: dict[str, ScheduleTimer] = {}
+        # Expression events startTimers has already checked
+        self.started_poll_events: set[str] = set()
         self.poller = None
         self.slowpoller = None
         selfid = id(self)
@@ -901,6 +941,10 @@ class BaseChandlerScriptContext:
             functions=functions, names=self._nameLookup
         )
 
+        # Parsed expressions keyed by source text, so the same expression
+        # in a binding isn't parsed again every time it is evaluated.
+        self.parsed_expressions: dict[str, Any] = {}
+
         if not gil:
             self.gil = threading.RLock()
         else:
@@ -917,15 +961,27 @@ class BaseChandlerScriptContext:
         """Check every event that is actually an expression, to see if it should
         be triggered
         """
+        self.refresh_expressions(self.poll_events)
+
+    def poll_volatile_expressions(self):
+        self.refresh_expressions(self.volatile_poll_events)
+
+    def refresh_expressions(self, expressions: Iterable[str]):
+        """Evaluate expression events and fire them with the result,
+        recording which variables each one depends on."""
         with self.gil:
-            for i in self.event_listeners:
+            # Tag functions set variables while we evaluate, which
+            # must not recursively trigger the same expressions.
+            if self._dependency_recorder is not None:
+                return
+
+            for i in expressions:
+                deps: set[str] = set()
+                self._dependency_recorder = deps
                 try:
-                    if i["event"].startswith("="):
-                        self.eval_times = 0
-                        r = self.preprocessArgument(i["event"])
-                        self.event(
-                            i["event"], r, self.eval_times or time.time()
-                        )
+                    self.eval_times = 0
+                    r = self.preprocessArgument(i)
+                    self.event(i, r, self.eval_times or time.time())
 
                 except Exception:
                     self.event(
@@ -933,6 +989,23 @@ class BaseChandlerScriptContext:
                         f"{self.contextName}\n{traceback.format_exc(chain=True)}",
                     )
                     raise
+                finally:
+                    self._dependency_recorder = None
+                    self._set_dependencies(i, deps)
+
+    def _set_dependencies(self, expression: str, deps: set[str]):
+        old = self.expression_dependencies.get(expression, set())
+        for i in old - deps:
+            self.variable_dependents[i].discard(expression)
+            if not self.variable_dependents[i]:
+                del self.variable_dependents[i]
+        for i in deps - old:
+            self.variable_dependents.setdefault(i, set()).add(expression)
+        self.expression_dependencies[expression] = deps
+
+    def _record_dependency(self, name: str):
+        if self._dependency_recorder is not None:
+            self._dependency_recorder.add(name)
 
     def do_async(self, f):
         self.event_queue.append(f)
@@ -1034,16 +1107,15 @@ class BaseChandlerScriptContext:
 
             self.stopScriptFlag = False
             try:
-                for pipeline in self.event_listeners:
-                    if evt == pipeline["event"]:
-                        handled = True
-                        if self.stopScriptFlag:
+                for pipeline in self.event_index.get(evt, ()):
+                    handled = True
+                    if self.stopScriptFlag:
+                        break
+                    for command in pipeline["commands"]:
+                        x = self._runCommand(command)
+                        if x is None:
                             break
-                        for command in pipeline["commands"]:
-                            x = self._runCommand(command)
-                            if x is None:
-                                break
-                            self.variables["_"] = x
+                        self.variables["_"] = x
 
             except Exception:
                 logging.exception("Error running script command")
@@ -1088,7 +1160,15 @@ class BaseChandlerScriptContext:
         return a
 
     def eval(self, a: Any):
-        return self.evaluator.eval(a)
+        try:
+            parsed = self.parsed_expressions[a]
+        except KeyError:
+            parsed = self.evaluator.parse(a)
+            # Expressions built at runtime could fill it up forever
+            if len(self.parsed_expressions) >= MAX_PARSED_EXPRESSIONS:
+                self.parsed_expressions.clear()
+            self.parsed_expressions[a] = parsed
+        return self.evaluator.eval(a, parsed)
 
     def addNamespace(self, name):
         """If name is foo, Makes variables named 'foo.bar'
@@ -1103,8 +1183,10 @@ class BaseChandlerScriptContext:
         if n == "event":
             return self.eventValueStack[-1]
 
+        # Even if it doesn't exist yet, so we notice when it gets set
+        self._record_dependency(n)
+
         if n in self.variables:
-            self.need_refresh_for_variable[n] = True
             return self.variables[n]
 
         if n in globalConstants:
@@ -1125,13 +1207,20 @@ class BaseChandlerScriptContext:
             self.variables[k] = v
             self.changedVariables[k] = v
             self.onVarSet(k, v)
-            if k not in self.need_refresh_for_variable:
-                self.need_refresh_for_variable[k] = False
-                for i in self.event_listeners:
-                    if k in i:
-                        self.need_refresh_for_variable[k] = True
-            if self.need_refresh_for_variable[k]:
-                self.checkPollEvents()
+
+            dependents = self.variable_dependents.get(k, set())
+            # foo.bar can be read through the foo namespace
+            if "." in k:
+                ns = k.split(".", 1)[0]
+                dependents = dependents | self.variable_dependents.get(
+                    ns, set()
+                )
+
+            if dependents:
+                # Keep binding order
+                self.refresh_expressions(
+                    [i for i in self.poll_events if i in dependents]
+                )
         finally:
             self.gil.release()
 
@@ -1250,17 +1339,58 @@ class BaseChandlerScriptContext:
                 )
 
             self.event_listeners.extend(loaded_rules)
+            self.parsed_expressions = {}
+            self._rebuild_event_index()
 
         if has_now:
             self.event("now")
-            self.event_listeners = [
-                i for i in self.event_listeners if i["event"] != "now"
-            ]
+            with self.gil:
+                self.event_listeners = [
+                    i for i in self.event_listeners if i["event"] != "now"
+                ]
+                self._rebuild_event_index()
 
         # Need to do this at least once to make the bindings know what to
         # Listen to
         self.checkPollEvents()
 
+    def _rebuild_event_index(self):
+        index: dict[str, list[LoadedEventBindingPipeline]] = {}
+        for i in self.event_listeners:
+            index.setdefault(i["event"], []).append(i)
+
+        # Replaced rather than mutated, so a dispatch already in progress
+        # keeps iterating the old ones.
+        self.event_index = index
+        self.poll_events = [i for i in index if i.startswith("=")]
+        self.volatile_poll_events = [
+            i for i in self.poll_events if self._is_volatile(i[1:])
+        ]
+
+        for i in list(self.expression_dependencies):
+            if i not in index:
+                self._set_dependencies(i, set())
+                del self.expression_dependencies[i]
+
+    def _is_volatile(self, expression: str) -> bool:
+        """True if an expression's value can change without any variable
+        or tag it reads changing, so it has to be polled."""
+        try:
+            tree = ast.parse(expression.strip())
+        except SyntaxError:
+            return False
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name):
+                    return True
+                if node.func.id not in pureFunctions:
+                    return True
+            # The last command's return value, set without setVar
+            elif isinstance(node, ast.Name) and node.id == "_":
+                return True
+        return False
+
     def addBindingsFromDict(self, rules: list[EventBindingPipelineConfig]):
         """Add bindings from dict format.
 
@@ -1290,10 +1420,9 @@ class BaseChandlerScriptContext:
         "Called when a binding is added that listens to evt"
 
     def startTimers(self):
-        needCheck = 0
+        new_poll_events = []
         with self.gil:
-            for i in self.event_listeners:
-                event_name = i["event"]
+            for event_name in self.event_index:
                 if event_name.strip()[0] == "@":
                     if event_name not in self.time_events:
                         self.time_events[event_name] = ScheduleTimer(
@@ -1307,17 +1436,21 @@ class BaseChandlerScriptContext:
                         self.poller = scheduler.schedule_repeating(
                             self.poll, 1 / 24.0
                         )
-                # Really just a fallback for various insta-check triggers like tag changes
                 if event_name.strip().startswith("="):
-                    if not self.slowpoller:
-                        needCheck = True
-                        self.slowpoller = scheduler.schedule_repeating(
-                            self.checkPollEvents, 3
-                        )
+                    if event_name not in self.started_poll_events:
+                        self.started_poll_events.add(event_name)
+                        new_poll_events.append(event_name)
+
+            # Anything else gets rechecked when what it reads changes
+            if self.volatile_poll_events and not self.slowpoller:
+                self.slowpoller = scheduler.schedule_repeating(
+                    self.poll_volatile_expressions, VOLATILE_POLL_INTERVAL
+                )
 
-            # Run right away for faster response
-            if needCheck:
-                self.checkPollEvents()
+            # Run new ones right away for faster response, the rest
+            # already rerun when what they read changes.
+            if new_poll_events:
+                self.refresh_expressions(new_poll_events)
 
     def poll(self):
         self.event("script.poll")
@@ -1334,13 +1467,16 @@ class BaseChandlerScriptContext:
                         j["command"].close()
 
             # Cache is invalidated, bindings have changed
-            self.need_refresh_for_variable = {}
-            self.need_refresh_for_tag = {}
+            self.expression_dependencies = {}
+            self.variable_dependents = {}
+            self.parsed_expressions = {}
 
             self.event_listeners = []
+            self._rebuild_event_index()
             for i in self.time_events:
                 self.time_events[i].stop()
             self.time_events = {}
+            self.started_poll_events = set()
 
             if self.poller:
                 self.poller.unregister()
@@ -1375,14 +1511,8 @@ class ChandlerScriptContext(BaseChandlerScriptContext):
         def f():
             if isinstance(val, str) and len(val) > 16000:
                 raise RuntimeError(f"{tagname} val too long for chandlerscript")
+            # Reruns any expression that read the tag
             self.setVar(f"$tag:{tagname}", val, True)
-            if tagname not in self.need_refresh_for_tag:
-                self.need_refresh_for_tag[tagname] = False
-                for i in self.event_listeners:
-                    if tagname in i:
-                        self.need_refresh_for_tag[tagname] = True
-            if self.need_refresh_for_tag[tagname]:
-                self.checkPollEvents()
 
         if len(self.event_queue) > 128:
             raise RuntimeError("Too Many queued events!!!")
@@ -1398,7 +1528,6 @@ class ChandlerScriptContext(BaseChandlerScriptContext):
             self.onTagChange(tag.name, v, ts)
 
         tag.subscribe(onchange)
-        self.need_refresh_for_tag[tag.name] = True
         self.tagHandlers[tag.name] = (tag, onchange)
         self.tagpoints[tag.name] = tag
 
@@ -1438,6 +1567,7 @@ class ChandlerScriptContext(BaseChandlerScriptContext):
             if not tagName:
                 raise RuntimeError(f"It seems you do not have access to:{t}")
             t = tagpoints.Tag(tagName)
+            self._record_dependency(f"$tag:{t.name}")
             self.setupTag(t)
             self.setVar(f"$tag:{t.name}", t.value, True)
             self.eval_times = max(t.timestamp, self.eval_times)
@@ -1448,6 +1578,7 @@ class ChandlerScriptContext(BaseChandlerScriptContext):
             if not tagName:
                 raise RuntimeError(f"It seems you do not have access to:{t}")
             t = tagpoints.StringTag(tagName)
+            self._record_dependency(f"$tag:{t.name}")
             self.setupTag(t)
             self.setVar(f"$tag:{t.name}", t.value, True)
             self.eval_times = max(t.timestamp, self.eval_times)
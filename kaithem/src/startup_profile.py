@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Timing of each part of startup, written to a report at every boot,
+to see where a particular install's startup time goes."""
+
+import contextlib
+import os
+import threading
+import time
+from collections.abc import Iterator
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+lock = threading.Lock()
+
+# (kind, name, seconds), in the order they finished.
+# Kinds are "import" for background imports, "plugin", and "init"
+# for the steps of initialize().
+timings: list[tuple[str, str, float]] = []
+
+
+def record(kind: str, name: str, seconds: float) -> None:
+    with lock:
+        timings.append((kind, name, seconds))
+
+
+@contextlib.contextmanager
+def timed(kind: str, name: str) -> Iterator[None]:
+    t = time.monotonic()
+    try:
+        yield
+    finally:
+        record(kind, name, time.monotonic() - t)
+
+
+def report(total: float | None = None) -> str:
+    "Text report with the slowest items of each kind first"
+    with lock:
+        t = list(timings)
+
+    lines = ["Kaithem startup profile", time.strftime("%Y-%m-%d %H:%M:%S")]
+    if total is not None:
+        lines.append(f"Total: {total * 1000:.1f}ms")
+    lines.append(
+        "Imports and plugins load in parallel, so their times overlap."
+    )
+
+    for kind in ("init", "plugin", "import"):
+        items = sorted((i for i in t if i[0] == kind), key=lambda i: -i[2])
+        if not items:
+            continue
+        lines.append("")
+        lines.append(f"[{kind}]")
+        for _kind, name, seconds in items:
+            lines.append(f"{seconds * 1000:10.1f}ms  {name}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_report(fn: str, total: float | None = None) -> None:
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn + "~", "w") as f:
+            f.write(report(total))
+        os.replace(fn + "~", fn)
+    except Exception:
+        logger.exception("Could not write startup profile")
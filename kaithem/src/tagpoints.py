@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import base64
+import collections
 import copy
 import functools
 import gc
@@ -91,6 +92,83 @@ allTagsAtomic: dict[str, weakref.ref[GenericTagPointClass[Any]]] = {}
 subscriber_error_handlers: list[Callable[..., Any]] = []
 
 
+class _AsyncSubscriber:
+    """Stands in for a subscriber's weakref in the subscriber list, and
+    delivers values to it in a worker instead of the thread that set them.
+
+    Values wait in a small bounded queue. When it is full the oldest
+    is dropped, so a slow subscriber only ever misses intermediate
+    values, never the latest one. Only one delivery runs at a time,
+    so the subscriber still sees values in order.
+    """
+
+    def __init__(
+        self,
+        ref: weakref.ref[Callable[..., Any]],
+        tag: GenericTagPointClass[Any],
+        queue_size: int = 1,
+    ):
+        self.ref = ref
+        self.tag = weakref.ref(tag)
+        self.queue: collections.deque[tuple[Any, float, Any]] = (
+            collections.deque(maxlen=max(queue_size, 1))
+        )
+        self.lock = threading.Lock()
+        self.running = False
+        self.dropped = 0
+
+    def __call__(self) -> Callable[..., Any] | None:
+        # Acts like the weakref it wraps, but returns the queueing function
+        if self.ref() is None:
+            return None
+        return self.put
+
+    def target(self) -> Callable[..., Any] | None:
+        return self.ref()
+
+    def put(self, value: Any, timestamp: float, annotation: Any):
+        with self.lock:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((value, timestamp, annotation))
+            if self.running:
+                return
+            self.running = True
+        workers.do(self.run)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.running = False
+                    return
+                vta = self.queue.popleft()
+
+            f = self.ref()
+            if f is None:
+                with self.lock:
+                    self.queue.clear()
+                    self.running = False
+                return
+
+            try:
+                f(*vta)
+            except Exception:
+                tag = self.tag()
+                if tag:
+                    tag._handle_subscriber_error(f, vta)
+            del f
+
+
+def _subscriber_target(
+    r: weakref.ref[Callable[..., Any]] | _AsyncSubscriber,
+) -> Callable[..., Any] | None:
+    "The function a subscriber list entry refers to"
+    if isinstance(r, _AsyncSubscriber):
+        return r.target()
+    return r()
+
+
 _default_display_units = {
     "temperature": "degC|degF",
     "length": "m",
@@ -275,10 +353,15 @@ class GenericTagPointClass(Generic[T]):
 
         self._claims: dict[str, Claim[T]] = {}
         self._lock = threading.RLock()
-        self._subscribers: list[weakref.ref[Callable[..., Any]]] = []
+        self._subscribers: list[
+            weakref.ref[Callable[..., Any]] | _AsyncSubscriber
+        ] = []
 
-        # This is only used for fast stream mode
-        self._subscribers_atomic: list[weakref.ref[Callable[..., Any]]] = []
+        # Immutable snapshot of _subscribers, replaced whole on every
+        # change, so dispatch can iterate it without copying or locking
+        self._subscribers_atomic: tuple[
+            weakref.ref[Callable[..., Any]] | _AsyncSubscriber, ...
+        ] = ()
 
         self._poller: scheduling.RepeatingEvent | None = None
 
@@ -457,6 +540,8 @@ class GenericTagPointClass(Generic[T]):
                         self._apiClaim.release()
                 else:
                     w = widgets.DataSource(id=f"tag:{self.name}")
+                    # Browsers only need the latest value of fast tags
+                    w.coalesce_updates = True
 
                     if self.unreliable:
                         w.noOnConnectData = True
@@ -927,7 +1012,11 @@ class GenericTagPointClass(Generic[T]):
 
     @validate_args
     def subscribe(
-        self, f: Callable[[T, float, Any], Any], immediate: bool = False
+        self,
+        f: Callable[[T, float, Any], Any],
+        immediate: bool = False,
+        asynchronous: bool = False,
+        queue_size: int = 1,
     ):
         """
         f will be called whe the value changes, as long
@@ -946,6 +1035,14 @@ class GenericTagPointClass(Generic[T]):
         like endless loops, one should be careful when accessing the tagpoint itself
         from within this function.
 
+        Reading the value from other threads does not take the lock,
+        so slow subscribers only delay writers.
+
+        If asynchronous is True, f is instead called in a worker thread,
+        one value at a time, and the writer never waits for it.
+        Values that arrive while f is busy wait in a queue of queue_size,
+        dropping the oldest when full, so a slow subscriber skips
+        intermediate values but always gets the latest.
         """
         if isinstance(f, GenericTagPointClass) and (
             f.unreliable or self.unreliable
@@ -971,7 +1068,9 @@ class GenericTagPointClass(Generic[T]):
                     + " was deleted <0.5s after being subscribed.  This is probably not what you wanted."
                 )
             try:
-                if r in self._subscribers:
+                if r in self._subscribers or any(
+                    getattr(i, "ref", None) is r for i in self._subscribers
+                ):
                     logger.warning(
                         f"Tag point subscriber {desc} on tag {self.name} was not explicitly unsubscribed."
                     )
@@ -985,6 +1084,7 @@ class GenericTagPointClass(Generic[T]):
                 ref: (
                     weakref.WeakMethod[Callable[[T, float, Any], Any]]
                     | weakref.ref[Callable[[T, float, Any], Any]]
+                    | _AsyncSubscriber
                     | None
                 ) = None
 
@@ -993,8 +1093,11 @@ class GenericTagPointClass(Generic[T]):
                 else:
                     ref = weakref.ref(f, errcheck)
 
+                if asynchronous:
+                    ref = _AsyncSubscriber(ref, self, queue_size)
+
                 for i in self._subscribers:
-                    if f == i():
+                    if f == _subscriber_target(i):
                         logger.warning(
                             "Double subscribe detected, same function subscribed to "
                             + self.name
@@ -1004,24 +1107,21 @@ class GenericTagPointClass(Generic[T]):
 
                 self._subscribers.append(ref)
 
-                to_rm = []
-                for i in self._subscribers:
-                    if not i():
-                        to_rm.append(i)
-                for i in to_rm:
-                    self._subscribers.remove(i)
-                messagebus.post_message(
-                    f"/system/tags/subscribers{self.name}",
-                    len(self._subscribers),
-                    synchronous=True,
-                )
+                self._subscribers = [i for i in self._subscribers if i()]
+                self._subscribers_atomic = tuple(self._subscribers)
+                count = len(self._subscribers)
 
                 if immediate and self.timestamp:
-                    f(self.value, self.timestamp, self.annotation)
-
-                self._subscribers_atomic = copy.copy(self._subscribers)
+                    if isinstance(ref, _AsyncSubscriber):
+                        ref.put(*self._vta)
+                    else:
+                        f(*self._vta)
             finally:
                 self._lock.release()
+
+            messagebus.post_message(
+                f"/system/tags/subscribers{self.name}", count
+            )
         else:  # pragma: no cover
             self._testForDeadlock()
             raise RuntimeError(
@@ -1034,19 +1134,19 @@ class GenericTagPointClass(Generic[T]):
             try:
                 x = None
                 for i in self._subscribers:
-                    if i() == f:
+                    if _subscriber_target(i) == f:
                         x = i
                 if x:
                     self._subscribers.remove(x)
-                messagebus.post_message(
-                    f"/system/tags/subscribers{self.name}",
-                    len(self._subscribers),
-                    synchronous=True,
-                )
-                self._subscribers_atomic = copy.copy(self._subscribers)
+                self._subscribers_atomic = tuple(self._subscribers)
+                count = len(self._subscribers)
             finally:
                 self._lock.release()
 
+            messagebus.post_message(
+                f"/system/tags/subscribers{self.name}", count
+            )
+
         else:  # pragma: no cover
             self._testForDeadlock()
             raise RuntimeError(
@@ -1088,38 +1188,47 @@ class GenericTagPointClass(Generic[T]):
         if self._alerts:
             self.recalc_alerts()
 
-        for i in self._subscribers:
+        vta = self._vta
+
+        # Subscribing during dispatch replaces the snapshot,
+        # it never changes the one we are iterating.
+        for i in self._subscribers_atomic:
             f = i()
             if f:
                 try:
-                    f(*self._vta)
+                    f(*vta)
                 except Exception:
-                    try:
-                        extraData = str(
-                            (
-                                str(self.last_value)[:48],
-                                self.timestamp,
-                                str(self.annotation)[:48],
-                            )
-                        )
-                    except Exception as e:
-                        extraData = str(e)
-                    logger.exception(
-                        f"Tag subscriber error, val,time,annotation was: {extraData}"
-                    )
-                    # Return the error from whence it came to display in the proper place
-                    for i in subscriber_error_handlers:
-                        try:
-                            i(self, f, self.last_value)
-                        except Exception:
-                            print(
-                                "Failed to handle error: "
-                                + traceback.format_exc(6)
-                                + "\nData: "
-                                + extraData
-                            )
+                    self._handle_subscriber_error(f, vta)
             del f
 
+    def _handle_subscriber_error(
+        self, f: Callable[..., Any], vta: tuple[T, float, Any]
+    ):
+        try:
+            extraData = str(
+                (
+                    str(vta[0])[:48],
+                    vta[1],
+                    str(vta[2])[:48],
+                )
+            )
+        except Exception as e:
+            extraData = str(e)
+        logger.exception(
+            f"Tag subscriber error, val,time,annotation was: {extraData}"
+        )
+        # Return the error from whence it came to display in the proper place
+        for i in subscriber_error_handlers:
+            try:
+                i(self, f, vta[0])
+            except Exception:
+                print(
+                    "Failed to handle error: "
+                    + traceback.format_exc(6)
+                    + "\nData: "
+                    + extraData
+                )
+
     def _process_value_for_tag_type(self, value: T) -> T:
         """Represents the transform from the claim input to the output.
         Must be a pure-ish function.
@@ -1132,7 +1241,7 @@ class GenericTagPointClass(Generic[T]):
 
     @property
     def value(self) -> T:
-        return self._get_value()[0]
+        return self.get_vta()[0]
 
     @value.setter
     def value(self, v: T):
@@ -1169,18 +1278,15 @@ class GenericTagPointClass(Generic[T]):
 
     def get_vta(self, force=False) -> tuple[T, float, Any]:
         """Get the current value, timestamp and annotation.
-        If force is true and the value is a getter, then force a new update.
+
+        Does not lock. Every write replaces the whole tuple with an
+        already processed value, so this is always a consistent snapshot.
         """
         if force:
             warnings.warn(
                 "get_vta(force=True) is deprecated, use get_value() instead",
             )
-        if not self._lock.acquire(timeout=240):
-            raise RuntimeError("Could not get lock")
-        try:
-            return self._get_value()
-        finally:
-            self._lock.release()
+        return self._vta
 
     def _get_value(self) -> tuple[T, float, Any]:
         "Get the processed value of the tag, and update last_value, It is meant to be called under lock."
@@ -1329,7 +1435,11 @@ class GenericTagPointClass(Generic[T]):
             ):
                 self.active_claim = self._claims[name]
 
-                self._vta = (value, timestamp, annotation)
+                self._vta = (
+                    self._process_value_for_tag_type(value),
+                    timestamp,
+                    annotation,
+                )
 
             # If priority has been changed on the existing active claim
             # We need to handle it
@@ -1347,7 +1457,11 @@ class GenericTagPointClass(Generic[T]):
                     if x:
                         v, t, a = x.vta
                         if v is not None:
-                            self._vta = v, t, a
+                            self._vta = (
+                                self._process_value_for_tag_type(v),
+                                t,
+                                a,
+                            )
 
                         if not i == self.active_claim:
                             self.active_claim = i
@@ -1411,7 +1525,7 @@ class GenericTagPointClass(Generic[T]):
             if upd:
                 self._vta = vta
                 # No need to push is listening
-                if self._subscribers or self._alerts:
+                if self._subscribers_atomic or self._alerts:
                     if timestamp:
                         self._push()
                     else:
@@ -1474,7 +1588,7 @@ class GenericTagPointClass(Generic[T]):
                 raise RuntimeError("Corrupt state")
 
             if v is not None:
-                self._vta = v, t, a
+                self._vta = self._process_value_for_tag_type(v), t, a
 
             self.active_claim = o
 
@@ -1486,18 +1600,12 @@ class GenericTagPointClass(Generic[T]):
 
     @property
     def subscribers(self) -> list[Callable[[T, float, Any], Any]]:
-        if self._lock.acquire(timeout=15):
-            try:
-                x: list[Callable[[T, float, Any], Any]] = []
-                for i in self._subscribers:
-                    y = i()
-                    if y:
-                        x.append(y)
-                return x
-            finally:
-                self._lock.release()
-        else:
-            raise RuntimeError("failed to get lock to list subscribers")
+        x: list[Callable[[T, float, Any], Any]] = []
+        for i in self._subscribers_atomic:
+            y = _subscriber_target(i)
+            if y:
+                x.append(y)
+        return x
 
 
 default_bool_enum = {-1: None, 0: False, 1: True}
@@ -1586,6 +1694,8 @@ class NumericTagPointClass(GenericTagPointClass[float]):
     @validate_args
     def min(self, v: float | int | None):
         self._min = v
+        # Reprocess the current value with the new range
+        self.poll()
         self.pull()
 
     @property
@@ -1598,6 +1708,7 @@ class NumericTagPointClass(GenericTagPointClass[float]):
     @validate_args
     def max(self, v: float | int | None):
         self._max = v
+        self.poll()
         self.pull()
 
     @property
@@ -1756,6 +1867,11 @@ class ObjectTagPointClass(GenericTagPointClass[dict[str, Any]]):
         self.validate = None
         super().__init__(name)
 
+    def get_vta(self, force=False) -> tuple[dict[str, Any], float, Any]:
+        v, t, a = super().get_vta(force)
+        # The stored dict is shared, readers get their own copy
+        return copy.deepcopy(v), t, a
+
     def _process_value_for_tag_type(self, value):
         if isinstance(value, str):
             value = json.loads(value)
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import base64
+
+from kaithem.src import auth, quart_app, tagpoints
+
+
+def _basic(username: str, password: str) -> dict[str, str]:
+    x = base64.b64encode(f"{username};{password}".encode()).decode()
+    return {"Authorization": f"Basic {x}"}
+
+
+async def test_basic_auth_credential_cache():
+    auth.add_user("basic_auth_test", "test-basic-password")
+    auth.add_user_to_group("basic_auth_test", "Administrators")
+
+    t = tagpoints.Tag("/system/unit_test_basic_auth")
+    t.value = 1
+    t.expose("system_admin")
+
+    client = quart_app.app.test_client()
+
+    async def visible(headers: dict[str, str]) -> bool:
+        r = await client.get("/tag_api/list", headers=headers)
+        return "/system/unit_test_basic_auth" in (await r.get_data()).decode()
+
+    good = _basic("basic_auth_test", "test-basic-password")
+    assert await visible(good)
+
+    # Only the digest is kept, later requests don't check the password
+    assert len(auth.credentialCache) == 1
+    assert list(auth.credentialCache.values())[0][1] == "basic_auth_test"
+    assert await visible(good)
+
+    assert not await visible(_basic("basic_auth_test", "wrong"))
+    assert len(auth.credentialCache) == 1
+
+    # Same Origin check as cookie logins
+    other_site = dict(good, Origin="https://example.com")
+    assert not await visible(other_site)
+    assert await visible(dict(good, Origin="http://localhost"))
+    auth.setUserSetting("basic_auth_test", "allow-cors", True)
+    assert await visible(other_site)
+    auth.setUserSetting("basic_auth_test", "allow-cors", False)
+
+    # Old credentials stop working right away after a password change
+    auth.changePassword("basic_auth_test", "new-basic-password")
+    assert not auth.credentialCache
+    assert not await visible(good)
+    assert await visible(_basic("basic_auth_test", "new-basic-password"))
+
+    auth.removeUser("basic_auth_test")
+    assert not auth.credentialCache
+    assert not await visible(_basic("basic_auth_test", "new-basic-password"))
+
+
+async def test_accessing_user_cached_per_request():
+    import quart
+
+    from kaithem.src import pages
+
+    auth.add_user("request_cache_test", "test-request-password")
+    auth.add_user_to_group("request_cache_test", "Administrators")
+    assert auth.Users["request_cache_test"].all_permissions
+    assert auth.canUserDoThis("request_cache_test", "anything_at_all")
+    assert not auth.canUserDoThis("nonexistent_user", "system_admin")
+    assert auth.canUserDoThis("nonexistent_user", "view_status")
+
+    headers = _basic("request_cache_test", "test-request-password")
+    async with quart_app.app.test_request_context("/", headers=headers):
+        assert pages.getAcessingUser() == "request_cache_test"
+        assert quart.request.scope["kaithem.user"] == (
+            auth.authVersion,
+            "request_cache_test",
+        )
+        assert pages.canUserDoThis("system_admin")
+
+        # Looked up again once anything about users changes
+        auth.changePassword("request_cache_test", "other-request-password")
+        assert pages.getAcessingUser() == "__guest__"
+        assert not pages.canUserDoThis("system_admin")
+
+    auth.removeUser("request_cache_test")
@@ -314,6 +314,68 @@ def test_internal_action_queue():
     assert len(logs) == 2
 
 
+def test_frame_scheduler():
+    from kaithem.src import tagpoints
+    from kaithem.src.chandler import frame_scheduler
+
+    # Simulated time, so a loaded test machine can't cause overruns
+    now = [1000.0]
+
+    def sleep(t: float):
+        now[0] += t
+
+    def clock() -> float:
+        return now[0]
+
+    sched = frame_scheduler.FrameScheduler(
+        50,
+        tag_prefix="/test_frame_scheduler",
+        telemetry_interval=0.1,
+        clock=clock,
+        sleep=sleep,
+    )
+
+    # Starting long after creation is not an overrun
+    sleep(0.2)
+    sched.begin_frame()
+    sched.wait_for_next_frame()
+    assert sched.overruns == 0
+    assert sched.skipped_frames == 0
+
+    # Render time must not add to the frame period
+    start = clock()
+    for i in range(10):
+        sched.begin_frame()
+        with sched.stage("composite"):
+            sleep(0.01)
+        sched.wait_for_next_frame()
+    assert clock() - start < 0.3
+    assert sched.overruns == 0
+    assert not sched.overrunning
+
+    # Overruns skip frames and resync instead of bursting to catch up
+    sched.begin_frame()
+    sleep(0.07)
+    sched.wait_for_next_frame()
+    assert sched.overrunning
+    assert sched.overruns == 1
+    assert sched.skipped_frames >= 1
+
+    t = clock()
+    sched.begin_frame()
+    sched.wait_for_next_frame()
+    assert not sched.overrunning
+    assert clock() - t > 0.015
+
+    sched.publish_telemetry()
+    assert tagpoints.Tag("/test_frame_scheduler.overruns").value == 1
+    assert tagpoints.Tag("/test_frame_scheduler.fps").value > 0
+
+    # The real render loop publishes too
+    time.sleep(1.5)
+    assert tagpoints.Tag("/chandler/render.fps").value > 10
+
+
 def test_slide_rel_len():
     with TempGroup() as grp:
         grp.cue.slide = os.path.join(
@@ -688,6 +750,121 @@ def test_cue_track_setting():
     assert "dmx2" not in universes.universes
 
 
+def test_sparse_lighting_layer():
+    import numpy
+
+    from kaithem.src.chandler.fadecanvas import LightingLayer
+
+    old = LightingLayer()
+    new = LightingLayer()
+
+    # Few channels set, so fading gives a sparse universe
+    new.set_val("few", 3, 200)
+    new.alphas["few"][3] = 1
+    new.invalidate("few")
+    old.set_val("few", 5, 100)
+    old.alphas["few"][5] = 1
+    old.invalidate("few")
+
+    # Most channels set, stays dense
+    new.values["many"] = numpy.full(512, 50.0)
+    new.alphas["many"] = numpy.ones(512)
+
+    out = old.fade_in(new, 0.5, {})
+
+    assert "few" in out.sparse
+    assert "few" not in out.values
+    assert "many" in out.values
+    assert sorted(out.universes()) == ["few", "many"]
+
+    sp = out.sparse["few"]
+    assert list(sp.indices) == [3, 5]
+
+    # Same as the dense math would give
+    v, a = sp.to_dense()
+    assert v[3] == 200
+    assert a[3] == 0.5
+    assert v[5] == 50
+    assert a[5] == 0.5
+    assert v[4] == 0 and a[4] == 0
+
+    # Copies are independent
+    cp = out.copy()
+    cp.sparse["few"].values[0] = 0
+    assert out.sparse["few"].values[0] == 200
+
+    # Updating a dense layer from a sparse one scatters into it
+    flat = LightingLayer()
+    flat.update_from(out)
+    assert flat.values["few"][3] == 200
+    assert flat.alphas["few"][5] == 0.5
+    assert list(flat.active_channels("few")) == [3, 5]
+    assert flat.values["many"][100] == 50
+
+
+def test_compositing_buffer():
+    from kaithem.src.chandler import core, group_lighting, universes
+
+    u = {
+        "dmx3": {
+            "channels": 512,
+            "framerate": 44,
+            "number": 1,
+            "type": "enttecopen",
+        },
+        "dmx4": {
+            "channels": 64,
+            "framerate": 44,
+            "number": 2,
+            "type": "enttecopen",
+        },
+    }
+
+    board.configured_universes = u
+    board.cl_create_universes(u)
+
+    with TempGroup() as grp:
+        grp.cue.set_value_immediate("default", "dmx3", "1", 255)
+        grp.cue.set_value_immediate("default", "dmx4", "2", 100)
+
+        for attempt in stamina.retry_context(on=AssertionError):
+            with attempt:
+                assert int(universes.universes["dmx3"]().values[1]) == 255
+                assert int(universes.universes["dmx4"]().values[2]) == 100
+
+        buf = group_lighting.compositing_buffer
+        u3 = universes.universes["dmx3"]()
+        u4 = universes.universes["dmx4"]()
+        assert u3 and u4
+
+        # Universes are views into rows of the one shared buffer
+        assert u3.values.base is buf.values
+        assert u4.values.base is buf.values
+        assert len(u4.values) == 64
+        assert buf.values.shape[1] >= 512
+
+        # Rendering more frames happens in place
+        old = buf.values
+        grp.setAlpha(0.5)
+        for attempt in stamina.retry_context(on=AssertionError):
+            with attempt:
+                assert u3.values[1] == 127.5
+                assert u4.values[2] == 50
+
+        assert buf.values is old
+        assert u3.values.base is buf.values
+
+        # Writing to one universe's row doesn't touch the others
+        assert u4.values[1] == 0
+        assert u3.values[2] == 0
+
+    board.configured_universes = {}
+    board.cl_create_universes(board.configured_universes)
+
+    core.wait_frame()
+    core.wait_frame()
+
+
 def test_make_group():
     from kaithem.src.chandler import (
         core,
@@ -1,8 +1,10 @@
 import os
 import pty
+import socket
 import sys
 import time
 
+import numpy
 import stamina
 
 """Does NOT fully replace physically testing
@@ -12,6 +14,7 @@ dmx break."""
 if "--collect-only" not in sys.argv:  # pragma: no cover
     from kaithem.src.chandler import (
         core,
+        network_output,
         universes,
     )
 
@@ -149,3 +152,120 @@ async def test_fixtures_to_dmx():
     finally:
         os.close(master_fd)
         os.close(slave_fd)
+
+
+def test_network_output():
+    """Art-Net and sACN universes should both send through
+    the shared output engine"""
+    artnet_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    artnet_sock.bind(("127.0.0.1", 0))
+    artnet_sock.settimeout(5)
+    sacn_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sacn_sock.bind(("127.0.0.1", 0))
+    sacn_sock.settimeout(5)
+
+    board = test_chandler.board
+    u = {
+        "artnet1": {
+            "channels": 16,
+            "framerate": 44,
+            "number": 3,
+            "type": "artnet",
+            "interface": f"127.0.0.1:{artnet_sock.getsockname()[1]}",
+        },
+        "sacn1": {
+            "channels": 16,
+            "framerate": 44,
+            "number": 7,
+            "type": "sacn",
+            "interface": f"127.0.0.1:{sacn_sock.getsockname()[1]}",
+        },
+    }
+
+    try:
+        board.configured_universes = u
+        board.cl_create_universes(u)
+
+        with TempGroup() as grp:
+            grp.cue.set_value_immediate("default", "artnet1", "1", 255)
+            grp.cue.set_value_immediate("default", "artnet1", "2", 300)
+            grp.cue.set_value_immediate("default", "sacn1", "3", 42)
+
+            for attempt in stamina.retry_context(on=AssertionError):
+                with attempt:
+                    p = artnet_sock.recv(1024)
+                    assert p[:12] == b"Art-Net\x00\x00\x50\x00\x0e"
+                    # Port address and length, which must be even
+                    assert p[14:16] == bytes([3, 0])
+                    assert p[16:18] == bytes([0, 16])
+                    assert len(p) == 18 + 16
+                    # Values are clipped to 255
+                    assert p[18:21] == bytes([255, 255, 0])
+
+            for attempt in stamina.retry_context(on=AssertionError):
+                with attempt:
+                    p = sacn_sock.recv(1024)
+                    assert p[4:16] == b"ASC-E1.17\x00\x00\x00"
+                    assert p[113:115] == bytes([0, 7])
+                    # Start code, then the channels
+                    assert p[125:129] == bytes([0, 0, 0, 42])
+
+            assert universes.universes["artnet1"]().frames_sent > 0
+
+            # Both universes share one sender thread
+            assert (
+                universes.universes["artnet1"]().sender.packet
+                in network_output.engine.packets
+            )
+            assert (
+                universes.universes["sacn1"]().sender.packet
+                in network_output.engine.packets
+            )
+
+    finally:
+        board.configured_universes = {}
+        board.cl_create_universes(board.configured_universes)
+        artnet_sock.close()
+        sacn_sock.close()
+
+
+def test_network_output_suppression():
+    "Frames that don't change the DMX bytes shouldn't be resent"
+    p = network_output.ArtNetPacket(16, ("127.0.0.1", 9), 44)
+    now = 1000.0
+    v = numpy.zeros(17)
+
+    # All zeros is the same as the initial packet
+    assert not p.write(v)
+    assert not p.dirty
+
+    v[1] = 10.2
+    assert p.write(v)
+    assert p.dirty
+    assert p.due(now)
+    p.snapshot(now)
+    assert p.tx[18] == 10
+    assert p.frames_sent == 1
+
+    # Rounds to the same byte
+    v[1] = 10.7
+    assert not p.write(v)
+    assert not p.due(now + 0.5 * p.keepalive)
+
+    # Unchanged frames are still resent at the keepalive interval
+    assert p.due(now + p.keepalive)
+    p.snapshot(now + p.keepalive)
+    assert p.keepalives_sent == 1
+    assert p.frames_sent == 1
+
+    # A frame staged to check for changes is sent without converting again
+    v[1] = 20
+    assert p.stage(v)
+    network_output.engine.submit_staged(p)
+    assert p.dirty
+    assert p.data[0] == 20
+
+    # Header changes go through the engine lock
+    network_output.engine.set_port_address(p, 1, 258)
+    assert p.port_address == (1, 258)
+    assert p.buffer[13:16] == bytes([1, 2, 1])
@@ -100,3 +100,140 @@ def test_cooldown_block():
         time.sleep(0.01)
 
     assert abs(ctr - 10) < 2
+
+
+def test_parsed_expression_cache():
+    ctx = scriptbindings.ChandlerScriptContext()
+    ctx.setVar("foo", 2)
+
+    assert ctx.preprocessArgument("=foo * 3") == 6
+    parsed = ctx.parsed_expressions["foo * 3"]
+
+    # Same expression, new values, reuses the parse
+    ctx.setVar("foo", 5)
+    assert ctx.preprocessArgument("=foo * 3") == 15
+    assert ctx.parsed_expressions["foo * 3"] is parsed
+
+    ctx.addBindings([{"event": "test", "commands": []}])
+    assert "foo * 3" not in ctx.parsed_expressions
+
+    assert ctx.eval("foo + 1") == 6
+    ctx.clearBindings()
+    assert not ctx.parsed_expressions
+
+
+def test_event_index():
+    ctx = scriptbindings.ChandlerScriptContext()
+    ctx.setVar("x", 0)
+
+    ctx.addBindings(
+        [
+            {
+                "event": "go",
+                "commands": [{"command": "set", "name": "a", "value": "1"}],
+            },
+            {
+                "event": "=x",
+                "commands": [{"command": "set", "name": "b", "value": "=_"}],
+            },
+            {
+                "event": "go",
+                "commands": [{"command": "set", "name": "c", "value": "2"}],
+            },
+            {
+                "event": "=x",
+                "commands": [{"command": "pass"}],
+            },
+        ]
+    )
+
+    assert [len(i) for i in ctx.event_index.values()] == [2, 2]
+    # Expressions bound more than once are only polled once
+    assert ctx.poll_events == ["=x"]
+
+    assert ctx._event("go", None, 0)
+    assert ctx.variables["a"] == 1
+    assert ctx.variables["c"] == 2
+    assert not ctx._event("nothing_listens", None, 0)
+
+    ctx.setVar("x", 5)
+    ctx.checkPollEvents()
+    ctx.waitForEvents()
+    assert ctx.variables["b"] == 5
+
+    ctx.clearBindings()
+    assert not ctx.event_index
+    assert not ctx.poll_events
+
+
+def test_expression_dependencies():
+    from kaithem.src import tagpoints
+
+    ctx = scriptbindings.ChandlerScriptContext()
+    ctx.setVar("hits", 0)
+    ctx.setVar("x", 1)
+    ctx.setVar("y", 0)
+
+    def count(event: str):
+        return {
+            "event": event,
+            "commands": [
+                {"command": "set", "name": "hits", "value": "=hits + 1"}
+            ],
+        }
+
+    tag = tagpoints.Tag("/sandbox/unit_test_expression_dependencies")
+    tag.value = 0
+
+    ctx.addBindings(
+        [
+            count("=x * 2"),
+            {
+                "event": "=tv('/sandbox/unit_test_expression_dependencies') > 5",
+                "commands": [{"command": "set", "name": "t", "value": "=_"}],
+            },
+            {"event": "=unixtime() > y", "commands": [{"command": "pass"}]},
+        ]
+    )
+    ctx.startTimers()
+    ctx.waitForEvents()
+    hits = ctx.variables["hits"]
+    assert hits
+
+    assert ctx.expression_dependencies["=x * 2"] == {"x"}
+    assert ctx.variable_dependents["$tag:" + tag.name] == {
+        "=tv('/sandbox/unit_test_expression_dependencies') > 5"
+    }
+    assert ctx.expression_dependencies["=unixtime() > y"] == {"y"}
+
+    # Only expressions calling time functions get polled
+    assert ctx.volatile_poll_events == ["=unixtime() > y"]
+    assert ctx.slowpoller
+
+    # Unrelated variables don't rerun anything
+    ctx.setVar("z", 1)
+    ctx.waitForEvents()
+    assert ctx.variables["hits"] == hits
+
+    ctx.setVar("x", 2)
+    ctx.waitForEvents()
+    assert ctx.variables["hits"] == hits + 1
+
+    # Starting timers again only runs expressions added since the last start
+    ctx.addBindings([count("=y + 1")])
+    ctx.waitForEvents()
+    hits = ctx.variables["hits"]
+    ctx.startTimers()
+    ctx.waitForEvents()
+    assert ctx.variables["hits"] == hits + 1
+
+    tag.value = 10
+    for i in range(100):
+        if ctx.variables.get("t") is True:
+            break
+        time.sleep(0.01)
+    assert ctx.variables["t"] is True
+
+    ctx.clearBindings()
+    assert not ctx.variable_dependents
+    assert not ctx.slowpoller
@@ -135,3 +135,221 @@ def test_midi_scanner_does_not_leave_behind_ports():
 
     # TODO could be brittle if other stuff is running
     assert len(list_midi_inputs(force_update=True)) == num
+
+
+def test_widget_update_coalescing():
+    "Rapid widget updates to one connection go out as one message"
+    import asyncio
+    import json
+    import threading
+
+    import msgpack
+
+    from kaithem.src import widgets
+
+    class RecordingSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def send_bytes(self, d):
+            self.sent.append(msgpack.unpackb(d, raw=False))
+
+        async def send_text(self, d):
+            self.sent.append(json.loads(d))
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    try:
+        sock = RecordingSocket()
+        conn = widgets.WebSocketHandler(sock, "__guest__", loop)
+
+        w1 = widgets.DataSource(id="test_coalescing_1")
+        w2 = widgets.DataSource(id="test_coalescing_2")
+        for w in (w1, w2):
+            w.coalesce_updates = True
+            w.subscriptions[conn.connection_id] = widgets.subsc_closure(
+                conn, w.uuid, w
+            )
+            w.subscriptions_atomic = w.subscriptions.copy()
+
+        for i in range(100):
+            w1.send(i)
+            w2.send(-i)
+
+        # Non-widget messages flush pending updates first, to keep order
+        conn.send(json.dumps([["other", 1]]))
+
+        for i in range(100):
+            if len(sock.sent) >= 2:
+                break
+            time.sleep(0.01)
+
+        assert sock.sent == [
+            [["test_coalescing_1", 99], ["test_coalescing_2", -99]],
+            [["other", 1]],
+        ]
+
+        # Updates with nothing else to flush them go out after the window
+        w1.send("x")
+        time.sleep(widgets.COALESCE_WINDOW + 0.2)
+        assert sock.sent[-1] == [["test_coalescing_1", "x"]]
+        assert len(sock.sent) == 3
+
+        # Widgets that don't opt in send every message
+        w3 = widgets.APIWidget(id="test_coalescing_3")
+        w3.subscriptions[conn.connection_id] = widgets.subsc_closure(
+            conn, w3.uuid, w3
+        )
+        w3.subscriptions_atomic = w3.subscriptions.copy()
+        w3.send("a")
+        w3.send("b")
+        for i in range(100):
+            if len(sock.sent) >= 5:
+                break
+            time.sleep(0.01)
+        assert sock.sent[3:] == [
+            [["test_coalescing_3", "a"]],
+            [["test_coalescing_3", "b"]],
+        ]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_widget_slow_consumer():
+    "A stalled websocket keeps bounded buffers and eventually gets closed"
+    import asyncio
+    import threading
+
+    from kaithem.src import widgets
+
+    class StalledSocket:
+        def __init__(self):
+            self.closed = False
+
+        async def send_bytes(self, d):
+            await asyncio.sleep(3600)
+
+        async def send_text(self, d):
+            await asyncio.sleep(3600)
+
+        async def close(self, code=1000):
+            self.closed = True
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    try:
+        sock = StalledSocket()
+        conn = widgets.WebSocketHandler(sock, "__guest__", loop)
+        conn.max_queue_bytes = 100
+        conn.slow_consumer_timeout = 0.5
+
+        w = widgets.DataSource(id="test_slow_consumer")
+        w.coalesce_updates = True
+        w.subscriptions[conn.connection_id] = widgets.subsc_closure(
+            conn, w.uuid, w
+        )
+        w.subscriptions_atomic = w.subscriptions.copy()
+
+        # The first one gets stuck sending
+        w.send(0)
+        for i in range(100):
+            if conn.draining and not conn.pending_updates:
+                break
+            time.sleep(0.01)
+        assert conn.draining
+
+        # Later values only keep the latest
+        for i in range(1, 51):
+            w.send(i)
+        assert conn.pending_updates == {"test_slow_consumer": 50}
+        assert conn.queue_depth == 0
+        assert conn.dropped_messages == 49
+
+        time.sleep(0.6)
+        conn.send("x")
+        assert conn.closed_slow_consumer
+        for i in range(100):
+            if sock.closed:
+                break
+            time.sleep(0.01)
+        assert sock.closed
+        assert conn.queue_depth == 0
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_widget_queue_overflow():
+    """Past the queue limit only superseded widget values are dropped,
+    and if that's not enough the connection is closed"""
+    import asyncio
+    import threading
+
+    from kaithem.src import widgets
+
+    class StalledSocket:
+        def __init__(self):
+            self.closed = False
+
+        async def send_bytes(self, d):
+            await asyncio.sleep(3600)
+
+        async def send_text(self, d):
+            await asyncio.sleep(3600)
+
+        async def close(self, code=1000):
+            self.closed = True
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    try:
+        sock = StalledSocket()
+        conn = widgets.WebSocketHandler(sock, "__guest__", loop)
+        conn.max_queue_bytes = 200
+        conn.slow_consumer_timeout = 0
+
+        w = widgets.DataSource(id="test_overflow_values")
+        w.coalesce_updates = True
+        a = widgets.APIWidget(id="test_overflow_api")
+        for i in (w, a):
+            i.subscriptions[conn.connection_id] = widgets.subsc_closure(
+                conn, i.uuid, i
+            )
+            i.subscriptions_atomic = i.subscriptions.copy()
+
+        w.send(0)
+        for i in range(100):
+            if conn.draining and not conn.pending_updates:
+                break
+            time.sleep(0.01)
+        assert conn.draining
+
+        # API messages pack the pending values ahead of them to keep
+        # the order, so values and API messages are interleaved
+        for i in range(1, 6):
+            w.send(i)
+            a.send(f"event {i}")
+
+        queued = [widgets.msgpack.unpackb(i[0]) for i in conn.sending_queue]
+        api = [i for i in queued if i[0][0] == "test_overflow_api"]
+        values = [i for i in queued if i[0][0] == "test_overflow_values"]
+
+        assert conn.queue_bytes <= 200
+        assert conn.dropped_messages > 0
+        assert not conn.closed_slow_consumer
+        # No API message is ever dropped, and the newest value is kept
+        assert [i[0][1] for i in api] == [f"event {i}" for i in range(1, 6)]
+        assert values[-1] == [["test_overflow_values", 5]]
+
+        # Nothing more can be dropped, so the client has to resync
+        a.send("x" * 100)
+        assert conn.closed_slow_consumer
+        for i in range(100):
+            if sock.closed:
+                break
+            time.sleep(0.01)
+        assert sock.closed
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from kaithem.src import modules_state
+from kaithem.src.modules_interface import search
+
+
+def _event(action: str):
+    return {"resource": {"type": "event"}, "setup": "", "action": action}
+
+
+def test_module_search_index():
+    m = "unit_test_module_search"
+    m2 = "unit_test_module_search_2"
+    modules_state.ActiveModules[m] = {
+        "pump_control": _event("turn_on_pump()"),
+        "lights": _event("set_lights(pump_level)"),
+        "home": {"resource": {"type": "page"}, "body": "Pumphouse status"},
+        "other": {"resource": {"type": "some_plugin_type"}, "x": "pumps"},
+    }
+    modules_state.ActiveModules[m2] = {"pump": _event("")}
+
+    try:
+        # Name matches rank first, prefixes match, all types are indexed
+        r, nxt = search.searchModuleResources(m, "pump")
+        assert r[0] == "pump_control"
+        assert sorted(r) == ["home", "lights", "other", "pump_control"]
+        assert nxt == 0
+
+        # Every word has to match
+        assert search.searchModuleResources(m, "pump lights")[0] == ["lights"]
+        assert search.searchModuleResources(m, "nonexistent")[0] == []
+
+        # Parts of identifiers inside code
+        modules_state.ActiveModules[m2]["level"] = _event(
+            "x = pumpLevel + NumericTag('/a').value + read_sensor2()"
+        )
+        for i in ("level", "tag", "sensor", "2", "pumplevel", "read_sens"):
+            assert search.searchModuleResources(m2, i)[0] == ["level"], i
+        assert search.searchModuleResources(m2, "pump")[0] == [
+            "pump",
+            "level",
+        ]
+
+        # Paging through the ranked results
+        assert search.searchModuleResources(m, "pump", 3, 0)[1] == 3
+        assert search.searchModuleResources(m, "pump", 3, 3) == (
+            [r[3]],
+            0,
+        )
+
+        r, _, nxt = search.searchModules("pump_control")
+        assert (m, ["pump_control"]) in r
+
+        # Changes are picked up by the next search
+        modules_state.ActiveModules[m]["lights"] = _event("set_lights(0)")
+        del modules_state.ActiveModules[m]["pump_control"]
+        assert sorted(search.searchModuleResources(m, "pump")[0]) == [
+            "home",
+            "other",
+        ]
+        modules_state.ActiveModules[m]["new"] = _event("pump_it()")
+        assert "new" in search.searchModuleResources(m, "pump_it")[0]
+    finally:
+        del modules_state.ActiveModules[m]
+        del modules_state.ActiveModules[m2]
+
+    assert search.searchModuleResources(m, "pump")[0] == []
+    assert not search.index.postings.get("pumphouse")
@@ -11,7 +11,7 @@ import weakref
 if "--collect-only" not in sys.argv:  # pragma: no cover
     from kaithem.api import modules as modulesapi
     from kaithem.api import tags
-    from kaithem.src import modules, modules_state
+    from kaithem.src import modules, modules_state, util
     from kaithem.src.plugins import CorePluginEventResources
 
 dir = "/dev/shm/kaithem_tests/"
@@ -148,3 +148,109 @@ def test_make_module():
     assert old_hash == modules_state.getModuleHash(n)
 
     modules.rmModule(n)
+
+
+def test_load_modules_parallel():
+    root = os.path.join(dir, f"parallel_load_{time.time()}")
+    names = [f"parallel_load_test_{i}" for i in range(12)]
+
+    for n in names:
+        os.makedirs(os.path.join(root, n, "folder"))
+        for j in range(5):
+            with open(os.path.join(root, n, "folder", f"r{j}.yaml"), "w") as f:
+                f.write(f"resource:\n  type: test_type\nvalue: {j}\n")
+
+    modules.loadModules(root)
+
+    for n in names:
+        m = modules_state.ActiveModules[n]
+        assert m["folder"] == {"resource": {"type": "directory"}}
+        assert m["folder/r3"]["value"] == 3
+        assert m["folder/r3"]["resource"]["type"] == "test_type"
+        assert "__metadata__" in m
+        assert n in modules_state.scopes
+
+    # Inserted in the same order as loading them one at a time
+    order = [i for i in modules_state.ActiveModules if i in names]
+    assert order == util.get_immediate_subdirectories(root)
+
+    with modules_state.modulesLock:
+        for n in names:
+            del modules_state.ActiveModules[n]
+            del modules_state.scopes[n]
+
+
+def test_resource_cache():
+    import msgpack
+
+    root = os.path.join(dir, f"resource_cache_{time.time()}")
+    os.makedirs(root)
+    for j in range(3):
+        with open(os.path.join(root, f"r{j}.yaml"), "w") as f:
+            f.write(f"resource:\n  type: test_type\nvalue: {j}\n")
+    # Can't be cached exactly, still loads
+    with open(os.path.join(root, "dated.yaml"), "w") as f:
+        f.write("resource:\n  type: test_type\nvalue: 2024-01-01\n")
+
+    m = modules.scanModule(root)
+    assert m["r1"]["value"] == 1
+    cache = modules.loadResourceCache(root)
+    assert sorted(cache) == ["r0.yaml", "r1.yaml", "r2.yaml"]
+
+    # Prove unchanged files come from the cache, by changing only the cache
+    entry = msgpack.unpackb(cache["r1.yaml"][3])
+    entry["value"] = "from cache"
+    cache["r1.yaml"][3] = msgpack.packb(entry)
+    modules.saveResourceCache(root, cache)
+
+    with open(os.path.join(root, "r2.yaml"), "w") as f:
+        f.write("resource:\n  type: test_type\nvalue: changed\n")
+    os.remove(os.path.join(root, "r0.yaml"))
+
+    m = modules.scanModule(root)
+    assert m["r1"]["value"] == "from cache"
+    assert m["r2"]["value"] == "changed"
+    assert "r0" not in m
+    assert str(m["dated"]["value"]) == "2024-01-01"
+    assert sorted(modules.loadResourceCache(root)) == ["r1.yaml", "r2.yaml"]
+
+
+def test_incremental_module_hash():
+    n = f"test_incremental_hash_{time.time()}"
+    root = os.path.join(dir, n)
+    os.makedirs(root)
+    for j in range(3):
+        with open(os.path.join(root, f"r{j}.yaml"), "w") as f:
+            f.write(f"resource:\n  type: test_type\nvalue: {j}\n")
+
+    modules_state.external_module_locations[n] = root
+    try:
+        h = modules_state.hashModule(n)
+        r1 = os.path.join(root, "r1.yaml")
+        r2 = os.path.join(root, "r2.yaml")
+        assert r1 in modules_state.file_digests
+
+        # Prove unchanged files are not read again, by changing the digest
+        real = modules_state.file_digests[r1]
+        modules_state.file_digests[r1] = (real[0], real[1], b"x" * 32)
+        assert modules_state.hashModule(n) != h
+        modules_state.file_digests[r1] = real
+        assert modules_state.hashModule(n) == h
+
+        # Writing a resource forgets just that file's digest
+        modules_state.writeResource(
+            {"resource": {"type": "test_type"}, "value": "changed"},
+            root,
+            "r2",
+        )
+        assert r2 not in modules_state.file_digests
+        assert r1 in modules_state.file_digests
+        h2 = modules_state.hashModule(n)
+        assert h2 != h
+
+        os.remove(r2)
+        h3 = modules_state.hashModule(n)
+        assert r2 not in modules_state.file_digests
+        assert h3 not in (h, h2)
+    finally:
+        modules_state.external_module_locations.pop(n, None)
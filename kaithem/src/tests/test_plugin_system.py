@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import importlib.util
+import os
+import time
+
+from kaithem.src import plugin_system, startup_profile
+
+plugin_code = """
+import quart
+
+from kaithem.src import modules_state, plugin_system, quart_app
+
+
+class Service(plugin_system.BasePluginInterface):
+    service = "unit_test.lazy_service"
+
+
+plugin_services = [Service()]
+
+modules_state.resource_types["unit_test_lazy_type"] = (
+    modules_state.ResourceType("unit_test_lazy_type")
+)
+
+
+@quart_app.app.route("/unit_test_lazy_plugin/hello/<name>", endpoint=__name__)
+def hello(name):
+    return "hello " + name
+"""
+
+plugin_metadata = """
+lazy: true
+resource_types:
+  unit_test_lazy_type:
+    title: Lazy
+routes:
+  - /unit_test_lazy_plugin/
+services:
+  - unit_test.lazy_service
+"""
+
+
+def _add_plugin(name: str):
+    p = os.path.join("/dev/shm/kaithem_tests", f"lazy_plugins_{time.time()}")
+    os.makedirs(p)
+    with open(os.path.join(p, "__init__.py"), "w") as f:
+        f.write(plugin_code)
+    with open(os.path.join(p, "plugin_metadata.yaml"), "w") as f:
+        f.write(plugin_metadata)
+
+    spec = importlib.util.spec_from_file_location(
+        f"kaithem_usr_plugins.{name}",
+        os.path.join(p, "__init__.py"),
+        submodule_search_locations=[p],
+    )
+    assert spec
+    plugin_system.add_lazy_plugin(spec, plugin_system.read_plugin_metadata(p))
+    return spec.name
+
+
+async def test_lazy_plugin():
+    from .helpers import make_client
+
+    name = _add_plugin("unit_test_lazy")
+    assert name not in plugin_system.plugins
+    assert "unit_test_lazy_type" in plugin_system.lazy_resource_types()
+
+    # Routes are only there once a request under the prefix loads it
+    client = await make_client()
+    r = await client.get("/unit_test_lazy_plugin/hello/world")
+    assert r.status_code == 307
+    assert name in plugin_system.plugins
+    assert "unit_test_lazy_type" not in plugin_system.lazy_resource_types()
+    assert plugin_system.get_providers("unit_test.lazy_service")
+
+    r = await client.get("/unit_test_lazy_plugin/hello/world")
+    assert await r.get_data(as_text=True) == "hello world"
+
+    # Nothing to load, not a redirect loop
+    r = await client.get("/unit_test_lazy_plugin/nonexistent/path")
+    assert r.status_code == 404
+
+    rec = [i for i in startup_profile.timings if i[:2] == ("plugin", name)]
+    assert len(rec) == 1
+
+
+def test_lazy_plugin_triggers():
+    from kaithem.src import modules_state
+
+    modules_state.resource_types.pop("unit_test_lazy_type", None)
+    name = _add_plugin("unit_test_lazy_2")
+    plugin_system.require_resource_types(["unrelated_type"])
+    assert name not in plugin_system.plugins
+
+    plugin_system.require_resource_types(["unit_test_lazy_type"])
+    assert name in plugin_system.plugins
+    assert "unit_test_lazy_type" in modules_state.resource_types
+
+    # Real core plugins
+    assert "kaithem.src.plugins.CorePluginEventResources" in (
+        plugin_system.plugins
+    )
+    assert "kaithem.src.plugins.CorePluginSTT" not in plugin_system.plugins
+    assert "mixing_board" in plugin_system.lazy_resource_types()
+    assert "[plugin]" in startup_profile.report()
@@ -0,0 +1,385 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import sqlite3
+import time
+
+import pytest
+
+from kaithem.src import tagpoints
+from kaithem.src.plugins import CorePluginTagHistorian as historian_plugin
+
+
+def _db_path(name: str) -> str:
+    path = f"/dev/shm/kaithem_tests/{name}-{time.time()}.sqlite"
+    if os.path.exists(path):
+        os.remove(path)
+    return path
+
+
+def _logger_for(
+    h: historian_plugin.TagHistorian, tag: tagpoints.GenericTagPointClass
+) -> historian_plugin.TagLogger:
+    logger = historian_plugin.TagLogger(tag, 0, target="ram")
+    # Point it at our own database
+    logger.h = h
+    logger.filename = h.filename
+    logger.getChannelID(tag)
+    return logger
+
+
+def test_historian_migrates_v1_database():
+    path = _db_path("historian_v1")
+
+    # Version 1 schema, as written by older versions
+    conn = sqlite3.Connection(path)
+    conn.execute(
+        """CREATE TABLE channel  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name text, unit text, accumulate text, metadata text)"""
+    )
+    conn.execute(
+        """CREATE TABLE record  (channel INTEGER,
+        time TEXT, value REAL, FOREIGN KEY(channel) REFERENCES channel(id))"""
+    )
+    conn.execute(
+        "INSERT INTO channel VALUES (1, '/test/migrated', '', 'latest', '{}')"
+    )
+    start = 1700000000.25
+    conn.executemany(
+        "INSERT INTO record VALUES (?,?,?)",
+        [
+            (1, historian_plugin.ts_to_iso(start + i), float(i))
+            for i in range(12000)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    h = historian_plugin.TagHistorian(path)
+    assert h.migration_thread
+    h.migration_thread.join(60)
+    assert not h.migration_thread.is_alive()
+    assert not h.legacy_records_pending()
+
+    conn = sqlite3.Connection(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == (
+        historian_plugin.SCHEMA_VERSION
+    )
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    rows = conn.execute(
+        "SELECT time, value FROM record WHERE channel=1 ORDER BY time"
+    ).fetchall()
+    assert len(rows) == 12000
+    assert rows[0] == (start, 0.0)
+    assert rows[-1] == (start + 11999, 11999.0)
+
+    # Migrated records are rolled up too
+    assert conn.execute(
+        "SELECT sum(n) FROM rollup WHERE tier=86400"
+    ).fetchone() == (12000,)
+
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT time,value FROM record "
+        "WHERE time>? AND time<? AND channel=?",
+        (0, 1, 1),
+    ).fetchall()
+    assert "record_channel_time" in str(plan)
+
+    utc = conn.execute(
+        "SELECT UTCTime FROM SimpleViewUTC ORDER BY UTCTime LIMIT 1"
+    ).fetchone()[0]
+    assert utc == "2023-11-14T22:13:20.250Z"
+    conn.close()
+
+    h.close()
+
+
+def test_historian_logger_range():
+    path = _db_path("historian_range")
+    h = historian_plugin.TagHistorian(path)
+    assert h.migration_thread is None
+
+    t = tagpoints.Tag("/system/unit_test_historian_range")
+    t.value = 1
+
+    logger = _logger_for(h, t)
+
+    now = time.time()
+    for i in range(10):
+        h.insertData((logger.chID, now - 100 + i, float(i)))
+    h.flush(True)
+
+    # Not flushed yet, but still found
+    h.insertData((logger.chID, now - 50, 50.0))
+
+    r = logger.getDataRange(now - 95.5, now)
+    assert [i[1] for i in r] == [5.0, 6.0, 7.0, 8.0, 9.0, 50.0]
+    assert isinstance(r[0][0], float)
+
+    r = logger.getRecent(now - 200, now, 3)
+    assert [i[1] for i in r] == [8.0, 9.0, 50.0]
+
+    # Records with the same time aren't lost between read batches
+    n = historian_plugin.EXPORT_CHUNK_ROWS + 10
+    for i in range(n):
+        h.insertData((logger.chID, now - 300, float(i)))
+    h.flush(True)
+    r = list(logger.iterDataRange(now - 300, now - 200))
+    assert sorted(i[1] for i in r) == [float(i) for i in range(n)]
+
+    # Read connections are pooled, and can't write
+    with h.reader() as c1:
+        pass
+    with h.reader() as c2:
+        assert c2 is c1
+        with pytest.raises(sqlite3.OperationalError):
+            c2.execute("DELETE FROM record")
+
+    logger.close()
+    h.close()
+
+
+async def test_historian_aggregates():
+    path = _db_path("historian_aggregates")
+    h = historian_plugin.TagHistorian(path)
+
+    t = tagpoints.Tag("/system/unit_test_historian_aggregates")
+    t.value = 1
+    logger = _logger_for(h, t)
+
+    start = time.time() - 1000
+    for i in range(1000):
+        h.insertData((logger.chID, start + i, float(i % 100)))
+    h.flush(True)
+
+    # One bucket has data from both disk and the pending list
+    h.insertData((logger.chID, start + 950.5, 1000.0))
+
+    r = logger.getAggregates(start, start + 1000, 10)
+    assert len(r) == 10
+    assert [i[0] for i in r] == [start + 100 * i for i in range(10)]
+
+    for i in r[:9]:
+        assert i[1:] == (0.0, 99.0, 49.5, 99.0, 100)
+
+    assert r[9][1:3] == (0.0, 1000.0)
+    assert r[9][4] == 99.0
+    assert r[9][5] == 101
+    assert abs(r[9][3] - (4950 + 1000) / 101) < 0.000001
+
+    # Finer than the data, empty buckets are left out
+    r = logger.getAggregates(start, start + 10, 20)
+    assert [i[4] for i in r] == [float(i) for i in range(10)]
+    assert [i[0] for i in r] == [start + i for i in range(10)]
+
+    assert logger.getAggregates(start + 2000, start + 3000, 10) == []
+
+    from .helpers import make_client
+
+    t.configLoggers["test"] = logger
+    client = await make_client()
+    r = await client.get(
+        "/plugin-tag-history/system/unit_test_historian_aggregates",
+        query_string={"buckets": 10, "start": start, "end": start + 1000},
+    )
+    d = await r.get_json()
+    assert d["type"] == "latest"
+    assert d["count"] == [100] * 9 + [101]
+    assert d["max"][9] == 1000.0
+
+    logger.close()
+    h.close()
+
+
+def test_historian_aggregate_tiers():
+    path = _db_path("historian_aggregate_tiers")
+    h = historian_plugin.TagHistorian(path)
+
+    t = tagpoints.Tag("/system/unit_test_historian_aggregate_tiers")
+    t.value = 1
+    logger = _logger_for(h, t)
+
+    # Six whole hours of data every 10 seconds
+    base = (time.time() // 3600 - 8) * 3600
+    data = [(base + i * 10, float(i * 37 % 101)) for i in range(2160)]
+    for i in data:
+        h.insertData((logger.chID, *i))
+    h.flush(True)
+
+    def from_raw(start, end, buckets):
+        width = (end - start) / buckets
+        acc: dict[int, list[float]] = {}
+        for rt, v in data:
+            if start <= rt < end:
+                acc.setdefault(int((rt - start) / width), []).append(v)
+        return [
+            (start + b * width, min(v), max(v), len(v))
+            for b, v in sorted(acc.items())
+        ]
+
+    # Neither end on a tier boundary, and data before the start
+    start = base + 1800 + 17.3
+    cases = [
+        # Multiples of the minute and hour tiers
+        (start, 20, 600),
+        (start, 2, 7200),
+        (base, 5, 3600),
+        # Not multiples of any tier
+        (start, 30, 100),
+        (start, 40, 90),
+    ]
+
+    for s, buckets, width in cases:
+        r = logger.getAggregates(s, s + buckets * width, buckets)
+        expected = from_raw(s, s + buckets * width, buckets)
+        assert [(i[0], i[1], i[2], i[5]) for i in r] == expected
+
+    # Simulate the raw records expiring.  Tier rows inside
+    # the buckets are still used, but nothing else is.
+    h.run_in_writer(lambda conn: conn.execute("DELETE FROM record"))
+    h.run_in_writer(lambda conn: conn.commit())
+
+    # Nine whole minutes in every bucket
+    r = logger.getAggregates(start, start + 20 * 600, 20)
+    assert [i[5] for i in r] == [54] * 20
+
+    r = logger.getAggregates(base, base + 5 * 3600, 5)
+    assert [i[5] for i in r] == [360] * 5
+
+    assert logger.getAggregates(start, start + 30 * 100, 30) == []
+
+    logger.close()
+    h.close()
+
+
+def test_historian_rollups():
+    path = _db_path("historian_rollups")
+    h = historian_plugin.TagHistorian(path)
+
+    t = tagpoints.Tag("/system/unit_test_historian_rollups")
+    t.value = 1
+    logger = _logger_for(h, t)
+
+    # Three whole hours of data every 10 seconds
+    start = (time.time() // 3600 - 4) * 3600
+    for i in range(1080):
+        h.insertData((logger.chID, start + i * 10, float(i % 360)))
+    # Non numeric values don't get rolled up
+    h.insertData((logger.chID, start + 5, "text"))
+    h.flush(True)
+
+    # Flushing in more than one batch adds to the same rows
+    h.insertData((logger.chID, start + 3599, 1000.0))
+    h.flush(True)
+
+    with h.reader() as conn:
+        counts = dict(
+            conn.execute(
+                "SELECT tier, count(*) FROM rollup WHERE channel=? "
+                "GROUP BY tier",
+                (logger.chID,),
+            ).fetchall()
+        )
+        assert counts == {60: 180, 3600: 3, 86400: counts[86400]}
+
+        hour = conn.execute(
+            "SELECT lo, hi, n, last FROM rollup "
+            "WHERE tier=3600 AND channel=? AND time=?",
+            (logger.chID, start),
+        ).fetchone()
+        assert hour == (0.0, 1000.0, 361, 1000.0)
+
+    from_raw = logger.getAggregates(start, start + 3 * 3600, 3)
+
+    # Simulate the raw records expiring, the rollups are still there
+    h.run_in_writer(lambda conn: conn.execute("DELETE FROM record"))
+    h.run_in_writer(lambda conn: conn.commit())
+
+    from_rollups = logger.getAggregates(start, start + 3 * 3600, 3)
+    assert from_rollups == from_raw
+    assert from_rollups[0][1:] == (
+        0.0,
+        1000.0,
+        (64620 + 1000) / 361,
+        1000.0,
+        361,
+    )
+
+    # Too fine for any tier
+    assert logger.getAggregates(start, start + 600, 20) == []
+
+    logger.close()
+    h.close()
+
+
+async def test_historian_export():
+    import csv
+    import io
+    import math
+
+    import numpy
+
+    from .helpers import make_client
+
+    path = _db_path("historian_export")
+    h = historian_plugin.TagHistorian(path)
+
+    t1 = tagpoints.Tag("/system/unit_test_historian_export_1")
+    t2 = tagpoints.StringTag("/system/unit_test_historian_export_2")
+    l1 = _logger_for(h, t1)
+    l2 = _logger_for(h, t2)
+    t1.configLoggers["test"] = l1
+    t2.configLoggers["test"] = l2
+
+    # More than one chunk, starting on the first of the month
+    start = 1767225600.0
+    for i in range(5000):
+        h.insertData((l1.chID, start + i, float(i)))
+    for i in range(0, 5000, 1000):
+        h.insertData((l2.chID, start + i + 0.5, f"s,{i}"))
+    h.flush(True)
+
+    client = await make_client()
+    form = {
+        "logtime": "2026-01-01T00:00:00",
+        "exportType": "latest",
+        "exportFormat": "csv.iso",
+        "exportTags": "/system/unit_test_historian_export_2",
+    }
+    r = await client.post(
+        "/plugin-tag-history/system/unit_test_historian_export_1", form=form
+    )
+    rows = list(csv.reader(io.StringIO((await r.get_data()).decode())))
+
+    assert rows[0] == [
+        "Time(ISO)",
+        "/system/unit_test_historian_export_1 <accum latest>",
+        "/system/unit_test_historian_export_2 <accum latest>",
+    ]
+    assert len(rows) == 1 + 5000 + 5
+    assert rows[1] == ["2026-01-01T00:00:00.000000Z", "0.0", ""]
+    # Held until the next value
+    assert rows[2] == ["2026-01-01T00:00:00.500000Z", "0.0", "s,0"]
+    assert rows[3] == ["2026-01-01T00:00:01.000000Z", "1.0", "s,0"]
+    assert rows[-1][1:] == ["4999.0", "s,4000"]
+
+    r = await client.post(
+        "/plugin-tag-history/system/unit_test_historian_export_1",
+        form=dict(form, exportFormat="npz", exportRows="3000"),
+    )
+    d = numpy.load(io.BytesIO(await r.get_data()))
+    assert list(d.keys()) == [
+        "time",
+        "system/unit_test_historian_export_1",
+        "system/unit_test_historian_export_2",
+    ]
+    assert [len(i) for i in d.values()] == [3000] * 3
+    assert d["time"][0] == start
+    # Three of the rows are from the other tag
+    assert d["system/unit_test_historian_export_1"][2999] == 2996.0
+    assert math.isnan(d["system/unit_test_historian_export_2"][0])
+
+    l1.close()
+    l2.close()
+    h.close()
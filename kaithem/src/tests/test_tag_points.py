@@ -261,6 +261,99 @@ def test_tags_basic():
     assert abs(t.timestamp - time.time()) < 0.1
 
 
+def test_tag_read_not_blocked_by_subscriber():
+    import threading
+    import time
+
+    from kaithem.src import tagpoints
+
+    t = tagpoints.Tag("/system/unit_test_tag_slow_subscriber")
+    t.value = 1
+
+    in_subscriber = threading.Event()
+    got = []
+
+    def slow(value, timestamp, annotation):
+        in_subscriber.set()
+        time.sleep(0.5)
+
+    def f(value, timestamp, annotation):
+        got.append(value)
+        # Subscribing during dispatch doesn't affect the current push
+        t.subscribe(late)
+
+    def late(value, timestamp, annotation):
+        got.append(("late", value))
+
+    t.subscribe(slow)
+    t.subscribe(f)
+
+    th = threading.Thread(target=lambda: setattr(t, "value", 2))
+    th.start()
+    assert in_subscriber.wait(5)
+
+    # Reads return the new value while the slow subscriber holds the lock
+    s = time.monotonic()
+    assert t.get_vta()[0] == 2
+    assert t.value == 2
+    assert time.monotonic() - s < 0.1
+
+    th.join()
+    assert got == [2]
+    assert t.subscribers == [slow, f, late]
+
+    t.value = 3
+    assert got == [2, 3, ("late", 3)]
+
+    t.unsubscribe(slow)
+    t.unsubscribe(f)
+    t.unsubscribe(late)
+
+
+def test_tag_async_subscriber():
+    import threading
+    import time
+
+    from kaithem.src import tagpoints
+
+    t = tagpoints.Tag("/system/unit_test_tag_async_subscriber")
+    t.value = 1
+
+    release = threading.Event()
+    got = []
+
+    def slow(value, timestamp, annotation):
+        got.append(value)
+        release.wait(5)
+
+    t.subscribe(slow, asynchronous=True)
+    assert t.subscribers == [slow]
+
+    t.value = 2
+    s = time.monotonic()
+    while not got and time.monotonic() - s < 5:
+        time.sleep(0.01)
+    assert got == [2]
+
+    # Setting never waits for the subscriber, which is still busy with 2
+    s = time.monotonic()
+    for i in range(3, 50):
+        t.value = i
+    assert time.monotonic() - s < 0.5
+
+    release.set()
+    s = time.monotonic()
+    while len(got) < 2 and time.monotonic() - s < 5:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    # Intermediate values were coalesced into the latest one
+    assert got == [2, 49]
+
+    t.unsubscribe(slow)
+    assert t.subscribers == []
+
+
 def test_tags_claim_release():
     import time
 
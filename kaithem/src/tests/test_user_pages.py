@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import types
+
+from kaithem.src import modules_state
+from kaithem.src.plugins import CorePluginUserPageResources as userpages
+
+
+def _page(body: str, **kw):
+    d = {
+        "resource": {"type": "page"},
+        "body": body,
+        "template_engine": "jinja2",
+        "require_method": ["GET", "POST"],
+    }
+    d.update(kw)
+    return d
+
+
+async def test_user_page_output_cache():
+    module = "unit_test_user_pages"
+    modules_state.scopes[module] = types.SimpleNamespace()
+
+    renders = []
+
+    userpages.updateOnePage(
+        "cached",
+        module,
+        _page(
+            "{{ render() }} {{ kwargs.get('x', '') }}",
+            code="render = lambda: renders.append(1) or len(renders)",
+            cache_seconds=60,
+        ),
+    )
+    userpages.updateOnePage(
+        "uncached",
+        module,
+        _page("{{ render() }}", code="render = lambda: renders.append(1)"),
+    )
+
+    # The page code can't see this test's locals, so provide it in the
+    # page scope, which is where setup code variables go.
+    for i in ("cached", "uncached"):
+        userpages._pages_by_module_resource[module][i].scope["renders"] = (
+            renders
+        )
+
+    client = userpages.app.test_client()
+
+    r = await client.get(f"/pages/{module}/cached")
+    assert r.status_code == 200
+    assert (await r.get_data()) == b"1 "
+    etag = r.headers["ETag"]
+
+    # Served from the cache
+    r = await client.get(f"/pages/{module}/cached")
+    assert (await r.get_data()) == b"1 "
+    assert len(renders) == 1
+
+    r = await client.get(
+        f"/pages/{module}/cached", headers={"If-None-Match": etag}
+    )
+    assert r.status_code == 304
+
+    # Different args are cached separately
+    r = await client.get(f"/pages/{module}/cached", query_string={"x": "y"})
+    assert (await r.get_data()) == b"2 y"
+
+    userpages._pages_by_module_resource[module]["cached"].localAPI.clear_cache()
+    r = await client.get(f"/pages/{module}/cached")
+    assert (await r.get_data()) == b"3 "
+
+    for i in range(2):
+        r = await client.get(f"/pages/{module}/uncached")
+        assert "ETag" not in r.headers
+    assert len(renders) == 5
+
+    # Updating the page discards its cache
+    userpages.updateOnePage("cached", module, _page("new", cache_seconds=60))
+    r = await client.get(f"/pages/{module}/cached")
+    assert (await r.get_data()) == b"new"
+
+    userpages.removeModulePages(module)
+    del modules_state.scopes[module]
@@ -24,7 +24,7 @@ import msgpack
 from kaithem.src.validation_util import validate_args
 
 from kaithem.api import lifespan
-from . import auth, messagebus, pages, workers
+from . import auth, messagebus, pages, settings_overrides, workers
 from http.cookies import SimpleCookie
 
 logger = structlog.get_logger(__name__)
@@ -131,6 +131,37 @@ class ClientInfo:
         self.cookie = cookie
 
 
+# Widget updates to a connection within this many seconds
+# are coalesced into one message, keeping only the latest value per widget
+COALESCE_WINDOW = 0.01
+
+MAX_QUEUE_SETTING = "core/websocket_max_queue_kb"
+SLOW_CONSUMER_SETTING = "core/websocket_slow_consumer_timeout"
+
+settings_overrides.set_description(
+    MAX_QUEUE_SETTING,
+    "Max KiB of messages buffered per websocket, default 8192. Past this, "
+    "widget values that have newer ones queued are dropped, and if that "
+    "is not enough the connection is closed so the client resyncs.",
+)
+settings_overrides.set_description(
+    SLOW_CONSUMER_SETTING,
+    "Close websockets that can't send anything for this many seconds, "
+    "default 60. 0 to never close them.",
+)
+
+
+def get_send_queue_limits() -> tuple[int, float]:
+    "Max queued bytes and slow consumer timeout for new connections"
+    try:
+        max_kb = float(settings_overrides.get_val(MAX_QUEUE_SETTING) or 8192)
+        timeout = float(settings_overrides.get_val(SLOW_CONSUMER_SETTING) or 60)
+    except ValueError:
+        logger.exception("Invalid websocket queue setting")
+        return 8192 * 1024, 60.0
+    return int(max_kb * 1024), timeout
+
+
 lastLoggedUserError = 0
 
 lastPrintedUserError = 0
@@ -159,6 +190,12 @@ def subsc_closure(self: WebSocketHandler, widgetid: str, widget: Widget):
             else:
                 logger.exception("Error sending data from websocket")
 
+    def queue_update(value: Any):
+        self.queue_update(widgetid, value)
+
+    # Widget.send uses this instead of sending a message per update
+    f.queue_update = queue_update
+
     return f
 
 
@@ -264,7 +301,29 @@ class WebSocketHandler:
         self.batteryStatus = None
         self.cookie = dict[str, Any] | None
 
-        self.sending_queue: list[str | bytes] = []
+        # Encoded messages waiting for the event loop to send them, with
+        # the IDs of the widgets in them if they are coalesced updates,
+        # and widget updates not yet encoded, by widget ID.
+        # All protected by send_lock
+        self.sending_queue: collections.deque[
+            tuple[str | bytes, frozenset[str | int] | None]
+        ] = collections.deque()
+        self.pending_updates: dict[str | int, Any] = {}
+        self.send_lock = threading.Lock()
+        self.flush_scheduled = False
+        self.draining = False
+        self.drain_future = None
+
+        # Limits, and metrics shown on the user page
+        self.max_queue_bytes, self.slow_consumer_timeout = (
+            get_send_queue_limits()
+        )
+        self.queue_bytes = 0
+        self.dropped_messages = 0
+        self.last_send_progress = time.monotonic()
+        self.closed_slow_consumer = False
+        # Set when the queue is full of things that can't be dropped
+        self.queue_overflowed = False
 
         self.loop = loop
 
@@ -297,17 +356,209 @@ class WebSocketHandler:
         if v[0] == self.user and v[1] in self.usedPermissions:
             self.closeUnderLock()
 
+    @property
+    def queue_depth(self) -> int:
+        "Number of encoded messages waiting to be sent"
+        return len(self.sending_queue)
+
     def send(self, b: bytes | str):
-        async def f():
-            d = self.sending_queue.pop(0)
-            if isinstance(d, str):
-                await self.parent.send_text(d)
+        if self.closed_slow_consumer:
+            return
+        with self.send_lock:
+            # Anything coalescing goes first so messages stay in order
+            self._pack_pending_updates()
+            self._enqueue(b)
+        self._check_queue_overflow()
+        self._wake_sender()
+        self._check_slow_consumer()
+
+    def queue_update(self, widget_id: str | int, value: Any):
+        """Queue a widget value to be sent along with any other
+        updates in the next COALESCE_WINDOW. If the widget already
+        has a value queued it is replaced.
+
+        While the client is still receiving earlier messages,
+        updates stay here instead of being queued behind them,
+        so a slow client only ever gets the latest values."""
+        if self.closed_slow_consumer:
+            return
+        with self.send_lock:
+            if widget_id in self.pending_updates and self.draining:
+                self.dropped_messages += 1
+            self.pending_updates[widget_id] = value
+            if self.flush_scheduled or self.draining:
+                return
+            self.flush_scheduled = True
+
+        self.loop.call_soon_threadsafe(
+            self.loop.call_later, COALESCE_WINDOW, self._flush_updates
+        )
+        self._check_slow_consumer()
+
+    def _flush_updates(self):
+        with self.send_lock:
+            self.flush_scheduled = False
+            # If a send is in progress, the drain loop picks these
+            # up when it catches up.
+            if self.draining:
+                return
+            self._pack_pending_updates()
+        self._check_queue_overflow()
+        self._wake_sender()
+
+    def _pack_pending_updates(self):
+        "Must be called with send_lock held"
+        if not self.pending_updates:
+            return
+
+        updates = [[k, v] for k, v in self.pending_updates.items()]
+        ids = frozenset(self.pending_updates)
+        self.pending_updates.clear()
+
+        try:
+            d = msgpack.packb(updates, use_bin_type=True)
+        except Exception:
+            # Don't let one unencodable value lose the whole batch
+            good = []
+            for i in updates:
+                try:
+                    msgpack.packb(i, use_bin_type=True)
+                    good.append(i)
+                except Exception:
+                    logger.exception(f"Could not encode value for {i[0]}")
+            d = msgpack.packb(good, use_bin_type=True)
+
+        # Very basic saniy check here
+        if len(d) > 32 * 1024 * 1024:
+            logger.error("Widget data is too large, refusing to send")
+            return
+        self._enqueue(d, ids)
+
+    def _enqueue(
+        self, d: str | bytes, widget_ids: frozenset[str | int] | None = None
+    ):
+        """Must be called with send_lock held. widget_ids is only for
+        coalesced updates, which can be dropped if newer values for all
+        the same widgets are queued. Nothing else ever gets dropped."""
+        self.sending_queue.append((d, widget_ids))
+        self.queue_bytes += len(d)
+
+        # Always keep the newest one, even if it's over on its own
+        if (
+            self.queue_bytes <= self.max_queue_bytes
+            or len(self.sending_queue) < 2
+        ):
+            return
+
+        self._drop_superseded_updates()
+        if self.queue_bytes > self.max_queue_bytes:
+            self.queue_overflowed = True
+
+    def _drop_superseded_updates(self):
+        "Drop the oldest coalesced updates that newer ones fully replace"
+        newer = set(self.pending_updates)
+        superseded: set[int] = set()
+        for n, (_d, ids) in enumerate(reversed(self.sending_queue)):
+            if ids is None:
+                continue
+            if n and ids <= newer:
+                superseded.add(len(self.sending_queue) - 1 - n)
+            newer |= ids
+
+        if not superseded:
+            return
+
+        kept: collections.deque[
+            tuple[str | bytes, frozenset[str | int] | None]
+        ] = collections.deque()
+        for n, i in enumerate(self.sending_queue):
+            if n in superseded and self.queue_bytes > self.max_queue_bytes:
+                self.queue_bytes -= len(i[0])
+                self.dropped_messages += 1
             else:
-                await self.parent.send_bytes(d)
+                kept.append(i)
+        self.sending_queue = kept
 
-        self.sending_queue.append(b)
+    def _check_queue_overflow(self):
+        if self.queue_overflowed:
+            self._close_slow_consumer(
+                "too much queued that could not be dropped"
+            )
+
+    def _wake_sender(self):
+        with self.send_lock:
+            if self.draining or not self.sending_queue:
+                return
+            self.draining = True
+            self.last_send_progress = time.monotonic()
         # TIL this can actually run in the same thread it seems like?
+        self.drain_future = asyncio.run_coroutine_threadsafe(
+            self._drain(), self.loop
+        )
+
+    async def _drain(self):
+        "Send everything in the queue, one coroutine per connection"
+        try:
+            while True:
+                with self.send_lock:
+                    if not self.sending_queue:
+                        self._pack_pending_updates()
+                    if not self.sending_queue:
+                        self.draining = False
+                        return
+                    d = self.sending_queue.popleft()[0]
+                    self.queue_bytes -= len(d)
+
+                if isinstance(d, str):
+                    await self.parent.send_text(d)
+                else:
+                    await self.parent.send_bytes(d)
+                self.last_send_progress = time.monotonic()
+        except Exception:
+            # The connection is gone, nothing queued will ever get sent
+            with self.send_lock:
+                self.sending_queue.clear()
+                self.pending_updates.clear()
+                self.queue_bytes = 0
+                self.draining = False
+            raise
+
+    def _check_slow_consumer(self):
+        "Disconnect if sending has been stuck for too long"
+        if not self.slow_consumer_timeout or not self.draining:
+            return
+        stuck = time.monotonic() - self.last_send_progress
+        if stuck < self.slow_consumer_timeout:
+            return
+        self._close_slow_consumer(f"nothing could be sent for {round(stuck)}s")
+
+    def _close_slow_consumer(self, reason: str):
+        """Close the connection and discard everything queued.
+        The client reconnects and gets current values."""
+        with self.send_lock:
+            if self.closed_slow_consumer:
+                return
+            self.closed_slow_consumer = True
+            self.sending_queue.clear()
+            self.pending_updates.clear()
+            self.queue_bytes = 0
+
+        logger.warning(
+            f"Closing websocket from {self.peer_address} for user "
+            f"{self.user}, {reason}"
+        )
+
+        if self.drain_future:
+            self.drain_future.cancel()
+
+        async def f():
+            try:
+                await self.parent.close(code=1008)
+            except Exception:
+                logger.exception("Error closing slow websocket")
+
         asyncio.run_coroutine_threadsafe(f(), self.loop)
+        self.closeUnderLock()
 
     def sl_close_all_subscriptions(self, *a: Any) -> None:
         with subscriptionLock:
@@ -776,6 +1027,11 @@ class Widget:
         self.echo: bool = True
         self.noOnConnectData: bool = False
 
+        # If True, each value replaces the last, so websocket connections
+        # may skip values sent in quick succession and only send the latest.
+        # Only safe for widgets whose messages are not events or deltas.
+        self.coalesce_updates: bool = False
+
         self.uuid: int | str
 
         self.metadata: dict[str, str | int | float | bool] = {}
@@ -952,11 +1208,7 @@ class Widget:
         if not x:
             return
 
-        d = msgpack.packb([[self.uuid, value]], use_bin_type=True)
-
-        # Very basic saniy check here
-        if len(d) > 32 * 1024 * 1024:
-            raise ValueError("Data is too large, refusing to send")
+        d = None
 
         # Yes, I really had a KeyError here.
         # Somehow the dict was replaced with the new version in the middle of iteration
@@ -964,8 +1216,23 @@ class Widget:
         for i in x:
             if i == exclude_connection_id:
                 continue
+            # Websocket connections batch updates and encode them
+            # themselves, only encode here for everything else.
+            queue_update = None
+            if self.coalesce_updates:
+                queue_update = getattr(x[i], "queue_update", None)
+
+            if d is None and not queue_update:
+                d = msgpack.packb([[self.uuid, value]], use_bin_type=True)
+                # Very basic saniy check here
+                if len(d) > 32 * 1024 * 1024:
+                    raise ValueError("Data is too large, refusing to send")
+
             try:
-                x[i](d, value)
+                if queue_update:
+                    queue_update(value)
+                else:
+                    x[i](d, value)
             except Exception:
                 print("WS Send Error ", traceback.format_exc())
 